@@ -0,0 +1,197 @@
+"""
+Priority admission control for the API.
+Every request belongs to an endpoint class with its own concurrency limit and
+queue-time deadline, all sharing one overall in-flight budget. When a slot frees
+up, waiters of the highest-priority class go first, so checkouts and room
+assignments keep their latency while status polling and analytics are shed
+with 429 + Retry-After instead of piling up behind them.
+"""
+import asyncio
+import json
+import math
+import time
+from collections import deque
+
+# (name, concurrency limit, max queue wait in ms), highest priority first
+DEFAULT_CLASSES = (
+    ("checkout", 64, 2000.0),
+    ("assignment", 48, 1000.0),
+    ("status", 16, 250.0),
+    ("analytics", 4, 250.0),
+)
+
+
+def parse_classes(spec: str) -> tuple:
+    """'checkout=64:2000,status=16:250' -> (('checkout', 64, 2000.0), ('status', 16, 250.0)), in the given order."""
+    classes = []
+    for part in spec.split(","):
+        name, _, limits = part.strip().partition("=")
+        limit, _, max_wait_ms = limits.partition(":")
+        try:
+            classes.append((name, int(limit), float(max_wait_ms)))
+        except ValueError:
+            raise ValueError(f"Invalid admission class '{part}' (expected name=limit:max_wait_ms)")
+    return tuple(classes)
+
+
+class Overloaded(Exception):
+    def __init__(self, endpoint_class: str, reason: str, retry_after: int):
+        super().__init__(f"Too many {endpoint_class} requests in progress ({reason}); retry in {retry_after}s")
+        self.endpoint_class = endpoint_class
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class EndpointClass:
+    __slots__ = ("name", "priority", "limit", "max_wait", "max_queue", "in_flight", "waiters",
+                 "admitted", "shed_queue_full", "shed_deadline", "service_time")
+
+    def __init__(self, name: str, priority: int, limit: int, max_wait_ms: float):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = limit * 4
+        self.in_flight = 0
+        self.waiters = deque()  # Futures of queued requests, oldest first
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_deadline = 0
+        self.service_time = 0.05  # Moving average of seconds per request, for Retry-After
+
+
+class AdmissionController:
+    """
+    Grants request slots on the event loop. A request is:
+      admitted at once if its class is under its limit, the overall budget
+        (`capacity`) has room, and no request is queued ahead of it (of its own
+        class, or of a higher class that is waiting only for overall budget);
+      queued otherwise, and admitted in priority order as slots are released;
+      shed with 429 if its class's queue is already full, or if it is still
+        queued when its class's max wait runs out.
+    """
+    def __init__(self, classes=DEFAULT_CLASSES, capacity: int = 64):
+        self.capacity = capacity
+        self.classes = {name: EndpointClass(name, priority, limit, max_wait_ms)
+                        for priority, (name, limit, max_wait_ms) in enumerate(classes)}
+        self._by_priority = sorted(self.classes.values(), key=lambda c: c.priority)
+        self.in_flight = 0
+
+    def _can_admit(self, endpoint_class: EndpointClass) -> bool:
+        return endpoint_class.in_flight < endpoint_class.limit and self.in_flight < self.capacity
+
+    def _queued_ahead(self, endpoint_class: EndpointClass) -> bool:
+        """Whether requests of this class, or of a higher one held back only by the overall budget, are waiting."""
+        return bool(endpoint_class.waiters) or any(
+            c.waiters and c.in_flight < c.limit for c in self._by_priority[:endpoint_class.priority])
+
+    def _admit(self, endpoint_class: EndpointClass):
+        endpoint_class.in_flight += 1
+        endpoint_class.admitted += 1
+        self.in_flight += 1
+
+    def retry_after(self, endpoint_class: EndpointClass) -> int:
+        """Seconds until the class has likely worked through its current backlog."""
+        backlog = endpoint_class.in_flight + len(endpoint_class.waiters)
+        return min(30, max(1, math.ceil(endpoint_class.service_time * backlog / max(endpoint_class.limit, 1))))
+
+    async def acquire(self, name: str) -> tuple:
+        """Waits for a slot; returns a ticket for release() or raises Overloaded."""
+        endpoint_class = self.classes[name]
+        if self._can_admit(endpoint_class) and not self._queued_ahead(endpoint_class):
+            self._admit(endpoint_class)
+            return endpoint_class, time.perf_counter()
+        if len(endpoint_class.waiters) >= endpoint_class.max_queue:
+            endpoint_class.shed_queue_full += 1
+            raise Overloaded(name, "queue full", self.retry_after(endpoint_class))
+
+        future = asyncio.get_running_loop().create_future()
+        endpoint_class.waiters.append(future)
+        try:
+            await asyncio.wait_for(future, endpoint_class.max_wait)
+        except asyncio.TimeoutError:
+            endpoint_class.shed_deadline += 1
+            raise Overloaded(name, "queue deadline passed", self.retry_after(endpoint_class))
+        except asyncio.CancelledError:
+            # Client went away while queued; give back a slot that was granted meanwhile
+            if future.done() and not future.cancelled():
+                self.release((endpoint_class, time.perf_counter()))
+            raise
+        finally:
+            if not future.done() or future.cancelled():
+                try:
+                    endpoint_class.waiters.remove(future)
+                except ValueError:
+                    pass
+        return endpoint_class, time.perf_counter()
+
+    def release(self, ticket: tuple):
+        endpoint_class, started_at = ticket
+        endpoint_class.in_flight -= 1
+        self.in_flight -= 1
+        endpoint_class.service_time += 0.1 * (time.perf_counter() - started_at - endpoint_class.service_time)
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hands free slots to queued requests, highest priority first."""
+        for endpoint_class in self._by_priority:
+            waiters = endpoint_class.waiters
+            while waiters and self._can_admit(endpoint_class):
+                future = waiters.popleft()
+                if not future.done():
+                    self._admit(endpoint_class)
+                    future.set_result(None)
+            if self.in_flight >= self.capacity:
+                return
+
+    def stats(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "in_flight": self.in_flight,
+            "classes": {
+                c.name: {
+                    "priority": c.priority,
+                    "limit": c.limit,
+                    "max_wait_ms": c.max_wait * 1000,
+                    "in_flight": c.in_flight,
+                    "queued": len(c.waiters),
+                    "admitted": c.admitted,
+                    "shed": c.shed_queue_full + c.shed_deadline,
+                    "shed_queue_full": c.shed_queue_full,
+                    "shed_deadline": c.shed_deadline,
+                }
+                for c in self._by_priority
+            },
+        }
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware holding an admission slot for the whole request, including a
+    streamed response body. `classify(method, path)` names the endpoint class, or
+    returns None for requests that bypass admission (health probes, long-lived streams).
+    """
+    def __init__(self, app, controller: AdmissionController, classify):
+        self.app = app
+        self.controller = controller
+        self.classify = classify
+
+    async def __call__(self, scope, receive, send):
+        name = self.classify(scope["method"], scope["path"]) if scope["type"] == "http" else None
+        if name is None:
+            return await self.app(scope, receive, send)
+        try:
+            ticket = await self.controller.acquire(name)
+        except Overloaded as e:
+            body = json.dumps({"detail": str(e)}).encode()
+            await send({"type": "http.response.start", "status": 429, "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(e.retry_after).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(ticket)
@@ -1,100 +1,42 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, ConfigDict, ValidationError
 from datetime import datetime, timedelta
+import asyncio
+import concurrent.futures
 import json
 import os
+import numpy as np
 import pandas as pd
 import uvicorn
 import random
+import secrets
+import tempfile
+import threading
+import time
 import uuid
+from decouple import config
 
-from models import DurationPredictor, AnomalyDetector
-from db_integration import load_item_database_from_db, load_historical_sessions_from_db, save_session_to_db
-
-# --- Updated Room Management Component ---
-
-class RoomManager:
-    """
-    Manages the state of fitting rooms with intelligent assignment.
-    """
-    def __init__(self, total_rooms: int = 2): # CHANGED: total_rooms from 6 to 2
-        self.total_rooms = total_rooms
-        self.rooms = {f"room_{i+1}": {"status": "available", "session_id": None, "entry_time": None, "predicted_duration": None} for i in range(total_rooms)}
-        print(f"✓ RoomManager initialized for {total_rooms} rooms.")
-
-    def _get_expected_release_time(self, room_data: dict) -> datetime:
-        """Calculates when an occupied room is expected to be free."""
-        if room_data['status'] == 'occupied' and room_data['entry_time'] and room_data['predicted_duration']:
-            return room_data['entry_time'] + timedelta(minutes=room_data['predicted_duration'])
-        return datetime.now() # If available, it's free now
-
-    def assign_room_intelligently(self, session_id: str, new_session_duration: float) -> dict:
-        """
-        Assigns a room using a 'Best Fit' strategy to minimize the new session's end time.
-        """
-        best_option = {
-            "room_id": None,
-            "final_end_time": datetime.max, # Initialize with a very late time
-            "wait_time_minutes": float('inf'),
-            "is_immediate": False
-        }
-
-        now = datetime.now()
-
-        for room_id, data in self.rooms.items():
-            expected_release_time = self._get_expected_release_time(data)
-
-            # Start time for the new session is either now (if room is free) or when it becomes free.
-            start_time = max(now, expected_release_time)
-
-            end_time = start_time + timedelta(minutes=new_session_duration)
-
-            if end_time < best_option["final_end_time"]:
-                best_option["room_id"] = room_id
-                best_option["final_end_time"] = end_time
-                best_option["wait_time_minutes"] = max(0, (expected_release_time - now).total_seconds() / 60)
-
-        # A room will always be found, but we need to check if the assignment is immediate.
-        if best_option["room_id"]:
-            is_immediate = best_option["wait_time_minutes"] < 0.1 # Small tolerance for immediate
-
-            # If the best option is to wait for an occupied room, but there IS an empty one,
-            # we should double-check if taking the empty one is better. The logic already handles this by finding the minimum end_time.
-
-            # Formally assign the room if the assignment is immediate
-            if is_immediate:
-                self.rooms[best_option["room_id"]] = {
-                    "status": "occupied",
-                    "session_id": session_id,
-                    "entry_time": now,
-                    "predicted_duration": new_session_duration
-                }
-                print(f"  [RoomManager] Intelligently assigned {best_option['room_id']} to session {session_id} (Immediate)")
-            else:
-                # In a real system, you'd place this in a queue. For now, we'll just inform the user.
-                print(f"  [RoomManager] Best option for session {session_id} is to wait for {best_option['room_id']}")
-
-            return {
-                "assigned_room_id": best_option["room_id"],
-                "wait_time_minutes": round(best_option["wait_time_minutes"], 2),
-                "is_immediate": is_immediate
-            }
-
-        return {} # Should not happen
-
-    def release_room(self, room_id: str) -> bool:
-        if room_id not in self.rooms:
-            print(f"  [RoomManager] Error: Attempted to release non-existent room {room_id}")
-            return False
-        if self.rooms[room_id]["status"] == "available":
-            print(f"  [RoomManager] Warning: Room {room_id} was already available.")
-
-        self.rooms[room_id] = {"status": "available", "session_id": None, "entry_time": None, "predicted_duration": None}
-        print(f"  [RoomManager] Released {room_id}. It is now available.")
-        return True
-
-    def get_status(self) -> dict:
-        return self.rooms
+from model_registry import ModelRegistry, ModelFileWatcher
+from rooms import RoomManager, RoomStateBackend
+from shared_rooms import SQLiteRoomManager
+from room_stream import RoomStreamHub, RESYNC, format_sse
+from batch_assign import AssignmentBatcher
+from admission import DEFAULT_CLASSES, AdmissionController, AdmissionMiddleware, parse_classes
+from coalescer import InferenceCoalescer
+from profiler import RequestProfiles, RequestProfilerMiddleware, StackSampler, format_collapsed
+from metrics import MetricsMiddleware, mark_validated, monitor_loop_lag, record_stage, registry as metrics_registry, timed
+from idempotency import IdempotencyCache, IdempotencyConflict
+from forecast import DEFAULT_QUANTILES, DurationDistributions, forecast_waits
+from remaining_time import RemainingTimeEstimator
+from sessions import SessionStore
+from scans import ReaderMap, ScanIngestor
+from overstay import DEFAULT_TIERS, OverstayMonitor, parse_tiers
+from db_integration import (load_item_updates_since, load_historical_sessions_from_db, save_session_to_db,
+                            save_overstay_alerts, save_missing_item_alerts)
+from catalog import Catalog, BasketFeatureCache, CatalogRefresher
+from logs import get_logger
 
 # --- App Initialization, Analytics Helpers, etc. (No Changes) ---
 app = FastAPI(
@@ -104,23 +46,73 @@ app = FastAPI(
 # ... (SimplePeakTimePredictor and SimpleDailyStatsCalculator are unchanged) ...
 
 # --- Global Variables ---
-duration_model: DurationPredictor = None
-anomaly_model: AnomalyDetector = None
-item_database: dict = {}
+db_log = get_logger("Database")  # Per-request events; prints are kept for startup
+scan_log = get_logger("ScanIngestor")
+model_registry: ModelRegistry = None
+model_watcher: ModelFileWatcher = None
+catalog: Catalog = Catalog()  # Item catalog; read catalog.items once per request
+feature_cache: BasketFeatureCache = BasketFeatureCache(catalog)
+catalog_refresher: CatalogRefresher = None
+historical_sessions: pd.DataFrame | None = None  # Loaded lazily by get_historical_sessions()
+historical_sessions_lock = threading.Lock()
+startup_state: dict = {"stage": "starting", "error": None, "startup_seconds": None}
+startup_task: asyncio.Task = None
 # Removed peak_predictor and daily_stats_calculator
-room_manager: RoomManager = None
+room_manager: RoomStateBackend = None
+room_stream: RoomStreamHub = None  # Pushes room changes to /rooms/stream clients
+assignment_batcher: AssignmentBatcher = None  # Set when ASSIGN_BATCH_WINDOW_MS > 0
+duration_distributions = DurationDistributions()  # Feature rows of recent sessions, for /rooms/forecast
+session_store = SessionStore()  # Sessions started by /assign_room, completed by /sessions/{id}/complete
+duration_coalescer: InferenceCoalescer = None  # Batch concurrent model calls; None when INFERENCE_BATCH_WAIT_MS=0
+anomaly_coalescer: InferenceCoalescer = None
+scan_ingestor: ScanIngestor = None  # Deduplicates raw RFID reads posted to /scans/ingest
+overstay_monitor: OverstayMonitor = None  # Raises overstay alerts (leader worker only); disabled with OVERSTAY_MONITOR=false
+executor: concurrent.futures.ThreadPoolExecutor = None  # Default executor of the event loop
+loop_lag_task: asyncio.Task = None
+completions = IdempotencyCache(  # Replays responses to retried /detect_anomaly and /sessions/{id}/complete calls
+    max_entries=config('IDEMPOTENCY_MAX_ENTRIES', default=10000, cast=int),
+    ttl_seconds=config('IDEMPOTENCY_TTL_SECONDS', default=3600.0, cast=float),
+)
+
+# --- Admission Control ---
+def admission_class(method: str, path: str) -> str | None:
+    """Endpoint class of a request; None for requests that are never queued or shed."""
+    if path.startswith(("/health/", "/debug/")) or path in ("/metrics", "/rooms/stream", "/admission/stats", "/models/reload"):
+        return None
+    if path == "/detect_anomaly" or path == "/scans/ingest" or (path.startswith("/sessions/") and path.endswith("/complete")):
+        return "checkout"
+    if path in ("/assign_room", "/predict_duration") or (path.startswith("/waitlist/") and method == "DELETE"):
+        return "assignment"
+    if path in ("/", "/rooms/status", "/rooms/forecast", "/waitlist", "/alerts/overstay") or path.startswith("/waitlist/"):
+        return "status"
+    return "analytics"  # /detect_anomaly/batch, stats and catalog endpoints
+
+admission_classes = config('ADMISSION_CLASSES', default='')
+admission = AdmissionController(parse_classes(admission_classes) if admission_classes else DEFAULT_CLASSES,
+                                capacity=config('ADMISSION_MAX_IN_FLIGHT', default=64, cast=int))
+if config('ADMISSION_CONTROL', default=True, cast=bool):
+    app.add_middleware(AdmissionMiddleware, controller=admission, classify=admission_class)
+request_profiles = RequestProfiles(rate=config('PROFILE_REQUEST_RATE', default=0.0, cast=float))
+stack_sampler = StackSampler()
+app.add_middleware(RequestProfilerMiddleware, profiles=request_profiles)
+app.add_middleware(MetricsMiddleware)  # Outermost, so shed requests are timed too
 
 # --- Pydantic Models ---
 class AssignRoomRequest(BaseModel):
     item_ids: list[str]
+    required_features: list[str] = []  # e.g. ["accessible"]; only rooms having all of them qualify
+    priority: int = 0  # Higher priority is served first from the waitlist
 
 class AssignRoomResponse(BaseModel): # CHANGED: More informative response
-    status: str # "assigned", "wait"
+    status: str # "assigned", "wait" (queued on the waitlist; poll /waitlist/{session_id})
     message: str
     assigned_room_id: str | None = None
     session_id: str | None = None
     predicted_duration_minutes: float | None = None
     estimated_wait_minutes: float = 0.0
+    waitlist_position: int | None = None
+    model_version: str | None = None
+    model_config = ConfigDict(protected_namespaces=())  # Allow the model_version field
 
 # ... (Other Pydantic models are unchanged) ...
 class PredictDurationRequest(BaseModel):
@@ -128,6 +120,8 @@ class PredictDurationRequest(BaseModel):
     entry_time: datetime
 class PredictDurationResponse(BaseModel):
     predicted_duration_minutes: float
+    model_version: str | None = None
+    model_config = ConfigDict(protected_namespaces=())  # Allow the model_version field
 class DetectAnomalyRequest(BaseModel):
     session_id: str
     room_id: str
@@ -136,54 +130,228 @@ class DetectAnomalyRequest(BaseModel):
     entry_scans: list[str]
     exit_scans: list[str]
     entry_time: datetime
+class AnomalyBatchRecord(BaseModel):
+    session_id: str
+    actual_duration: float
+    predicted_duration: float
+    entry_scans: list[str]
+    exit_scans: list[str]
+    entry_time: datetime
+    room_id: str | None = None  # Accepted for convenience; no room is released
 class AnomalyDetectionResponse(BaseModel):
     session_id: str
     is_anomaly: bool
     anomaly_score: float
     risk_level: str
+    model_version: str | None = None
+    model_config = ConfigDict(protected_namespaces=())  # Allow the model_version field
+class CompleteSessionRequest(BaseModel):
+    exit_scans: list[str] | None = None   # Defaults to the exit reads ingested through /scans/ingest
+    entry_scans: list[str] | None = None  # Defaults to ingested entry reads, else the item_ids given to /assign_room
+    exit_time: datetime | None = None     # Defaults to now
+class CompleteSessionResponse(AnomalyDetectionResponse):
+    room_id: str
+    actual_duration_minutes: float
+    predicted_duration_minutes: float
+    missing_items: list[str]
+class ReloadModelsRequest(BaseModel):
+    force: bool = False
 
 # --- API Lifecycle Events ---
-@app.on_event("startup")
-async def startup_event():
-
-    global duration_model, anomaly_model, item_database, room_manager
-    print("API Startup: Loading models and data from database...")
-    room_manager = RoomManager(total_rooms=2)
-    
-    # Load item database from PostgreSQL database
+def load_item_database() -> tuple:
+    """
+    Loads the item catalog from PostgreSQL, falling back to the JSON file.
+    Returns (items, watermark); the watermark is None for the JSON fallback.
+    """
     try:
-        item_database = load_item_database_from_db()
-        print(f"✓ Loaded {len(item_database)} items from database.")
+        items, watermark = load_item_updates_since(None)
+        print(f"✓ Loaded {len(items)} items from database.")
+        return items, watermark
     except Exception as e:
         print(f"⚠ Error loading from database: {e}")
         print("⚠ Falling back to JSON file...")
         item_db_path = 'data/item_database.json'
         if os.path.exists(item_db_path):
             with open(item_db_path, 'r') as f:
-                item_database = json.load(f)
-            print(f"✓ Loaded {len(item_database)} items from JSON file.")
-        else:
-            raise RuntimeError(f"Item database not found in database or JSON file. Please ensure database is set up.")
-    
-    try:
-        duration_model = DurationPredictor.load()
-    except FileNotFoundError:
-        raise RuntimeError("Duration model not found. Run train.py first.")
+                items = json.load(f)
+            print(f"✓ Loaded {len(items)} items from JSON file.")
+            return items, None
+        raise RuntimeError(f"Item database not found in database or JSON file. Please ensure database is set up.")
+
+def get_historical_sessions() -> pd.DataFrame:
+    """
+    Returns the historical session history, loading it on first use from PostgreSQL,
+    falling back to the CSV file. Nothing on the serving path needs it, so it is
+    kept off the startup path.
+    """
+    global historical_sessions
+    if historical_sessions is not None:
+        return historical_sessions
+    with historical_sessions_lock:
+        if historical_sessions is None:
+            try:
+                historical_sessions = load_historical_sessions_from_db()
+                print(f"✓ Loaded {len(historical_sessions)} historical sessions from database.")
+            except Exception as e:
+                print(f"⚠ Warning: Could not load historical sessions from database: {e}")
+                sessions_path = 'data/historical_sessions.csv'
+                if os.path.exists(sessions_path):
+                    print("⚠ Falling back to CSV file...")
+                    historical_sessions = pd.read_csv(sessions_path)
+                    print(f"✓ Loaded {len(historical_sessions)} historical sessions from CSV file.")
+                else:
+                    print("⚠ Analytics will be limited.")
+                    historical_sessions = pd.DataFrame(columns=['session_id', 'entry_time', 'exit_time', 'item_ids', 'entry_scans', 'exit_scans', 'duration'])
+    return historical_sessions
+
+def create_room_manager() -> RoomStateBackend:
+    """
+    Builds the room state backend from ROOM_CONFIG (a JSON list of {"room_id", "features"})
+    if set, otherwise from ROOM_COUNT plain rooms.
+    ROOM_STATE_BACKEND=memory (default) keeps state in this process; sqlite shares it
+    through the ROOM_STATE_PATH file so several API workers can serve /assign_room.
+    """
+    room_config_path = config('ROOM_CONFIG', default='')
+    layout = {"total_rooms": config('ROOM_COUNT', default=2, cast=int)}
+    if room_config_path:
+        with open(room_config_path, 'r') as f:
+            layout = {"rooms": json.load(f)}
+
+    backend = config('ROOM_STATE_BACKEND', default='memory').lower()
+    if backend == 'sqlite':
+        return SQLiteRoomManager(config('ROOM_STATE_PATH', default='room_state.db'), **layout)
+    if backend != 'memory':
+        raise ValueError(f"Unknown ROOM_STATE_BACKEND '{backend}' (expected 'memory' or 'sqlite')")
+    return RoomManager(**layout)
+
+def create_overstay_monitor() -> OverstayMonitor:
+    """
+    Watches every occupied room and writes an 'overstay' alert each time a session
+    passes a multiple of its predicted duration (OVERSTAY_TIERS, e.g. "1.5:medium,2:high").
+    With the sqlite backend every worker runs one, and they elect a single leader
+    through a lease in the shared file, so each alert is written once.
+    """
+    tiers = config('OVERSTAY_TIERS', default='')
+    return OverstayMonitor(
+        room_manager,
+        emit=save_overstay_alerts,
+        tiers=parse_tiers(tiers) if tiers else DEFAULT_TIERS,
+        min_excess_minutes=config('OVERSTAY_MIN_EXCESS_MINUTES', default=5.0, cast=float),
+        poll_interval=config('OVERSTAY_POLL_INTERVAL', default=5.0, cast=float),
+    )
+
+def attach_remaining_time_estimator():
+    """
+    Builds the remaining-time curves from historical sessions and hands them to the
+    room manager, so rooms that overrun their prediction get a fresh release estimate.
+    """
     try:
-        anomaly_model = AnomalyDetector.load()
-    except FileNotFoundError:
-        raise RuntimeError("Anomaly model not found. Run train.py first.")
-    
-    # Load historical sessions from database (optional, for analytics)
+        estimator = RemainingTimeEstimator.from_sessions(get_historical_sessions())
+        room_manager.remaining_estimator = estimator
+        print(f"✓ Remaining-time curves built from {estimator.sessions} historical sessions.")
+    except Exception as e:
+        print(f"⚠ Remaining-time curves unavailable, overrunning rooms keep their original estimate: {e}")
+
+async def load_service_state():
+    """
+    Loads everything the serving path needs. The catalog and both pickles are
+    independent, so they load concurrently; the warm-up batch needs both and runs last.
+    """
+    global model_watcher, catalog_refresher
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
     try:
-        sessions_df = load_historical_sessions_from_db()
-        print(f"✓ Loaded {len(sessions_df)} historical sessions from database.")
+        startup_state["stage"] = "loading"
+        items_future = loop.run_in_executor(None, load_item_database)
+        artifacts_future = loop.run_in_executor(None, model_registry.load_artifacts)
+        try:
+            (items, watermark), artifacts = await asyncio.gather(items_future, artifacts_future)
+        except FileNotFoundError:
+            raise RuntimeError("Duration or anomaly model not found. Run train.py first.")
+        catalog.replace(items, watermark)
+
+        startup_state["stage"] = "warming_up"
+        bundle = await loop.run_in_executor(None, model_registry.build_bundle, artifacts)
+        model_registry.publish(bundle)
+
+        watch_interval = config('MODEL_WATCH_INTERVAL', default=30.0, cast=float)
+        if watch_interval > 0:
+            model_watcher = ModelFileWatcher(model_registry, interval=watch_interval)
+            model_watcher.start()
+
+        refresh_interval = config('CATALOG_REFRESH_INTERVAL', default=60.0, cast=float)
+        if refresh_interval > 0:
+            catalog_refresher = CatalogRefresher(
+                catalog,
+                interval=refresh_interval,
+                channel=config('CATALOG_NOTIFY_CHANNEL', default='') or None
+            )
+            catalog_refresher.start()
+
+        startup_state["stage"] = "ready"
+        startup_state["startup_seconds"] = round(time.perf_counter() - started, 3)
+        print(f"API Startup complete in {startup_state['startup_seconds']}s.")
+
+        # Not needed to serve; runs after readiness so a slow history load never delays it
+        await loop.run_in_executor(None, attach_remaining_time_estimator)
     except Exception as e:
-        print(f"⚠ Warning: Could not load historical sessions from database: {e}")
-        print("⚠ Analytics will be limited.")
-        sessions_df = pd.DataFrame(columns=['session_id', 'entry_time', 'exit_time', 'item_ids', 'entry_scans', 'exit_scans', 'duration'])
+        startup_state["stage"] = "failed"
+        startup_state["error"] = str(e)
+        print(f"❌ API Startup failed: {e}")
+
+@app.on_event("startup")
+async def startup_event():
+    global model_registry, room_manager, room_stream, assignment_batcher, overstay_monitor, scan_ingestor, startup_task
+    global duration_coalescer, anomaly_coalescer, executor, loop_lag_task
+    print("API Startup: Loading models and data from database...")
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=config('EXECUTOR_WORKERS', default=min(32, (os.cpu_count() or 1) + 4), cast=int),
+        thread_name_prefix="api-worker")
+    asyncio.get_running_loop().set_default_executor(executor)
+    loop_lag_task = asyncio.create_task(monitor_loop_lag(config('LOOP_LAG_INTERVAL', default=0.25, cast=float)))
+    room_manager = create_room_manager()
+    room_stream = RoomStreamHub(room_manager, poll_interval=config('ROOM_STREAM_POLL_INTERVAL', default=0.5, cast=float))
+    room_stream.start()
+    reader_config_path = config('READER_CONFIG', default='')
+    scan_ingestor = ScanIngestor(room_manager, session_store.interner,
+                                 ReaderMap.from_file(reader_config_path) if reader_config_path else ReaderMap(),
+                                 dedup_window=config('SCAN_DEDUP_WINDOW_SECONDS', default=2.0, cast=float),
+                                 known_skus=lambda: catalog.items)
+    if config('OVERSTAY_MONITOR', default=True, cast=bool):
+        overstay_monitor = create_overstay_monitor()
+        overstay_monitor.start()
+    batch_window_ms = config('ASSIGN_BATCH_WINDOW_MS', default=0, cast=float)
+    if batch_window_ms > 0:
+        assignment_batcher = AssignmentBatcher(room_manager, batch_window_ms,
+                                               config('ASSIGN_BATCH_MAX', default=64, cast=int))
+        print(f"✓ Batched room assignment enabled ({batch_window_ms:g} ms window)")
+    inference_wait_ms = config('INFERENCE_BATCH_WAIT_MS', default=2.0, cast=float)
+    if inference_wait_ms > 0:
+        inference_max = config('INFERENCE_BATCH_MAX', default=64, cast=int)
+        duration_coalescer = InferenceCoalescer(
+            "duration", lambda bundle, X: bundle.duration_model.predict_batch(X), inference_max, inference_wait_ms)
+        anomaly_coalescer = InferenceCoalescer(
+            "anomaly", lambda bundle, X: bundle.anomaly_model.predict_with_score_batch(X), inference_max, inference_wait_ms)
+    model_registry = ModelRegistry(item_database_provider=lambda: catalog.items)
+    # Load in the background so /health/live answers while models are still loading;
+    # /health/ready flips once the service can serve at full speed.
+    startup_task = asyncio.create_task(load_service_state())
+
 
-    print("API Startup complete.")
+@app.on_event("shutdown")
+async def shutdown_event():
+    if startup_task and not startup_task.done():
+        startup_task.cancel()
+    if model_watcher:
+        model_watcher.stop()
+    if catalog_refresher:
+        catalog_refresher.stop()
+    if room_stream:
+        await room_stream.stop()
+    if overstay_monitor:
+        overstay_monitor.stop()
+    if loop_lag_task:
+        loop_lag_task.cancel()
 
 
 # --- Endpoints ---
@@ -191,74 +359,307 @@ async def startup_event():
 async def read_root():
     return {"message": "Welcome to the Smart Fitting Room AI/ML API. Visit /docs for API documentation."}
 
+@app.get("/health/live")
+async def liveness_endpoint():
+    """Liveness probe: the process is up and the event loop is responsive."""
+    if startup_state["stage"] == "failed":
+        raise HTTPException(status_code=503, detail=f"Startup failed: {startup_state['error']}")
+    return {"status": "alive", "stage": startup_state["stage"]}
+
+@app.get("/health/ready")
+async def readiness_endpoint():
+    """Readiness probe: catalog and warmed-up models are loaded, so requests are served at full speed."""
+    bundle = model_registry.current if model_registry else None
+    if startup_state["stage"] != "ready" or not bundle or not room_manager:
+        raise HTTPException(status_code=503, detail=f"Not ready: {startup_state['stage']}")
+    return {
+        "status": "ready",
+        "model_version": bundle.version,
+        "items": len(catalog),
+        "startup_seconds": startup_state["startup_seconds"],
+    }
+
 @app.post("/assign_room", response_model=AssignRoomResponse)
 async def assign_room_endpoint(request: AssignRoomRequest):
     """
     Intelligently assigns a fitting room to minimize wait times and maximize throughput.
     """
-    if not duration_model or not room_manager:
+    bundle = model_registry.current if model_registry else None
+    if not bundle or not room_manager:
         raise HTTPException(status_code=503, detail="Duration model or Room Manager not initialized.")
+    mark_validated()
 
     # 1. Predict duration
+    now = datetime.now()
     try:
-        features = duration_model.extract_features(request.item_ids, item_database, datetime.now())
-        predicted_duration = duration_model.predict(features)
+        with timed("features"):
+            features = feature_cache.duration_features(request.item_ids, now)
+        predicted_duration = await predict_duration(bundle, features)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error predicting duration for assignment: {e}")
 
     # 2. Generate a session ID
     session_id = str(uuid.uuid4())
+    duration_distributions.remember(session_id, features)
 
-    # 3. Get the best room assignment option
-    assignment = room_manager.assign_room_intelligently(session_id, predicted_duration)
+    # 3. Get the best room assignment option (jointly with other arrivals when batching)
+    with timed("room_op"):
+        if assignment_batcher:
+            assignment = await assignment_batcher.submit(
+                session_id, predicted_duration, request.required_features, request.priority, len(request.item_ids)
+            )
+        else:
+            assignment = room_manager.assign_room_intelligently(
+                session_id, predicted_duration, request.required_features, request.priority, len(request.item_ids)
+            )
+    if not assignment:
+        raise HTTPException(status_code=422, detail=f"No fitting room has all of the features {request.required_features}.")
+    immediate = assignment["is_immediate"]
+    session_store.start(session_id, request.item_ids, predicted_duration,
+                        assignment['assigned_room_id'] if immediate else None, now if immediate else None,
+                        created_at=now, model_version=bundle.version)
 
-    if assignment["is_immediate"]:
+    if immediate:
         return AssignRoomResponse(
             status="assigned",
             message=f"Please proceed to {assignment['assigned_room_id']}.",
             assigned_room_id=assignment['assigned_room_id'],
             session_id=session_id,
             predicted_duration_minutes=round(float(predicted_duration), 2),
-            estimated_wait_minutes=0.0
+            estimated_wait_minutes=0.0,
+            model_version=bundle.version
         )
     else:
-        wait_minutes = assignment['wait_time_minutes']
+        wait_minutes = assignment['wait_time_minutes'] or 0.0
         return AssignRoomResponse(
             status="wait",
-            message=f"All rooms are occupied. The best option is {assignment['assigned_room_id']}, available in approximately {wait_minutes:.1f} minutes.",
-            assigned_room_id=assignment['assigned_room_id'], # We still provide the target room
+            message=f"All rooms are occupied. You are number {assignment['waitlist_position']} on the waitlist; "
+                    f"{assignment['assigned_room_id']} is expected to be free for you in approximately {wait_minutes:.1f} minutes.",
+            assigned_room_id=assignment['assigned_room_id'], # Room reserved for this customer; may change if another frees up first
             session_id=session_id,
             predicted_duration_minutes=round(float(predicted_duration), 2),
-            estimated_wait_minutes=wait_minutes
+            estimated_wait_minutes=wait_minutes,
+            waitlist_position=assignment['waitlist_position'],
+            model_version=bundle.version
         )
 
 
+async def predict_duration(bundle, features) -> float:
+    """Duration prediction for one feature row, batched with concurrent requests when coalescing is on."""
+    with timed("inference"):
+        if duration_coalescer:
+            return float(await duration_coalescer.submit(bundle, features))
+        # Off the event loop, so other requests keep being served during the sklearn call
+        return await asyncio.get_running_loop().run_in_executor(None, bundle.duration_model.predict, features)
+
+async def score_anomaly(bundle, features) -> dict:
+    """Anomaly result for one feature row, batched with concurrent requests when coalescing is on."""
+    with timed("inference"):
+        if anomaly_coalescer:
+            return await anomaly_coalescer.submit(bundle, features)
+        return await asyncio.get_running_loop().run_in_executor(None, bundle.anomaly_model.predict_with_score, features)
+
+
+def room_status_etag(version: int) -> str:
+    return f'"{room_manager.feed_epoch}-{version}"'
+
 @app.get("/rooms/status")
-async def get_room_status_endpoint():
-    """Returns the current status of all fitting rooms."""
+async def get_room_status_endpoint(request: Request):
+    """
+    Returns the current status of all fitting rooms.
+    The ETag carries the room change feed version; send it back in If-None-Match
+    to get a bodiless 304 while nothing has changed.
+    """
     if not room_manager:
         raise HTTPException(status_code=503, detail="Room Manager not initialized.")
-    return room_manager.get_status()
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and if_none_match == room_status_etag(room_manager.status_version()):
+        return Response(status_code=304, headers={"ETag": if_none_match})
+    version, status = room_manager.get_status_versioned()
+    return JSONResponse(jsonable_encoder(status), headers={"ETag": room_status_etag(version)})
+
+@app.get("/rooms/stream")
+async def room_stream_endpoint(request: Request):
+    """
+    Server-Sent Events stream of room changes. Starts with a "snapshot" event
+    holding every room, then sends one "room" event per assign or release.
+    Reconnecting clients send Last-Event-ID and only receive what they missed.
+    """
+    if not room_manager or not room_stream:
+        raise HTTPException(status_code=503, detail="Room Manager not initialized.")
+
+    async def events():
+        queue = room_stream.subscribe()  # Before the snapshot, so no change falls in between
+        try:
+            version, missed = None, None
+            last_event_id = request.headers.get("last-event-id", "")
+            epoch, _, last_version = last_event_id.rpartition("-")
+            if epoch == room_manager.feed_epoch and last_version.isdigit():
+                missed = room_manager.changes_since(int(last_version))
+            if missed is not None:
+                version = int(last_version)
+                queue.put_nowait(missed)
+            else:
+                queue.put_nowait(RESYNC)
+
+            while not await request.is_disconnected():
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is RESYNC:
+                    version, status = room_manager.get_status_versioned()
+                    yield format_sse("snapshot", {"version": version, "rooms": jsonable_encoder(status)},
+                                     f"{room_manager.feed_epoch}-{version}")
+                    continue
+                for change in item if isinstance(item, list) else [item]:
+                    if change["version"] <= version:
+                        continue  # Already covered by the snapshot or replay
+                    version = change["version"]
+                    yield format_sse("room", change, f"{room_manager.feed_epoch}-{version}")
+        finally:
+            room_stream.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/rooms/forecast")
+async def room_forecast_endpoint(samples: int = 2000, quantiles: str = "", required_features: str = ""):
+    """
+    Wait-time forecast with uncertainty. Samples each occupied room's remaining time
+    and each waiting customer's duration from the duration forest's per-tree
+    predictions and rolls the queue out `samples` times. Returns quantiles of every
+    waiting customer's wait, of each room's remaining time, and of the wait a new
+    customer (with the comma-separated required_features) would face joining now.
+    """
+    bundle = model_registry.current if model_registry else None
+    if not bundle or not room_manager:
+        raise HTTPException(status_code=503, detail="Duration model or Room Manager not initialized.")
+    try:
+        levels = tuple(float(q) for q in quantiles.split(",")) if quantiles else DEFAULT_QUANTILES
+    except ValueError:
+        raise HTTPException(status_code=422, detail="quantiles must be comma-separated numbers between 0 and 1.")
+    if not all(0 <= q <= 1 for q in levels):
+        raise HTTPException(status_code=422, detail="quantiles must be between 0 and 1.")
+
+    status = room_manager.get_status()
+    waitlist = room_manager.get_waitlist()
+    occupied = [record["session_id"] for record in status.values() if record["status"] == "occupied"]
+    per_tree = duration_distributions.per_tree(bundle, occupied + [t["session_id"] for t in waitlist])
+
+    def samples_for(session_id, predicted):
+        # Sessions assigned by another worker or before a restart only have their point prediction
+        return per_tree.get(session_id, np.array([float(predicted or 0.0)]))
+
+    rooms = [{"room_id": room_id, "features": record["features"],
+              "entry_time": record["entry_time"] if record["status"] == "occupied" else None,
+              "samples": samples_for(record["session_id"], record["predicted_duration"])}
+             for room_id, record in status.items()]
+    queue = [{"session_id": t["session_id"], "required_features": t["required_features"],
+              "samples": samples_for(t["session_id"], t["predicted_duration_minutes"])}
+             for t in waitlist]
+    new_customer = [f for f in required_features.split(",") if f]
+    return forecast_waits(rooms, queue, datetime.now(), n_samples=max(100, min(samples, 20000)),
+                          quantiles=levels, new_customer_features=new_customer)
+
+@app.get("/alerts/overstay")
+async def overstay_alerts_endpoint():
+    """Overstay monitor state and the most recent overstay alerts it raised."""
+    if not overstay_monitor:
+        raise HTTPException(status_code=503, detail="Overstay monitor is disabled.")
+    return {**overstay_monitor.describe(), "recent_alerts": list(overstay_monitor.recent)[::-1]}
+
+@app.get("/waitlist")
+async def get_waitlist_endpoint():
+    """Returns the waiting customers in service order with their estimated waits."""
+    if not room_manager:
+        raise HTTPException(status_code=503, detail="Room Manager not initialized.")
+    return room_manager.get_waitlist()
+
+@app.get("/waitlist/{session_id}")
+async def get_waitlist_ticket_endpoint(session_id: str):
+    """
+    Polls a waitlist ticket. Once a matching room is released the ticket is promoted
+    automatically and its status becomes "assigned" with the room to go to.
+    """
+    if not room_manager:
+        raise HTTPException(status_code=503, detail="Room Manager not initialized.")
+    ticket = room_manager.get_ticket(session_id)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail=f"No waitlist ticket for session {session_id}.")
+    return ticket
+
+@app.delete("/waitlist/{session_id}")
+async def cancel_waitlist_ticket_endpoint(session_id: str):
+    """Removes a waiting customer from the waitlist."""
+    if not room_manager:
+        raise HTTPException(status_code=503, detail="Room Manager not initialized.")
+    ticket = room_manager.cancel_ticket(session_id)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail=f"No waitlist ticket for session {session_id}.")
+    if ticket["status"] == "assigned":
+        raise HTTPException(status_code=409, detail=f"Session {session_id} was already assigned {ticket['room_id']}.")
+    session_store.pop(session_id)
+    if scan_ingestor:
+        scan_ingestor.forget(session_id)
+    return ticket
+
 @app.post("/predict_duration", response_model=PredictDurationResponse)
 async def predict_duration_endpoint(request: PredictDurationRequest):
     """
     Predicts the expected duration (in minutes) for a fitting room session
     based on the items taken and entry time. This prediction is crucial for anomaly detection.
     """
-    if not duration_model or not duration_model.is_trained:
+    bundle = model_registry.current if model_registry else None
+    if not bundle or not bundle.duration_model.is_trained:
         raise HTTPException(status_code=503, detail="Duration model not loaded or trained.")
+    mark_validated()
     if not request.item_ids:
-        return PredictDurationResponse(predicted_duration_minutes=5.0)
+        return PredictDurationResponse(predicted_duration_minutes=5.0, model_version=bundle.version)
     try:
-        features = duration_model.extract_features(
-            request.item_ids,
-            item_database,
-            request.entry_time
+        with timed("features"):
+            features = feature_cache.duration_features(request.item_ids, request.entry_time)
+        predicted_duration = await predict_duration(bundle, features)
+        return PredictDurationResponse(
+            predicted_duration_minutes=round(float(predicted_duration), 2),
+            model_version=bundle.version
         )
-        predicted_duration = duration_model.predict(features)
-        return PredictDurationResponse(predicted_duration_minutes=round(float(predicted_duration), 2))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error predicting duration: {e}")
+def save_completed_session(session_id: str, room_id: str, entry_time: datetime, exit_time: datetime,
+                           entry_scans: list, exit_scans: list, predicted_duration: float, result: dict):
+    """Saves a scored session for training; a database failure is logged, never raised."""
+    started_at = time.perf_counter()
+    try:
+        # Extract room_id number from room_id string (e.g., "room_1" -> 1)
+        room_id_num = None
+        if room_id:
+            try:
+                room_id_num = int(room_id.split('_')[-1])
+            except:
+                pass
+
+        save_session_to_db(
+            session_id=session_id,
+            room_id=room_id_num,
+            customer_rfid=None,  # Can be extracted from request if available
+            entry_time=entry_time,
+            exit_time=exit_time,
+            item_ids=entry_scans,  # All items entered
+            entry_scans=entry_scans,
+            exit_scans=exit_scans,
+            predicted_duration=predicted_duration,
+            is_anomaly=result['is_anomaly'],
+            anomaly_score=result['anomaly_score'],
+            risk_level=result['risk_level']
+        )
+    except Exception as db_error:
+        # Continue even if database save fails
+        db_log.warning("session_save_failed", session_id=session_id, error=db_error)
+    finally:
+        record_stage("db_write", time.perf_counter() - started_at)
+
 @app.post("/detect_anomaly", response_model=AnomalyDetectionResponse)
 async def detect_anomaly_endpoint(request: DetectAnomalyRequest):
     """
@@ -266,55 +667,452 @@ async def detect_anomaly_endpoint(request: DetectAnomalyRequest):
     This is the core security endpoint, identifying potential theft indicators.
     Upon completion, the associated room_id is made available again.
     Saves session data to database for AI training.
+    A retry with the same session_id and body gets the first response back without
+    being scored, saved or released again; a different body for it gets 409.
     """
-    if not anomaly_model or not room_manager:
+    bundle = model_registry.current if model_registry else None
+    if not bundle or not room_manager:
         raise HTTPException(status_code=503, detail="Anomaly model or Room Manager not loaded.")
+    mark_validated()
+    try:
+        return await completions.run(("detect_anomaly", request.session_id), request.dict(),
+                                     lambda: detect_anomaly(bundle, request))
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+async def detect_anomaly(bundle, request: DetectAnomalyRequest) -> AnomalyDetectionResponse:
     try:
         session_data = request.dict()
-        features = anomaly_model.extract_features(session_data)
-        result = anomaly_model.predict_with_score(features)
+        with timed("features"):
+            features = bundle.anomaly_model.extract_features(session_data)
+        result = await score_anomaly(bundle, features)
         
         # Calculate exit time
         entry_time = request.entry_time
         if isinstance(entry_time, str):
             entry_time = datetime.fromisoformat(entry_time.replace('Z', '+00:00'))
         exit_time = entry_time + timedelta(minutes=request.actual_duration)
-        
+
         # Save session to database for training
-        try:
-            # Extract room_id number from room_id string (e.g., "room_1" -> 1)
-            room_id_num = None
-            if request.room_id:
-                try:
-                    room_id_num = int(request.room_id.split('_')[-1])
-                except:
-                    pass
-            
-            save_session_to_db(
-                session_id=request.session_id,
-                room_id=room_id_num,
-                customer_rfid=None,  # Can be extracted from request if available
-                entry_time=entry_time,
-                exit_time=exit_time,
-                item_ids=request.entry_scans,  # All items entered
-                entry_scans=request.entry_scans,
-                exit_scans=request.exit_scans,
-                predicted_duration=request.predicted_duration,
-                is_anomaly=result['is_anomaly'],
-                anomaly_score=result['anomaly_score'],
-                risk_level=result['risk_level']
-            )
-        except Exception as db_error:
-            print(f"⚠ Warning: Could not save session to database: {db_error}")
-            # Continue even if database save fails
-        
-        room_manager.release_room(request.room_id)
+        save_completed_session(request.session_id, request.room_id, entry_time, exit_time, request.entry_scans,
+                               request.exit_scans, request.predicted_duration, result)
+
+        # Only frees the room if this session still holds it, never someone else's booking
+        with timed("room_op"):
+            room_manager.release_room(request.room_id, request.session_id)
+        session_store.pop(request.session_id)
         return AnomalyDetectionResponse(
             session_id=request.session_id,
             is_anomaly=result['is_anomaly'],
             anomaly_score=result['anomaly_score'],
-            risk_level=result['risk_level']
+            risk_level=result['risk_level'],
+            model_version=bundle.version
         )
     except Exception as e:
-        room_manager.release_room(request.room_id)
+        room_manager.release_room(request.room_id, request.session_id)
         raise HTTPException(status_code=500, detail=f"Error detecting anomaly: {e}. Room has been force-released.")
+
+
+def score_anomaly_chunk(bundle, records: list) -> str:
+    """Validates and scores one chunk of batch records; returns their NDJSON lines."""
+    lines = [None] * len(records)
+    valid, positions = [], []
+    for i, record in enumerate(records):
+        try:
+            valid.append(AnomalyBatchRecord.parse_obj(record).dict())
+            positions.append(i)
+        except ValidationError as e:
+            session_id = record.get("session_id") if isinstance(record, dict) else None
+            lines[i] = json.dumps({"session_id": session_id, "error": str(e).replace("\n", " ")})
+    if valid:
+        features = bundle.anomaly_model.extract_features_batch(valid)
+        for i, record, result in zip(positions, valid, bundle.anomaly_model.predict_with_score_batch(features)):
+            lines[i] = json.dumps({"session_id": record["session_id"], **result, "model_version": bundle.version})
+    return "\n".join(lines) + "\n"
+
+@app.post("/detect_anomaly/batch")
+async def detect_anomaly_batch_endpoint(request: Request, chunk_size: int = 500):
+    """
+    Scores many completed sessions for reconciliation, e.g. a whole day, without
+    any side effect: nothing is saved and no room is released. Accepts a JSON list
+    of /detect_anomaly bodies, or NDJSON (Content-Type: application/x-ndjson), one
+    session per line. Results stream back as NDJSON in input order, one line per
+    session ({"session_id", "error"} for invalid records), `chunk_size` sessions at a
+    time. NDJSON bodies are spooled to a temporary file (on disk beyond 8 MB) and
+    read back line by line, so memory use does not grow with the size of the request.
+    """
+    bundle = model_registry.current if model_registry else None
+    if not bundle:
+        raise HTTPException(status_code=503, detail="Anomaly model not loaded.")
+    chunk_size = max(1, min(chunk_size, 10000))
+    loop = asyncio.get_running_loop()
+    # The body is read in full before responding: once the response streams,
+    # Starlette listens on the same channel for disconnects
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        spool = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+        async for data in request.stream():
+            spool.write(data)
+        spool.seek(0)
+        records = (json.loads(line) for line in spool if line.strip())
+    else:
+        spool = None
+        try:
+            records = await request.json()
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Malformed JSON: {e}")
+        if not isinstance(records, list):
+            raise HTTPException(status_code=422, detail="Expected a JSON list of sessions.")
+
+    async def results():
+        chunk = []
+        try:
+            for record in records:
+                chunk.append(record)
+                if len(chunk) >= chunk_size:
+                    yield await loop.run_in_executor(None, score_anomaly_chunk, bundle, chunk)
+                    chunk = []
+        except ValueError as e:
+            # Unparseable NDJSON line: score what came before it, then stop
+            if chunk:
+                yield await loop.run_in_executor(None, score_anomaly_chunk, bundle, chunk)
+            yield json.dumps({"session_id": None, "error": f"Malformed NDJSON line: {e}"}) + "\n"
+            return
+        finally:
+            if spool:
+                spool.close()
+        if chunk:
+            yield await loop.run_in_executor(None, score_anomaly_chunk, bundle, chunk)
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@app.post("/sessions/{session_id}/complete", response_model=CompleteSessionResponse)
+async def complete_session_endpoint(session_id: str, request: CompleteSessionRequest):
+    """
+    Completes a session started with /assign_room from its exit scans alone.
+    The basket, predicted duration, room and entry time are already known to the
+    API, so the checkout is scored without the client echoing them back, and the
+    room is released. Sessions assigned by another API worker or before a restart
+    are unknown here (404) and must use /detect_anomaly. Retries are answered like
+    those of /detect_anomaly.
+    """
+    bundle = model_registry.current if model_registry else None
+    if not bundle or not room_manager:
+        raise HTTPException(status_code=503, detail="Anomaly model or Room Manager not loaded.")
+    mark_validated()
+    try:
+        return await completions.run(("complete", session_id), request.dict(),
+                                     lambda: complete_session(bundle, session_id, request))
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+async def complete_session(bundle, session_id: str, request: CompleteSessionRequest) -> CompleteSessionResponse:
+    record = session_store.get(session_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Unknown session {session_id}.")
+    if record.room_id is None:
+        # Queued at assignment; look up the room it was promoted to
+        ticket = room_manager.get_ticket(session_id)
+        if ticket and ticket["status"] == "waiting":
+            raise HTTPException(status_code=409, detail=f"Session {session_id} is still waiting for a room.")
+        if not ticket or ticket["status"] != "assigned":
+            # Cancelled, or evicted from the finished tickets: it will never get a room
+            session_store.pop(session_id)
+            scan_ingestor.forget(session_id)
+            raise HTTPException(status_code=410, detail=f"Session {session_id} left the waitlist without a room.")
+        session_store.seat(session_id, ticket["room_id"], datetime.fromisoformat(ticket["assigned_at"]))
+
+    exit_time = request.exit_time or datetime.now()
+    if exit_time.tzinfo is not None:
+        exit_time = exit_time.astimezone().replace(tzinfo=None)  # Session times are naive local time
+    if exit_time < record.entry_time:
+        raise HTTPException(status_code=422, detail=f"exit_time is before the session's entry at {record.entry_time.isoformat()}.")
+    ingested = scan_ingestor.session_scans(session_id) if scan_ingestor else None
+    entry_scans = request.entry_scans
+    if entry_scans is None:
+        entry_scans = ingested["entry"] if ingested and ingested["entry"] else session_store.basket(record)
+    exit_scans = request.exit_scans
+    if exit_scans is None:
+        if ingested is None:
+            raise HTTPException(status_code=422, detail="exit_scans is required when no reads were ingested for the session.")
+        exit_scans = ingested["exit"]
+    actual_duration = (exit_time - record.entry_time).total_seconds() / 60
+    try:
+        with timed("features"):
+            features = bundle.anomaly_model.extract_features({
+                'actual_duration': actual_duration,
+                'predicted_duration': record.predicted_duration,
+                'entry_scans': entry_scans,
+                'exit_scans': exit_scans,
+                'entry_time': record.entry_time,
+            })
+        result = await score_anomaly(bundle, features)
+        save_completed_session(session_id, record.room_id, record.entry_time, exit_time, entry_scans,
+                               exit_scans, record.predicted_duration, result)
+    except Exception as e:
+        room_manager.release_room(record.room_id, session_id)
+        session_store.pop(session_id)
+        scan_ingestor.forget(session_id)
+        raise HTTPException(status_code=500, detail=f"Error detecting anomaly: {e}. Room has been force-released.")
+
+    with timed("room_op"):
+        room_manager.release_room(record.room_id, session_id)
+    session_store.pop(session_id)
+    scan_ingestor.forget(session_id)
+    exited = set(exit_scans)
+    return CompleteSessionResponse(
+        session_id=session_id,
+        is_anomaly=result['is_anomaly'],
+        anomaly_score=result['anomaly_score'],
+        risk_level=result['risk_level'],
+        model_version=bundle.version,
+        room_id=record.room_id,
+        actual_duration_minutes=round(actual_duration, 2),
+        predicted_duration_minutes=round(record.predicted_duration, 2),
+        missing_items=sorted(sku for sku in set(entry_scans) if sku not in exited),
+    )
+
+
+@app.post("/scans/ingest")
+async def ingest_scans_endpoint(request: Request):
+    """
+    Accepts raw RFID reads {"tag": SKU, "reader": id, "ts": epoch seconds or ISO time},
+    either as a JSON list (or {"reads": [...]}) or streamed as NDJSON
+    (Content-Type: application/x-ndjson), one read per line, which is processed
+    chunk by chunk as it arrives. Repeated reads of a tag at the same room zone
+    within SCAN_DEDUP_WINDOW_SECONDS are dropped; the rest update the entry/exit
+    items of the session holding the room, used by /sessions/{id}/complete.
+    A read from an exit gate reader while the session still has items that were
+    not scanned out raises a missing-item event: it is returned in "events"
+    and written to the alerts table straight away. Tags that are not catalog or
+    basket SKUs are counted as unknown_tag. A malformed JSON list gets 422 and
+    nothing is ingested; malformed NDJSON lines are skipped and listed in
+    "rejected_lines".
+    """
+    if not scan_ingestor:
+        raise HTTPException(status_code=503, detail="Room Manager not initialized.")
+    loop = asyncio.get_running_loop()
+    totals = dict.fromkeys(scan_ingestor.counts, 0)
+    events = []
+
+    def add(result: tuple):
+        counts, new_events = result
+        for name, value in counts.items():
+            totals[name] += value
+        if new_events:
+            events.extend(new_events)
+            # Alert staff while the customer is still at the door, without holding up ingestion
+            loop.run_in_executor(None, deliver_missing_item_alerts, new_events)
+
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        # Chunks are ingested as they arrive, so a bad line cannot undo earlier ones:
+        # it is skipped and reported with its line number instead
+        rejected, buffer, next_line = [], b"", 1
+
+        def add_lines(lines: list):
+            nonlocal next_line
+            unparsed = len(rejected)
+            reads, line_numbers = parse_ndjson_lines(lines, next_line, rejected)
+            next_line += len(lines)
+            if len(rejected) > unparsed:
+                scan_ingestor.count_rejected(len(rejected) - unparsed)
+                add(({"reads": len(rejected) - unparsed, "rejected": len(rejected) - unparsed}, []))
+            rejects = []
+            add(scan_ingestor.ingest(reads, rejects=rejects))
+            rejected.extend({"line": line_numbers[i], "error": error} for i, error in rejects)
+
+        async for chunk in request.stream():
+            buffer += chunk
+            lines, newline, buffer = buffer.rpartition(b"\n")
+            if newline:
+                add_lines(lines.split(b"\n"))
+        if buffer.strip():
+            add_lines([buffer])
+        rejected.sort(key=lambda reject: reject["line"])
+        return {**totals, "events": events, "rejected_lines": rejected[:MAX_REJECTED_LINES]}
+
+    try:
+        body = await request.json()
+        # Parsed as a whole before anything is applied, so a 422 means nothing was ingested
+        add(scan_ingestor.ingest(body["reads"] if isinstance(body, dict) else body))
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=f"Malformed scan reads: {e}")
+    return {**totals, "events": events}
+
+MAX_REJECTED_LINES = 100  # Rejected NDJSON lines listed in an /scans/ingest response
+
+def parse_ndjson_lines(lines: list, first_line: int, rejected: list) -> tuple:
+    """
+    (reads, their line numbers) from NDJSON lines numbered from `first_line`.
+    Blank lines are skipped; lines that are not valid JSON are added to `rejected`.
+    """
+    numbered = [(first_line + i, line) for i, line in enumerate(lines) if line.strip()]
+    try:
+        # One json.loads per chunk instead of one per read
+        return json.loads(b"[" + b",".join(line for _, line in numbered) + b"]"), [n for n, _ in numbered]
+    except ValueError:
+        pass
+    reads, line_numbers = [], []
+    for n, line in numbered:
+        try:
+            reads.append(json.loads(line))
+            line_numbers.append(n)
+        except ValueError as e:
+            rejected.append({"line": n, "error": f"invalid JSON: {e}"})
+    return reads, line_numbers
+
+def deliver_missing_item_alerts(events: list):
+    for e in events:
+        scan_log.info("missing_items", room_id=e['room_id'], session_id=e['session_id'],
+                      missing_items=len(e['missing_items']))
+    try:
+        save_missing_item_alerts(events)
+    except Exception as e:
+        scan_log.warning("alert_save_failed", alerts=len(events), error=e)
+
+@app.get("/scans/stats")
+async def scan_stats_endpoint():
+    """Totals of ingested, accepted and suppressed reads since startup, and recent missing-item events."""
+    if not scan_ingestor:
+        raise HTTPException(status_code=503, detail="Room Manager not initialized.")
+    return {**scan_ingestor.stats(), "recent_missing_item_events": list(scan_ingestor.recent_events)[::-1]}
+
+
+@app.get("/models")
+async def get_models_endpoint():
+    """Returns the model version currently serving predictions."""
+    bundle = model_registry.current if model_registry else None
+    if not bundle:
+        raise HTTPException(status_code=503, detail="Models not loaded.")
+    return bundle.describe()
+
+@app.post("/models/reload")
+async def reload_models_endpoint(request: ReloadModelsRequest = ReloadModelsRequest()):
+    """
+    Loads the model artifacts from disk as a new version, warms it up and sanity-checks it
+    in a worker thread, then swaps it in. Requests keep being served by the old version
+    until the swap, and requests already in flight finish on it.
+    """
+    if not model_registry:
+        raise HTTPException(status_code=503, detail="Model registry not initialized.")
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(None, model_registry.reload, request.force)
+    except Exception as e:
+        current = model_registry.current
+        raise HTTPException(
+            status_code=422,
+            detail=f"New model version rejected, still serving {current.version if current else None}: {e}"
+        )
+
+@app.get("/inference/stats")
+async def inference_stats_endpoint():
+    """Batch size and queue wait histograms of the inference coalescers."""
+    return {coalescer.name: coalescer.stats() for coalescer in (duration_coalescer, anomaly_coalescer) if coalescer}
+
+def collect_service_metrics() -> list:
+    """Gauges and counters read from the service's components when /metrics is scraped."""
+    bundle = model_registry.current if model_registry else None
+    caches = {"basket_features": feature_cache.stats(), "completions": completions.stats()}
+    admission_stats = admission.stats()["classes"]
+    families = [
+        ("fitting_room_model_info", "gauge", "Model version currently serving.",
+         [({"version": bundle.version}, 1)] if bundle else []),
+        ("fitting_room_executor_queue_depth", "gauge", "Jobs waiting for a thread of the default executor.",
+         [({}, executor._work_queue.qsize())] if executor else []),
+        ("fitting_room_cache_hits_total", "counter", "Cache lookups answered from the cache.",
+         [({"cache": name}, stats["hits"]) for name, stats in caches.items()]),
+        ("fitting_room_cache_misses_total", "counter", "Cache lookups that had to compute the value.",
+         [({"cache": name}, stats["misses"]) for name, stats in caches.items()]),
+        ("fitting_room_cache_hit_ratio", "gauge", "Share of cache lookups answered from the cache.",
+         [({"cache": name}, stats["hit_rate"]) for name, stats in caches.items()]),
+        ("fitting_room_cache_entries", "gauge", "Entries held by each cache.",
+         [({"cache": name}, stats["entries"]) for name, stats in caches.items()]),
+        ("fitting_room_admission_in_flight", "gauge", "Requests being served, per endpoint class.",
+         [({"class": name}, stats["in_flight"]) for name, stats in admission_stats.items()]),
+        ("fitting_room_admission_queued", "gauge", "Requests waiting for admission, per endpoint class.",
+         [({"class": name}, stats["queued"]) for name, stats in admission_stats.items()]),
+        ("fitting_room_admission_shed_total", "counter", "Requests rejected with 429, per endpoint class.",
+         [({"class": name, "reason": reason}, stats[f"shed_{reason}"])
+          for name, stats in admission_stats.items() for reason in ("queue_full", "deadline")]),
+        ("fitting_room_active_sessions", "gauge", "Sessions started by /assign_room and not completed yet.",
+         [({}, len(session_store))]),
+    ]
+    if room_manager:
+        rooms_by_status = {}
+        for record in room_manager.get_status().values():
+            rooms_by_status[record["status"]] = rooms_by_status.get(record["status"], 0) + 1
+        families.append(("fitting_room_rooms", "gauge", "Fitting rooms by status.",
+                         [({"status": status}, n) for status, n in sorted(rooms_by_status.items())]))
+    return families
+
+metrics_registry.add_collector(collect_service_metrics)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics: request and per-stage latency histograms, loop lag, queues, caches and model version."""
+    return Response(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+# --- Debug Endpoints ---
+def require_admin(request: Request):
+    """Debug endpoints need ADMIN_TOKEN in an X-Admin-Token header; without ADMIN_TOKEN they do not exist."""
+    token = config('ADMIN_TOKEN', default='')
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(request.headers.get("x-admin-token", ""), token):
+        raise HTTPException(status_code=403, detail="Admin token required.")
+
+@app.get("/debug/profile")
+async def debug_profile_endpoint(request: Request, seconds: float = 10.0, interval_ms: float = 10.0,
+                                 include_idle: bool = False):
+    """
+    Samples the stacks of all threads for `seconds` (at most 120) every `interval_ms`
+    and returns them collapsed, one "stack count" line each, for flamegraph.pl or
+    speedscope. Threads waiting for work are left out unless include_idle=true.
+    """
+    require_admin(request)
+    if stack_sampler.running:
+        raise HTTPException(status_code=409, detail="A profile is already running.")
+    seconds = max(0.1, min(seconds, 120.0))
+    stacks, samples = await stack_sampler.profile(seconds, max(interval_ms, 1.0) / 1000, include_idle)
+    return Response(format_collapsed(stacks), media_type="text/plain",
+                    headers={"X-Profile-Samples": str(samples)})
+
+@app.get("/debug/profile/requests")
+async def debug_request_profiles_endpoint(request: Request, sort: str = "cumulative", limit: int = 40):
+    """cProfile statistics aggregated over the requests sampled at PROFILE_REQUEST_RATE."""
+    require_admin(request)
+    try:
+        report = request_profiles.report(sort, max(1, limit))
+    except KeyError:
+        raise HTTPException(status_code=422, detail=f"Unknown sort key '{sort}'.")
+    return Response(report, media_type="text/plain")
+
+@app.post("/debug/profile/requests")
+async def configure_request_profiles_endpoint(request: Request, rate: float | None = None, reset: bool = False):
+    """Changes the share of requests profiled (0 turns it off) and optionally clears the statistics."""
+    require_admin(request)
+    if rate is not None:
+        request_profiles.rate = max(0.0, min(rate, 1.0))
+    if reset:
+        request_profiles.reset()
+    return {"rate": request_profiles.rate, "profiled": request_profiles.profiled}
+
+@app.get("/admission/stats")
+async def admission_stats_endpoint():
+    """Requests in flight, queued, admitted and shed (429) per endpoint class."""
+    return admission.stats()
+
+@app.get("/sessions/stats")
+async def session_stats_endpoint():
+    """Sessions held for /sessions/{id}/complete and the completion replay cache."""
+    return {**session_store.stats(), "idempotency": completions.stats()}
+
+@app.get("/catalog")
+async def get_catalog_endpoint():
+    """Returns catalog size, refresh watermark and basket feature cache statistics."""
+    return {
+        "items": len(catalog),
+        "version": catalog.version,
+        "watermark": catalog.watermark.isoformat() if catalog.watermark else None,
+        "feature_cache": feature_cache.stats(),
+    }
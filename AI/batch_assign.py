@@ -0,0 +1,102 @@
+"""
+Micro-batched room assignment.
+Instead of seating each arrival greedily in the room that frees up first for it,
+arrivals collected over a short window are assigned jointly so that the total
+wait of the batch is minimal.
+
+Formulation: if room r is free at t_r and gets jobs in order, the job placed k-th
+from the end of r's queue delays the k jobs behind it by its duration p_j. Summed
+over a batch, total start time = sum of t_r(j) + k_j * p_j, which is separable per
+(job, room, k) slot. A min-cost bipartite matching between jobs and (room, k) slots
+(Hungarian algorithm, scipy's linear_sum_assignment) is therefore an exact optimum;
+lower k slots are always cheaper, so every room's queue comes out contiguous.
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+INFEASIBLE = 1e12  # Cost of putting a job in a room without its required features
+
+
+def plan_joint_assignment(rooms: list, jobs: list, now: datetime) -> list:
+    """
+    rooms: [(room_id, free_at datetime, features frozenset)]
+    jobs: [(duration_minutes, required_features frozenset)]
+    Returns one (room_id, planned_start) per job, in job order; (None, None) for a
+    job no room can serve. Higher-priority batches should be planned first and the
+    room free times advanced before planning the rest.
+    """
+    n = len(jobs)
+    if n == 0:
+        return []
+    free_at = np.array([max(0.0, (free - now).total_seconds() / 60) for _, free, _ in rooms])
+    durations = np.array([float(duration) for duration, _ in jobs])
+
+    # cost[j, r * n + k] = t_r + k * p_j
+    slot_room = np.repeat(np.arange(len(rooms)), n)
+    slot_k = np.tile(np.arange(n), len(rooms))
+    cost = free_at[slot_room][None, :] + durations[:, None] * slot_k[None, :]
+    for j, (_, required) in enumerate(jobs):
+        if required:
+            allowed = np.array([required <= features for _, _, features in rooms])
+            cost[j, ~allowed[slot_room]] = INFEASIBLE
+
+    job_idx, slot_idx = linear_sum_assignment(cost)
+
+    # Rebuild each room's queue: the job with the highest k goes first
+    queues = {}
+    for j, s in zip(job_idx, slot_idx):
+        if cost[j, s] >= INFEASIBLE:
+            continue
+        queues.setdefault(slot_room[s], []).append((-slot_k[s], j))
+    plan = [(None, None)] * n
+    for r, entries in queues.items():
+        start = free_at[r]
+        for _, j in sorted(entries):
+            plan[j] = (rooms[r][0], now + timedelta(minutes=float(start)))
+            start += durations[j]
+    return plan
+
+
+class AssignmentBatcher:
+    """
+    Collects /assign_room calls for up to `window_ms` (or `max_batch` arrivals) and
+    hands them to the room state backend as one batch.
+    """
+    def __init__(self, backend, window_ms: float = 50.0, max_batch: int = 64):
+        self.backend = backend
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending = []
+        self._flush_handle = None
+
+    async def submit(self, session_id: str, duration: float, required_features=(), priority: int = 0,
+                     basket_size: int | None = None) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append(((session_id, duration, tuple(required_features), priority, basket_size), future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            results = self.backend.assign_batch([request for request, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
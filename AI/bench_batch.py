@@ -0,0 +1,158 @@
+"""
+Benchmark of micro-batched joint room assignment against the greedy policy.
+Replays the arrivals of data/historical_sessions.csv with their real durations.
+Inter-arrival gaps are compressed so the rooms run at the requested load, which
+turns the historical arrival pattern into realistic bursts. Both policies run
+through the real RoomManager on a virtual clock and see the same noisy duration
+predictions; waits are measured on the real durations, from arrival to start.
+
+Usage: python bench_batch.py [--rooms 2] [--load 0.9] [--windows 0.5,1,2,5] [--noise 0.25]
+                             [--group-share 0.05 --group-size 8]
+"""
+import argparse
+import contextlib
+import heapq
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from rooms import RoomManager
+from simulator import SimClock
+
+BASE_TIME = datetime(2025, 1, 1)
+
+
+def load_arrivals(csv_path: str, num_rooms: int, load: float, noise: float,
+                  group_share: float = 0.0, group_size: int = 8, seed: int = 7) -> list:
+    """
+    [(arrival_minute, actual_duration, predicted_duration)] at the given utilisation.
+    With group_share > 0, that share of arrivals brings the next group_size - 1
+    sessions along within a minute, like a tour group; the total load is unchanged.
+    """
+    sessions = pd.read_csv(csv_path, parse_dates=['entry_time']).sort_values('entry_time')
+    minutes = (sessions['entry_time'] - sessions['entry_time'].iloc[0]).dt.total_seconds().to_numpy() / 60
+    durations = sessions['duration'].to_numpy(dtype=float)
+    span_needed = durations.sum() / (num_rooms * load)
+    arrivals = minutes * (span_needed / max(minutes[-1], 1e-9))
+    rng = random.Random(seed)
+    i = 0
+    while i < len(arrivals):
+        if rng.random() < group_share:
+            for k in range(i + 1, min(i + group_size, len(arrivals))):
+                arrivals[k] = arrivals[i] + rng.random()
+            i += group_size
+        else:
+            i += 1
+    order = np.argsort(arrivals, kind="stable")
+    return [(float(arrivals[k]), float(durations[k]), float(durations[k]) * rng.lognormvariate(0, noise))
+            for k in order]
+
+
+ARRIVAL, FLUSH, DEPARTURE = 2, 1, 0  # Departures first at equal times, so a freed room is reusable
+
+
+def replay(arrivals: list, num_rooms: int, window: float = 0.0, max_batch: int = 64) -> dict:
+    """
+    Replays the arrivals through the real RoomManager on a virtual clock.
+    window == 0 assigns every arrival on its own (greedy). Otherwise arrivals are
+    held like AssignmentBatcher does: the first one opens a window, and after
+    `window` minutes (or `max_batch` arrivals) the pending batch goes to
+    RoomManager.assign_batch. Waits run from arrival to the actual start, so the
+    time spent waiting for the batch decision is charged to batching.
+    """
+    clock = SimClock(BASE_TIME)
+    manager = RoomManager(total_rooms=num_rooms, clock=clock)
+    events = [(BASE_TIME + timedelta(minutes=arrival), ARRIVAL, i) for i, (arrival, _, _) in enumerate(arrivals)]
+    heapq.heapify(events)
+    arrived_at, waits = {}, []
+    pending, flush_at = [], None
+    solve_seconds, batches = 0.0, 0
+    version = manager.status_version()
+
+    def start_session(session_id: str, room_id: str):
+        i = int(session_id)
+        waits.append((clock.now - arrived_at[session_id]).total_seconds() / 60)
+        heapq.heappush(events, (clock.now + timedelta(minutes=arrivals[i][1]), DEPARTURE, (i, room_id)))
+
+    def seat(results: list, session_ids: list):
+        for session_id, result in zip(session_ids, results):
+            if result and result["is_immediate"]:
+                start_session(session_id, result["assigned_room_id"])
+
+    def flush():
+        nonlocal pending, flush_at, solve_seconds, batches
+        batch, pending, flush_at = pending, [], None
+        started = time.perf_counter()
+        results = manager.assign_batch(batch)
+        if len(batch) > 1:
+            solve_seconds += time.perf_counter() - started
+            batches += 1
+        seat(results, [request[0] for request in batch])
+
+    while events:
+        clock.now, kind, payload = heapq.heappop(events)
+        if kind == DEPARTURE:
+            i, room_id = payload
+            manager.release_room(room_id, str(i))
+            # Sessions promoted from the waitlist show up in the room change feed
+            for change in manager.changes_since(version) or []:
+                if change["status"] == "occupied" and change["session_id"] != str(i):
+                    start_session(change["session_id"], change["room_id"])
+        elif kind == FLUSH:
+            if flush_at == clock.now:
+                flush()
+        else:
+            session_id = str(payload)
+            arrived_at[session_id] = clock.now
+            request = (session_id, arrivals[payload][2], (), 0, None)
+            if window <= 0:
+                seat([manager.assign_room_intelligently(*request)], [session_id])
+            else:
+                pending.append(request)
+                if len(pending) >= max_batch:
+                    flush()
+                elif flush_at is None:
+                    flush_at = clock.now + timedelta(minutes=window)
+                    heapq.heappush(events, (flush_at, FLUSH, None))
+        version = manager.status_version()
+    return {"waits": np.array(waits), "solve_us": solve_seconds / max(batches, 1) * 1e6}
+
+
+def summarize(name: str, result: dict) -> str:
+    w = result["waits"]
+    return (f"{name:>18} | {w.mean():>9.2f} | {np.percentile(w, 50):>8.2f} | {np.percentile(w, 95):>8.2f} | "
+            f"{w.sum() / 60:>10.1f} | {result['solve_us']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--csv", default="data/historical_sessions.csv")
+    parser.add_argument("--rooms", type=int, default=2)
+    parser.add_argument("--load", type=float, default=0.9, help="Target room utilisation")
+    parser.add_argument("--windows", default="0.5,1,2,5", help="Batch windows in minutes")
+    parser.add_argument("--noise", type=float, default=0.25, help="Log-normal sigma of prediction error")
+    parser.add_argument("--group-share", type=float, default=0.0, help="Share of arrivals that bring a group")
+    parser.add_argument("--group-size", type=int, default=8)
+    args = parser.parse_args()
+
+    arrivals = load_arrivals(args.csv, args.rooms, args.load, args.noise, args.group_share, args.group_size)
+    print("=" * 78)
+    print(f"BATCH vs GREEDY ASSIGNMENT ({len(arrivals)} sessions, {args.rooms} rooms, load {args.load:.0%})")
+    print("=" * 78)
+    print(f"{'policy':>18} | {'mean wait':>9} | {'p50':>8} | {'p95':>8} | {'total (h)':>10} | {'solve µs':>9}")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        greedy = replay(arrivals, args.rooms)
+    print(summarize("greedy", greedy))
+    for window in (float(w) for w in args.windows.split(",")):
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            batched = replay(arrivals, args.rooms, window)
+        saved = 1 - batched["waits"].sum() / greedy["waits"].sum()
+        print(summarize(f"batch {window:g} min", batched) + f"  ({saved:+.1%} total wait saved)")
+
+
+if __name__ == "__main__":
+    main()
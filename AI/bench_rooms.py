@@ -0,0 +1,97 @@
+"""
+Benchmark for RoomManager assignment latency as the number of rooms grows.
+Compares the heap-indexed RoomManager with the previous linear scan over all rooms.
+
+Usage: python bench_rooms.py [--cycles 2000] [--sizes 2,40,400,4000,20000]
+"""
+import argparse
+import contextlib
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from rooms import RoomManager
+
+
+def build_layout(num_rooms: int, rooms_per_store: int = 40) -> list:
+    """Multi-store layout: stores of 40 rooms, ~10% accessible and ~25% with a large mirror."""
+    rng = random.Random(7)
+    layout = []
+    for i in range(num_rooms):
+        features = [f"store:{i // rooms_per_store}"]
+        if rng.random() < 0.10:
+            features.append("accessible")
+        if rng.random() < 0.25:
+            features.append("large_mirror")
+        layout.append({"room_id": f"room_{i+1}", "features": features})
+    return layout
+
+
+def linear_best_room(manager: RoomManager, new_session_duration: float):
+    """The pre-index assignment policy: scan every room and recompute its release time."""
+    now = datetime.now()
+    best_room, best_end = None, datetime.max
+    for room_id, data in manager.rooms.items():
+        if data["status"] == "occupied":
+            release = data["entry_time"] + timedelta(minutes=data["predicted_duration"])
+        else:
+            release = now
+        end_time = max(now, release) + timedelta(minutes=new_session_duration)
+        if end_time < best_end:
+            best_room, best_end = room_id, end_time
+    return best_room
+
+
+def bench_size(num_rooms: int, cycles: int, occupancy: float = 0.95) -> dict:
+    rng = random.Random(42)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        manager = RoomManager(rooms=build_layout(num_rooms))
+        occupied = []
+        for i in range(int(num_rooms * occupancy)):
+            result = manager.assign_room_intelligently(f"warm_{i}", rng.uniform(5, 40))
+            occupied.append(result["assigned_room_id"])
+
+        durations = [rng.uniform(5, 40) for _ in range(cycles)]
+        stores = max(1, num_rooms // 40)
+        constraints = [() if rng.random() < 0.8 else (f"store:{rng.randrange(stores)}",) for _ in range(cycles)]
+
+        # Steady state: each cycle releases a random occupied room and assigns a new session
+        start = time.perf_counter()
+        for i in range(cycles):
+            released = occupied.pop(rng.randrange(len(occupied)))
+            manager.release_room(released)
+            if manager.rooms[released]["status"] == "occupied":
+                occupied.append(released)  # Promoted straight to a waiting session
+            result = manager.assign_room_intelligently(f"bench_{i}", durations[i], constraints[i])
+            if result.get("is_immediate"):
+                occupied.append(result["assigned_room_id"])
+        heap_us = (time.perf_counter() - start) / cycles * 1e6
+
+        linear_cycles = max(10, min(cycles, 200_000 // max(num_rooms, 1)))
+        start = time.perf_counter()
+        for i in range(linear_cycles):
+            linear_best_room(manager, durations[i])
+        linear_us = (time.perf_counter() - start) / linear_cycles * 1e6
+
+    return {"rooms": num_rooms, "heap_us": heap_us, "linear_us": linear_us}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--cycles", type=int, default=2000)
+    parser.add_argument("--sizes", default="2,40,400,4000,20000")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("ROOM ASSIGNMENT BENCHMARK (release + assign per cycle)")
+    print("=" * 60)
+    print(f"{'rooms':>8} | {'heap index (µs)':>16} | {'linear scan (µs)':>17} | {'speedup':>8}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        result = bench_size(size, args.cycles)
+        print(f"{result['rooms']:>8} | {result['heap_us']:>16.1f} | {result['linear_us']:>17.1f} | "
+              f"{result['linear_us'] / result['heap_us']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
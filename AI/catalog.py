@@ -0,0 +1,206 @@
+"""
+In-memory item catalog with incremental refresh.
+The catalog dict is never mutated once published: updates build a new dict and
+swap the reference, so a request that read `catalog.items` keeps a consistent
+snapshot even while a refresh is being applied.
+"""
+import select
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+from models import DurationPredictor
+from db_integration import get_db_connection, load_item_updates_since
+from logs import get_logger
+
+log = get_logger("Catalog")
+
+
+class Catalog:
+    """Copy-on-write holder for the SKU -> item data mapping."""
+    def __init__(self, items: dict = None, watermark: datetime = None):
+        self._items = dict(items or {})
+        self.watermark = watermark  # Newest products.updated_at applied so far
+        self.version = 0
+        self._write_lock = threading.Lock()
+        self._listeners = []
+
+    @property
+    def items(self) -> dict:
+        return self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def add_listener(self, callback):
+        """Registers callback(changed_skus) to run after each applied update."""
+        self._listeners.append(callback)
+
+    def replace(self, items: dict, watermark: datetime = None):
+        """Publishes a full catalog, e.g. the initial load."""
+        with self._write_lock:
+            changed = set(self._items) ^ set(items) | {sku for sku in items if self._items.get(sku) != items[sku]}
+            self._items = dict(items)
+            self.watermark = watermark
+            self.version += 1
+        self._notify(changed)
+
+    def apply_updates(self, updates: dict, watermark: datetime = None) -> set:
+        """
+        Merges changed rows into a copy of the catalog and swaps it in.
+        Rows identical to what is already loaded are ignored.
+        Returns the set of SKUs that actually changed.
+        """
+        with self._write_lock:
+            changed = {sku for sku, item in updates.items() if self._items.get(sku) != item}
+            if changed:
+                new_items = dict(self._items)
+                for sku in changed:
+                    new_items[sku] = updates[sku]
+                self._items = new_items
+                self.version += 1
+            if watermark is not None:
+                self.watermark = watermark
+        if changed:
+            self._notify(changed)
+        return changed
+
+    def _notify(self, changed: set):
+        for callback in self._listeners:
+            try:
+                callback(changed)
+            except Exception as e:
+                log.warning("listener_failed", error=e)
+
+
+class BasketFeatureCache:
+    """
+    Bounded LRU cache of DurationPredictor basket features, keyed on the sorted SKUs.
+    Entries are dropped when any of their SKUs changes in the catalog.
+    """
+    def __init__(self, catalog: Catalog, max_entries: int = 4096):
+        self.catalog = catalog
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._keys_by_sku = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        catalog.add_listener(self.invalidate_skus)
+
+    def item_features(self, item_ids) -> list:
+        key = tuple(sorted(item_ids))
+        with self._lock:
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return features
+            self.misses += 1
+            version = self.catalog.version
+
+        features = DurationPredictor.extract_item_features(key, self.catalog.items)
+
+        with self._lock:
+            # Skip caching if the catalog changed while we computed; the result may be stale
+            if version == self.catalog.version and key not in self._entries:
+                self._entries[key] = features
+                for sku in set(key):
+                    self._keys_by_sku.setdefault(sku, set()).add(key)
+                if len(self._entries) > self.max_entries:
+                    self._evict(next(iter(self._entries)))
+        return features
+
+    def duration_features(self, item_ids, entry_time):
+        """Full DurationPredictor feature row, using the cached basket part."""
+        return DurationPredictor.combine_features(self.item_features(item_ids), entry_time)
+
+    def _evict(self, key):
+        self._entries.pop(key, None)
+        for sku in set(key):
+            keys = self._keys_by_sku.get(sku)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_sku[sku]
+
+    def invalidate_skus(self, skus):
+        with self._lock:
+            for sku in skus:
+                for key in list(self._keys_by_sku.get(sku, ())):
+                    self._evict(key)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class CatalogRefresher(threading.Thread):
+    """
+    Pulls products changed since the catalog watermark and applies them.
+    Polls every `interval` seconds; when `channel` is set it also LISTENs on that
+    Postgres NOTIFY channel and refreshes as soon as a notification arrives.
+    """
+    def __init__(self, catalog: Catalog, interval: float = 60.0, channel: str = None,
+                 lookback_seconds: float = 5.0):
+        super().__init__(name="catalog-refresher", daemon=True)
+        self.catalog = catalog
+        self.interval = interval
+        self.channel = channel
+        # Re-read a short window before the watermark so rows committed late with an
+        # older updated_at are not missed; unchanged rows are filtered out on apply.
+        self.lookback = timedelta(seconds=lookback_seconds)
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def refresh(self) -> set:
+        since = self.catalog.watermark - self.lookback if self.catalog.watermark else None
+        updates, watermark = load_item_updates_since(since)
+        changed = self.catalog.apply_updates(updates, watermark or self.catalog.watermark)
+        if changed:
+            log.info("refreshed", changed_items=len(changed), items=len(self.catalog))
+        return changed
+
+    def _safe_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            log.warning("refresh_failed", error=e)
+
+    def run(self):
+        if self.channel:
+            self._run_listen()
+        while not self._stop_event.wait(self.interval):
+            self._safe_refresh()
+
+    def _run_listen(self):
+        """LISTEN loop; falls back to plain polling (by returning) if the connection drops."""
+        try:
+            conn = get_db_connection()
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f'LISTEN "{self.channel}"')
+            log.info("listening", channel=self.channel)
+        except Exception as e:
+            log.warning("listen_failed", channel=self.channel, fallback="polling", error=e)
+            return
+        try:
+            while not self._stop_event.is_set():
+                readable, _, _ = select.select([conn], [], [], self.interval)
+                if readable:
+                    conn.poll()
+                    conn.notifies.clear()  # One delta pull covers every pending notification
+                self._safe_refresh()
+        except Exception as e:
+            log.warning("listen_lost", channel=self.channel, fallback="polling", error=e)
+        finally:
+            conn.close()
@@ -0,0 +1,102 @@
+"""
+Request coalescing for model inference.
+A single-row sklearn call is dominated by per-call overhead (validation, tree
+traversal setup), so concurrent requests are queued for at most a couple of
+milliseconds and scored together as one matrix.
+"""
+import asyncio
+import time
+
+import numpy as np
+
+from metrics import registry
+
+
+BATCH_SIZE_BOUNDS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+QUEUE_WAIT_MS_BOUNDS = (0.1, 0.25, 0.5, 1, 2, 3, 5, 10, 25, 100)
+
+batch_size_rows = registry.histogram(
+    "fitting_room_inference_batch_size", "Feature rows scored together in one coalesced model call.",
+    ("model",), BATCH_SIZE_BOUNDS)
+queue_wait_ms = registry.histogram(
+    "fitting_room_inference_queue_wait_milliseconds", "Time a feature row waited for its coalesced batch.",
+    ("model",), QUEUE_WAIT_MS_BOUNDS)
+
+
+class InferenceCoalescer:
+    """
+    Queues feature rows from concurrent requests and runs `predict_batch(bundle, X)`
+    once per flush. When no batch is running, rows are flushed on the next loop
+    iteration, so a lone request waits for nothing; while one is running, rows
+    collect until it finishes, `max_batch` are waiting or the oldest has waited
+    `max_wait_ms`. Rows are grouped by model bundle, so a request never gets a
+    prediction from a different model version than the one it asked for. Batches
+    run on an executor thread, and the event loop keeps collecting the next one.
+    """
+    def __init__(self, name: str, predict_batch, max_batch: int = 64, max_wait_ms: float = 2.0, executor=None):
+        self.name = name
+        self.predict_batch = predict_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self._pending = []
+        self._flush_handle = None
+        self._in_flight = 0
+        self.batch_size = batch_size_rows.labels(name)  # Exported on /metrics as well
+        self.queue_wait_ms = queue_wait_ms.labels(name)
+
+    async def submit(self, bundle, row):
+        """Prediction for one feature row (shape (n_features,) or (1, n_features))."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((bundle, np.asarray(row).reshape(-1), future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._flush_handle is None:
+            # Idle: flush once the requests already queued on the loop have added their rows
+            self._flush_handle = (loop.call_soon(self._flush) if not self._in_flight
+                                  else loop.call_later(self.max_wait, self._flush))
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        flushed_at = time.perf_counter()
+        groups = {}
+        for bundle, row, future, enqueued_at in batch:
+            self.queue_wait_ms.observe((flushed_at - enqueued_at) * 1000)
+            groups.setdefault(id(bundle), (bundle, []))[1].append((row, future))
+        for bundle, entries in groups.values():
+            self.batch_size.observe(len(entries))
+            self._in_flight += 1
+            asyncio.ensure_future(self._run(bundle, entries))
+
+    async def _run(self, bundle, entries):
+        loop = asyncio.get_running_loop()
+        try:
+            X = np.stack([row for row, _ in entries])
+            results = await loop.run_in_executor(self.executor, self.predict_batch, bundle, X)
+        except Exception as e:
+            for _, future in entries:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._in_flight -= 1
+            if self._pending and not self._in_flight:
+                self._flush()
+        for (_, future), result in zip(entries, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "batch_size": self.batch_size.describe(),
+            "queue_wait_ms": self.queue_wait_ms.describe(),
+        }
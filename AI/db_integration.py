@@ -6,11 +6,15 @@ import os
 import json
 import pandas as pd
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from decouple import config
 
+from logs import get_logger
+
+log = get_logger("Database")
+
 # Database connection configuration
 DB_CONFIG = {
     'host': config('DB_HOST', default='localhost'),
@@ -24,10 +28,25 @@ def get_db_connection():
     """Get database connection"""
     return psycopg2.connect(**DB_CONFIG)
 
-def load_item_database_from_db() -> Dict:
+def _row_to_item(row) -> Dict:
+    """Converts a products row into the item format used by the JSON file"""
+    return {
+        'name': row['name'],
+        'category': row['category'] or 'Unknown',
+        'size': row['size'] or 'Unknown',
+        'color': row['color'] or 'Unknown',
+        'price': float(row['price']) if row['price'] else 0.0,
+        'material': row['material'] or 'Unknown',
+        'has_buttons': bool(row['has_buttons']),
+        'has_zipper': bool(row['has_zipper']),
+        'complexity_score': int(row['complexity_score']) if row['complexity_score'] else 5,
+    }
+
+def load_item_updates_since(since: Optional[datetime]) -> Tuple[Dict, Optional[datetime]]:
     """
-    Load item database from PostgreSQL products table
-    Returns: Dictionary mapping SKU to item data (same format as JSON file)
+    Load products changed at or after `since` (all products when `since` is None)
+    Returns: (dictionary mapping SKU to item data, new watermark)
+    The watermark is the newest updated_at seen, or `since` if nothing changed.
     """
     conn = get_db_connection()
     try:
@@ -43,29 +62,32 @@ def load_item_database_from_db() -> Dict:
                     price,
                     complexity_score,
                     has_zipper,
-                    has_buttons
+                    has_buttons,
+                    updated_at
                 FROM products
-            """)
+                WHERE %(since)s::timestamp IS NULL OR updated_at >= %(since)s::timestamp
+                ORDER BY updated_at
+            """, {'since': since})
             
             items = {}
+            watermark = since
             for row in cur.fetchall():
-                items[row['sku']] = {
-                    'name': row['name'],
-                    'category': row['category'] or 'Unknown',
-                    'size': row['size'] or 'Unknown',
-                    'color': row['color'] or 'Unknown',
-                    'price': float(row['price']) if row['price'] else 0.0,
-                    'material': row['material'] or 'Unknown',
-                    'has_buttons': bool(row['has_buttons']),
-                    'has_zipper': bool(row['has_zipper']),
-                    'complexity_score': int(row['complexity_score']) if row['complexity_score'] else 5,
-                }
-            
-            print(f"✓ Loaded {len(items)} items from database")
-            return items
+                items[row['sku']] = _row_to_item(row)
+                if row['updated_at'] and (watermark is None or row['updated_at'] > watermark):
+                    watermark = row['updated_at']
+            return items, watermark
     finally:
         conn.close()
 
+def load_item_database_from_db() -> Dict:
+    """
+    Load item database from PostgreSQL products table
+    Returns: Dictionary mapping SKU to item data (same format as JSON file)
+    """
+    items, _ = load_item_updates_since(None)
+    print(f"✓ Loaded {len(items)} items from database")
+    return items
+
 def load_historical_sessions_from_db() -> pd.DataFrame:
     """
     Load historical sessions from PostgreSQL sessions table
@@ -74,7 +96,7 @@ def load_historical_sessions_from_db() -> pd.DataFrame:
     conn = get_db_connection()
     try:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Get sessions with their entry/exit scans
+            # Sessions with their entry/exit scans aggregated in one round trip
             cur.execute("""
                 SELECT 
                     s.session_id,
@@ -82,12 +104,23 @@ def load_historical_sessions_from_db() -> pd.DataFrame:
                     s.exit_time,
                     s.duration_minutes as duration,
                     s.is_anomaly,
-                    s.room_id,
-                    s.customer_rfid
-                FROM sessions s
-                WHERE s.status = 'completed'
+                    COALESCE(array_agg(p.sku ORDER BY rp.scanned_in_at)
+                        FILTER (WHERE p.sku IS NOT NULL AND rp.in_entry_scan), '{}') AS entry_scans,
+                    COALESCE(array_agg(p.sku ORDER BY rp.scanned_out_at)
+                        FILTER (WHERE p.sku IS NOT NULL AND rp.in_exit_scan), '{}') AS exit_scans,
+                    COALESCE(array_agg(p.sku ORDER BY rp.scanned_in_at)
+                        FILTER (WHERE p.sku IS NOT NULL), '{}') AS item_ids
+                FROM (
+                    SELECT session_id, entry_time, exit_time, duration_minutes, is_anomaly
+                    FROM sessions
+                    WHERE status = 'completed'
+                    ORDER BY entry_time DESC
+                    LIMIT 10000
+                ) s
+                LEFT JOIN room_products rp ON rp.session_id = s.session_id
+                LEFT JOIN products p ON rp.product_id = p.id
+                GROUP BY s.session_id, s.entry_time, s.exit_time, s.duration_minutes, s.is_anomaly
                 ORDER BY s.entry_time DESC
-                LIMIT 10000
             """)
             
             sessions_data = cur.fetchall()
@@ -99,54 +132,16 @@ def load_historical_sessions_from_db() -> pd.DataFrame:
                     'entry_scans', 'exit_scans', 'duration', 'is_anomaly'
                 ])
             
-            # Get entry and exit scans for each session
-            sessions_list = []
-            for session in sessions_data:
-                session_id = session['session_id']
-                
-                # Get entry scans (items scanned in)
-                cur.execute("""
-                    SELECT p.sku
-                    FROM room_products rp
-                    JOIN products p ON rp.product_id = p.id
-                    WHERE rp.session_id = %s AND rp.in_entry_scan = TRUE
-                    ORDER BY rp.scanned_in_at
-                """, (session_id,))
-                
-                entry_scans = [row['sku'] for row in cur.fetchall()]
-                
-                # Get exit scans (items scanned out)
-                cur.execute("""
-                    SELECT p.sku
-                    FROM room_products rp
-                    JOIN products p ON rp.product_id = p.id
-                    WHERE rp.session_id = %s AND rp.in_exit_scan = TRUE
-                    ORDER BY rp.scanned_out_at
-                """, (session_id,))
-                
-                exit_scans = [row['sku'] for row in cur.fetchall()]
-                
-                # Get all items in session
-                cur.execute("""
-                    SELECT p.sku
-                    FROM room_products rp
-                    JOIN products p ON rp.product_id = p.id
-                    WHERE rp.session_id = %s
-                    ORDER BY rp.scanned_in_at
-                """, (session_id,))
-                
-                item_ids = [row['sku'] for row in cur.fetchall()]
-                
-                sessions_list.append({
-                    'session_id': session_id,
-                    'entry_time': session['entry_time'],
-                    'exit_time': session['exit_time'],
-                    'item_ids': item_ids,
-                    'entry_scans': entry_scans,
-                    'exit_scans': exit_scans,
-                    'duration': float(session['duration_minutes']) if session['duration_minutes'] else 0.0,
-                    'is_anomaly': bool(session['is_anomaly']) if session['is_anomaly'] is not None else False,
-                })
+            sessions_list = [{
+                'session_id': session['session_id'],
+                'entry_time': session['entry_time'],
+                'exit_time': session['exit_time'],
+                'item_ids': list(session['item_ids']),
+                'entry_scans': list(session['entry_scans']),
+                'exit_scans': list(session['exit_scans']),
+                'duration': float(session['duration']) if session['duration'] else 0.0,
+                'is_anomaly': bool(session['is_anomaly']) if session['is_anomaly'] is not None else False,
+            } for session in sessions_data]
             
             df = pd.DataFrame(sessions_list)
             
@@ -161,6 +156,98 @@ def load_historical_sessions_from_db() -> pd.DataFrame:
     finally:
         conn.close()
 
+def count_sessions_to_score(after_id: int = 0) -> int:
+    """Number of completed sessions with sessions.id > after_id"""
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT COUNT(*) FROM sessions
+                WHERE status = 'completed' AND duration_minutes IS NOT NULL AND id > %s
+            """, (after_id,))
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+def load_sessions_to_score(after_id: int, limit: int, conn=None) -> List[Dict]:
+    """
+    Next `limit` completed sessions after sessions.id `after_id`, in id order, with
+    their items and scans. Keyset pagination, so every chunk is an index range scan.
+    """
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                SELECT
+                    s.id,
+                    s.session_id,
+                    s.entry_time,
+                    s.duration_minutes,
+                    s.predicted_duration_minutes,
+                    COALESCE(array_agg(p.sku ORDER BY rp.scanned_in_at)
+                        FILTER (WHERE p.sku IS NOT NULL AND rp.in_entry_scan), '{}') AS entry_scans,
+                    COALESCE(array_agg(p.sku ORDER BY rp.scanned_out_at)
+                        FILTER (WHERE p.sku IS NOT NULL AND rp.in_exit_scan), '{}') AS exit_scans,
+                    COALESCE(array_agg(p.sku ORDER BY rp.scanned_in_at)
+                        FILTER (WHERE p.sku IS NOT NULL), '{}') AS item_ids
+                FROM (
+                    SELECT id, session_id, entry_time, duration_minutes, predicted_duration_minutes
+                    FROM sessions
+                    WHERE status = 'completed' AND duration_minutes IS NOT NULL AND id > %s
+                    ORDER BY id
+                    LIMIT %s
+                ) s
+                LEFT JOIN room_products rp ON rp.session_id = s.session_id
+                LEFT JOIN products p ON rp.product_id = p.id
+                GROUP BY s.id, s.session_id, s.entry_time, s.duration_minutes, s.predicted_duration_minutes
+                ORDER BY s.id
+            """, (after_id, limit))
+            return [{
+                'id': row['id'],
+                'session_id': row['session_id'],
+                'entry_time': row['entry_time'],
+                'actual_duration': float(row['duration_minutes']),
+                'predicted_duration': (float(row['predicted_duration_minutes'])
+                                       if row['predicted_duration_minutes'] is not None else None),
+                'item_ids': list(row['item_ids']),
+                'entry_scans': list(row['entry_scans']),
+                'exit_scans': list(row['exit_scans']),
+            } for row in cur.fetchall()]
+    finally:
+        if own_conn:
+            conn.close()
+
+def update_session_scores(scores: List[Tuple[str, bool, float, str]], conn=None) -> int:
+    """
+    Writes (session_id, is_anomaly, anomaly_score, risk_level) for many sessions
+    with one UPDATE ... FROM (VALUES ...) statement. Returns the number of rows updated.
+    """
+    if not scores:
+        return 0
+    own_conn = conn is None
+    conn = conn or get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, """
+                UPDATE sessions AS s SET
+                    is_anomaly = v.is_anomaly,
+                    anomaly_score = v.anomaly_score,
+                    risk_level = v.risk_level,
+                    updated_at = NOW()
+                FROM (VALUES %s) AS v (session_id, is_anomaly, anomaly_score, risk_level)
+                WHERE s.session_id = v.session_id
+            """, scores, template="(%s, %s::boolean, %s::numeric, %s)", page_size=len(scores))
+            updated = cur.rowcount
+        conn.commit()
+        return updated
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own_conn:
+            conn.close()
+
 def save_session_to_db(
     session_id: str,
     room_id: int,
@@ -237,15 +324,70 @@ def save_session_to_db(
                 ))
             
             conn.commit()
-            print(f"✓ Saved session {session_id} to database")
+            log.info("session_saved", session_id=session_id)
             
     except Exception as e:
         conn.rollback()
-        print(f"❌ Error saving session to database: {e}")
+        raise  # Logged by the caller
+    finally:
+        conn.close()
+
+def save_alerts(alert_type: str, alerts: List[Tuple[str, Optional[str], str, str]]) -> int:
+    """
+    Writes a batch of alerts of one type to the alerts table in one statement.
+    alerts: (room_id, session_id, severity, message) tuples. Room ids like "room_3"
+    map to rooms.id 3; alerts for rooms the database does not know are dropped, and
+    session_id is only linked if the session row exists.
+    Returns the number of alerts inserted.
+    """
+    rows = []
+    for room_id, session_id, severity, message in alerts:
+        try:
+            room_id_num = int(str(room_id).split('_')[-1])
+        except ValueError:
+            continue
+        rows.append((room_id_num, session_id, alert_type, severity, message))
+    if not rows:
+        return 0
+    conn = get_db_connection()
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, """
+                INSERT INTO alerts (room_id, session_id, alert_type, severity, message)
+                SELECT r.id, s.session_id, v.alert_type, v.severity, v.message
+                FROM (VALUES %s) AS v (room_id, session_id, alert_type, severity, message)
+                JOIN rooms r ON r.id = v.room_id
+                LEFT JOIN sessions s ON s.session_id = v.session_id
+            """, rows, page_size=len(rows))
+            inserted = cur.rowcount
+        conn.commit()
+        return inserted
+    except Exception:
+        conn.rollback()
         raise
     finally:
         conn.close()
 
+def save_overstay_alerts(alerts: List[Dict]) -> int:
+    """Writes a batch of OverstayMonitor alerts as 'overstay' alerts."""
+    return save_alerts('overstay', [(
+        alert['room_id'],
+        alert['session_id'],
+        alert['severity'],
+        f"Customer has been in {alert['room_id']} for {alert['elapsed_minutes']:.0f} minutes, "
+        f"{alert['excess_minutes']:.0f} minutes over the predicted {alert['predicted_duration']:.0f}.",
+    ) for alert in alerts])
+
+def save_missing_item_alerts(events: List[Dict]) -> int:
+    """Writes exit gate missing-item events as 'missing-item' alerts, like the backend's own."""
+    return save_alerts('missing-item', [(
+        event['room_id'],
+        event['session_id'],
+        'high',
+        f"Customer leaving {event['room_id']} with {len(event['missing_items'])} item(s) not scanned out "
+        f"({', '.join(event['missing_items'])}). Staff intervention required.",
+    ) for event in events])
+
 def sync_ai_data_to_db():
     """
     Sync AI training data from JSON/CSV files to database
@@ -0,0 +1,123 @@
+"""
+Monte Carlo wait-time forecast.
+Every session's duration is uncertain: the trees of the duration forest disagree,
+and that spread is used as the session's duration distribution. Thousands of
+rollouts of the current queue are simulated at once with NumPy, one array row per
+rollout, and the waits are summarised as quantiles instead of a single number.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+DEFAULT_QUANTILES = (0.1, 0.5, 0.9)
+
+
+class DurationDistributions:
+    """
+    Remembers the duration feature row of recent sessions so their per-tree
+    predictions can be computed when a forecast needs them. Tree predictions are
+    cached per model version.
+    """
+    def __init__(self, max_sessions: int = 20000):
+        self.max_sessions = max_sessions
+        self._features = OrderedDict()
+        self._samples = {}
+        self._samples_version = None
+        self._lock = threading.Lock()
+
+    def remember(self, session_id: str, features):
+        with self._lock:
+            self._features[session_id] = np.asarray(features, dtype=float).reshape(-1)
+            if len(self._features) > self.max_sessions:
+                old_id, _ = self._features.popitem(last=False)
+                self._samples.pop(old_id, None)
+
+    def per_tree(self, bundle, session_ids) -> dict:
+        """session_id -> per-tree duration predictions, for sessions with known features."""
+        with self._lock:
+            if self._samples_version != bundle.version:
+                self._samples, self._samples_version = {}, bundle.version
+            missing = [s for s in session_ids if s not in self._samples and s in self._features]
+            if missing:
+                predictions = bundle.duration_model.predict_per_tree(np.stack([self._features[s] for s in missing]))
+                for i, session_id in enumerate(missing):
+                    self._samples[session_id] = predictions[:, i]
+            return {s: self._samples[s] for s in session_ids if s in self._samples}
+
+
+def sample_remaining(tree_predictions: np.ndarray, elapsed: float, n: int, rng) -> np.ndarray:
+    """
+    Remaining minutes of a session already `elapsed` minutes in, drawn from the trees
+    that predict it is not over yet. If none do, the session has overrun every
+    prediction and is treated as about to end.
+    """
+    remaining = tree_predictions[tree_predictions > elapsed] - elapsed
+    if remaining.size == 0:
+        return np.zeros(n)
+    return rng.choice(remaining, size=n)
+
+
+def forecast_waits(rooms: list, queue: list, now: datetime, n_samples: int = 2000,
+                   quantiles=DEFAULT_QUANTILES, new_customer_features=None, seed: int | None = None) -> dict:
+    """
+    rooms: [{"room_id", "features", "entry_time" (None if free), "samples" (per-tree durations)}]
+    queue: waiting customers in service order, [{"session_id", "required_features", "samples"}]
+    new_customer_features: if not None, also forecasts the wait of a customer with
+    these required features joining the queue now.
+
+    Each rollout serves the queue in order, every customer taking the eligible room
+    that frees up first in that rollout, like RoomManager's promotion on release.
+    """
+    rng = np.random.default_rng(seed)
+    free_at = np.zeros((n_samples, len(rooms)))
+    room_forecasts = {}
+    for r, room in enumerate(rooms):
+        if room["entry_time"] is None:
+            continue
+        elapsed = max(0.0, (now - room["entry_time"]).total_seconds() / 60)
+        free_at[:, r] = sample_remaining(room["samples"], elapsed, n_samples, rng)
+        room_forecasts[room["room_id"]] = _quantiles(free_at[:, r], quantiles)
+
+    room_features = [frozenset(room["features"]) for room in rooms]
+    rollout = np.arange(n_samples)
+
+    def serve(required) -> tuple | None:
+        """(chosen room, start time) per rollout for the next customer needing `required`."""
+        eligible = np.array([frozenset(required) <= features for features in room_features])
+        if not eligible.any():
+            return None
+        masked = np.where(eligible[None, :], free_at, np.inf)
+        chosen = masked.argmin(axis=1)
+        return chosen, free_at[rollout, chosen]
+
+    customers = []
+    for position, customer in enumerate(queue, start=1):
+        served = serve(customer["required_features"])
+        entry = {"session_id": customer["session_id"], "waitlist_position": position}
+        if served is None:
+            customers.append({**entry, "wait_minutes": None})
+            continue
+        chosen, start = served
+        durations = rng.choice(customer["samples"], size=n_samples)
+        free_at[rollout, chosen] = start + durations
+        customers.append({**entry, "wait_minutes": _quantiles(start, quantiles)})
+
+    result = {
+        "generated_at": now.isoformat(),
+        "samples": n_samples,
+        "rooms": room_forecasts,
+        "waitlist": customers,
+    }
+    if new_customer_features is not None:
+        served = serve(new_customer_features)
+        result["new_customer"] = {
+            "required_features": sorted(new_customer_features),
+            "wait_minutes": _quantiles(served[1], quantiles) if served else None,
+        }
+    return result
+
+
+def _quantiles(values: np.ndarray, quantiles) -> dict:
+    return {f"p{round(q * 100):g}": round(float(v), 2) for q, v in zip(quantiles, np.quantile(values, quantiles))}
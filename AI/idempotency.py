@@ -0,0 +1,79 @@
+"""
+Idempotency cache for session-completing endpoints.
+Retries of /detect_anomaly after a gateway error carry the same session_id and
+body; the first response is stored and replayed, so a retry neither re-scores,
+re-saves nor releases the room a second time.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+
+class IdempotencyConflict(Exception):
+    """The key was already used with a different payload."""
+
+
+def payload_hash(payload) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyCache:
+    """
+    Bounded LRU of key -> (payload hash, response future, stored at), with a TTL.
+    A request arriving while the first one with its key is still running waits for
+    that result instead of running again. Failed requests are not remembered, so
+    they can be retried.
+    """
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 3600.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.clock = clock
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.conflicts = 0
+
+    async def run(self, key, payload, handler):
+        """Returns handler()'s response for the first call with `key`, and replays it for repeats."""
+        digest = payload_hash(payload)
+        now = self.clock()
+        entry = self._entries.get(key)
+        if entry is not None and now - entry[2] > self.ttl:
+            del self._entries[key]
+            entry = None
+        if entry is not None:
+            if entry[0] != digest:
+                self.conflicts += 1
+                raise IdempotencyConflict(f"{key[-1] if isinstance(key, tuple) else key} was already "
+                                          f"submitted with a different payload")
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return await asyncio.shield(entry[1])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = (digest, future, now)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        try:
+            response = await handler()
+        except BaseException as e:
+            if self._entries.get(key, (None, None))[1] is future:
+                del self._entries[key]
+            future.set_exception(e)
+            future.exception()  # Waiters get it re-raised; nobody else needs to retrieve it
+            raise
+        future.set_result(response)
+        return response
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "conflicts": self.conflicts,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
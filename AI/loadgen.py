@@ -0,0 +1,324 @@
+"""
+Asyncio load generator for the AI API.
+Drives a weighted mix of /assign_room, /predict_duration, /detect_anomaly and
+/rooms/status, either open-loop at a target request rate (--rate, arrivals are
+Poisson) or closed-loop with a fixed number of concurrent clients
+(--concurrency). Customers behave like real ones: /detect_anomaly completes a
+session that /assign_room started, so rooms are released and the waitlist
+moves; waiting customers are looked up with GET /waitlist and give up with
+DELETE /waitlist after --patience seconds. Connections are pooled and kept
+alive. Reports throughput, p50/p95/p99/max latency and error rates per endpoint,
+and the achieved mix next to the configured one. --in-process drives the ASGI app directly,
+with no server or network; client and API then share one event loop, so the
+latencies include the client's own overhead.
+
+Usage: python loadgen.py [--url http://localhost:8000 | --in-process] [--rate 200 | --concurrency 32]
+                         [--duration 30] [--mix assign_room=3,predict_duration=3,detect_anomaly=3,rooms_status=6]
+                         [--connections 64] [--json results.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+import httpx
+
+API_BASE_URL = "http://localhost:8000"
+DEFAULT_MIX = "assign_room=3,predict_duration=3,detect_anomaly=3,rooms_status=6"
+# Operation -> the endpoint it exercises; GET/DELETE /waitlist are follow-up calls outside the mix
+OPERATIONS = {"assign_room": "/assign_room", "predict_duration": "/predict_duration",
+              "detect_anomaly": "/detect_anomaly", "rooms_status": "/rooms/status"}
+
+
+def parse_mix(spec: str) -> dict:
+    """'assign_room=3,rooms_status=6' -> {'assign_room': 3.0, 'rooms_status': 6.0}"""
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition("=")
+        if name not in OPERATIONS:
+            raise ValueError(f"Unknown operation '{name}' (expected one of {tuple(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def load_skus() -> list:
+    try:
+        with open("data/item_database.json", "r") as f:
+            return list(json.load(f))
+    except FileNotFoundError:
+        return [f"sku-{i:04d}" for i in range(1, 101)]
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q / 100))]
+
+
+class Recorder:
+    """Latencies and outcomes per endpoint; only requests finishing inside the measured window count."""
+    def __init__(self):
+        self.latencies = {}  # endpoint -> [seconds]
+        self.statuses = {}   # endpoint -> Counter of status codes or exception names
+        self.measure_from = float("inf")  # perf_counter() at which the warm-up ends
+
+    def record(self, endpoint: str, latency: float, status):
+        if time.perf_counter() < self.measure_from:
+            return
+        self.latencies.setdefault(endpoint, []).append(latency)
+        self.statuses.setdefault(endpoint, Counter())[status] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        report = {}
+        for endpoint in sorted(self.latencies):
+            values = sorted(self.latencies[endpoint])
+            statuses = self.statuses[endpoint]
+            errors = sum(n for status, n in statuses.items() if not (isinstance(status, int) and status < 400))
+            report[endpoint] = {
+                "requests": len(values),
+                "throughput_rps": round(len(values) / elapsed, 1),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p95_ms": round(percentile(values, 95) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2),
+                "error_rate": round(errors / len(values), 4),
+                "statuses": {str(status): n for status, n in sorted(statuses.items(), key=str)},
+            }
+        return report
+
+
+class Workload:
+    """
+    Issues one operation of the mix at a time. Sessions started by /assign_room are
+    kept until /detect_anomaly checks them out, oldest seated session first. With
+    nobody seated, the longest-waiting ticket is looked up: if it has been given a
+    room it is checked out, otherwise it keeps its place at the front of the line,
+    and a customer who has waited longer than `patience` seconds cancels the ticket.
+    """
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, mix: dict, skus: list, seed: int,
+                 patience: float = 60.0):
+        self.client = client
+        self.recorder = recorder
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.skus = skus
+        self.rng = random.Random(seed)
+        self.patience = patience
+        self.seated = deque()   # (session_id, room_id, items, predicted, started_at), oldest first
+        self.waiting = deque()  # Same, with room_id None, longest waiting first
+
+    async def request(self, endpoint: str, method: str, path: str, scheduled_at: float = None, **kwargs):
+        """Sends a request; latency counts from `scheduled_at` when given, so a backlog is not hidden."""
+        started_at = scheduled_at if scheduled_at is not None else time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            self.recorder.record(endpoint, time.perf_counter() - started_at, type(e).__name__)
+            return None
+        self.recorder.record(endpoint, time.perf_counter() - started_at, response.status_code)
+        return response
+
+    def basket(self) -> list:
+        return self.rng.sample(self.skus, self.rng.randint(1, min(5, len(self.skus))))
+
+    async def run_one(self, scheduled_at: float = None):
+        operation = self.rng.choices(self.operations, self.weights)[0]
+        await getattr(self, operation)(scheduled_at)
+
+    async def assign_room(self, scheduled_at=None):
+        items = self.basket()
+        response = await self.request("/assign_room", "POST", "/assign_room", scheduled_at, json={"item_ids": items})
+        if response is not None and response.status_code == 200:
+            body = response.json()
+            session = (body["session_id"], body["assigned_room_id"], items, body["predicted_duration_minutes"],
+                       datetime.now())
+            if body["status"] == "assigned":
+                self.seated.append(session)
+            else:
+                self.waiting.append(session[:1] + (None,) + session[2:])
+
+    async def predict_duration(self, scheduled_at=None):
+        await self.request("/predict_duration", "POST", "/predict_duration", scheduled_at,
+                           json={"item_ids": self.basket(), "entry_time": datetime.now().isoformat()})
+
+    async def rooms_status(self, scheduled_at=None):
+        await self.request("/rooms/status", "GET", "/rooms/status", scheduled_at)
+
+    async def next_seated(self) -> tuple | None:
+        """The oldest seated session; with nobody seated, checks whether the longest-waiting ticket got a room."""
+        if self.seated:
+            return self.seated.popleft()
+        if not self.waiting:
+            return None
+        session = self.waiting.popleft()
+        session_id, started_at = session[0], session[4]
+        response = await self.request("GET /waitlist", "GET", f"/waitlist/{session_id}")
+        ticket = response.json() if response is not None and response.status_code == 200 else None
+        if ticket and ticket["status"] == "assigned":
+            return session[:1] + (ticket["room_id"],) + session[2:]
+        if ticket and ticket["status"] == "waiting":
+            if (datetime.now() - started_at).total_seconds() < self.patience:
+                self.waiting.appendleft(session)  # Keeps its place: rooms go to the waitlist in arrival order
+            else:
+                await self.request("DELETE /waitlist", "DELETE", f"/waitlist/{session_id}")
+        return None
+
+    async def detect_anomaly(self, scheduled_at=None):
+        session = await self.next_seated()
+        if session is None:
+            if not self.waiting:
+                await self.assign_room(scheduled_at)  # Nobody to check out yet
+            return
+        session_id, room_id, items, predicted, started_at = session
+        # One customer in thirty leaves with an item
+        exit_scans = items[1:] if self.rng.random() < 1 / 30 else items
+        await self.request("/detect_anomaly", "POST", "/detect_anomaly", scheduled_at, json={
+            "session_id": session_id,
+            "room_id": room_id,
+            "actual_duration": round(max(0.5, self.rng.gauss(predicted, predicted / 4)), 2),
+            "predicted_duration": predicted,
+            "entry_scans": items,
+            "exit_scans": exit_scans,
+            "entry_time": started_at.isoformat(),
+        })
+
+
+async def run_closed_loop(workload: Workload, concurrency: int, until: float):
+    async def client_loop():
+        while time.perf_counter() < until:
+            await workload.run_one()
+            # The in-process app may answer without suspending; let the other clients run
+            await asyncio.sleep(0)
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+
+
+async def run_open_loop(workload: Workload, rate: float, until: float, max_in_flight: int) -> int:
+    """Starts operations at Poisson arrival times; returns how many arrivals were dropped at max_in_flight."""
+    in_flight, dropped = set(), 0
+    next_at = time.perf_counter()
+    while next_at < until:
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if len(in_flight) >= max_in_flight:
+            dropped += 1
+        else:
+            task = asyncio.create_task(workload.run_one(scheduled_at=next_at))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        next_at += workload.rng.expovariate(rate)
+    if in_flight:
+        await asyncio.gather(*in_flight)
+    return dropped
+
+
+@contextlib.asynccontextmanager
+async def open_client(args):
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    timeout = httpx.Timeout(args.timeout)
+    if not args.in_process:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as client:
+            yield client
+        return
+    # The API's own console output (startup, database warnings) would bury the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import api
+        async with api.app.router.lifespan_context(api.app):
+            while api.startup_state["stage"] not in ("ready", "failed"):
+                await asyncio.sleep(0.05)
+            if api.startup_state["stage"] == "failed":
+                raise RuntimeError(f"API startup failed: {api.startup_state['error']}")
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://loadgen",
+                                         limits=limits, timeout=timeout) as client:
+                yield client
+
+
+async def run(args) -> dict:
+    mix = parse_mix(args.mix)
+    recorder = Recorder()
+    mode = f"{args.rate:g} req/s open loop" if args.rate else f"{args.concurrency} concurrent clients"
+    target = "in-process ASGI app" if args.in_process else args.url
+    print(f"Load test against {target}: {mode}, {args.warmup:g}s warm-up + {args.duration:g}s measured")
+    async with open_client(args) as client:
+        workload = Workload(client, recorder, mix, load_skus(), args.seed, args.patience)
+        warmup_ends = time.perf_counter() + args.warmup
+        until = warmup_ends + args.duration
+        recorder.measure_from = warmup_ends
+        if args.rate:
+            dropped = await run_open_loop(workload, args.rate, until, args.max_in_flight)
+        else:
+            await run_closed_loop(workload, args.concurrency, until)
+            dropped = 0
+        # Requests still running after the window count too, so the divisor covers them
+        elapsed = max(time.perf_counter() - warmup_ends, 1e-9)
+    endpoints = recorder.summary(elapsed)
+    return {"mode": mode, "target": target, "duration_s": round(elapsed, 2), "dropped_arrivals": dropped,
+            "endpoints": endpoints, "mix": mix_summary(mix, endpoints)}
+
+
+def mix_summary(mix: dict, endpoints: dict) -> dict:
+    """Configured and achieved share of each operation, counting the requests to its endpoint."""
+    done = {name: endpoints.get(endpoint, {}).get("requests", 0) for name, endpoint in OPERATIONS.items()
+            if name in mix}
+    total_weight, total_done = sum(mix.values()), max(sum(done.values()), 1)
+    return {name: {"configured": round(mix[name] / total_weight, 3), "achieved": round(n / total_done, 3)}
+            for name, n in done.items()}
+
+
+def print_report(result: dict):
+    endpoints = result["endpoints"]
+    print("=" * 104)
+    print(f"{'endpoint':<24} | {'requests':>8} | {'req/s':>8} | {'p50 ms':>8} | {'p95 ms':>8} | "
+          f"{'p99 ms':>8} | {'max ms':>8} | {'errors':>7}")
+    print("-" * 104)
+    for endpoint, r in endpoints.items():
+        print(f"{endpoint:<24} | {r['requests']:>8} | {r['throughput_rps']:>8.1f} | {r['p50_ms']:>8.2f} | "
+              f"{r['p95_ms']:>8.2f} | {r['p99_ms']:>8.2f} | {r['max_ms']:>8.2f} | {r['error_rate']:>7.2%}")
+    total = sum(r["requests"] for r in endpoints.values())
+    print("-" * 104)
+    print(f"{'total':<24} | {total:>8} | {total / result['duration_s']:>8.1f}")
+    for endpoint, r in endpoints.items():
+        failures = {status: n for status, n in r["statuses"].items() if not status.isdigit() or int(status) >= 400}
+        if failures:
+            print(f"⚠ {endpoint}: {failures}")
+    print("Mix (configured -> achieved): " + ", ".join(
+        f"{name} {share['configured']:.0%} -> {share['achieved']:.0%}" for name, share in result["mix"].items()))
+    short = [name for name, share in result["mix"].items() if share["achieved"] < 0.8 * share["configured"]]
+    if "detect_anomaly" in short:
+        print("⚠ detect_anomaly fell short of the mix: only seated sessions can check out, so checkouts are "
+              "capped by the number of rooms (raise ROOM_COUNT on the API)")
+    if result["dropped_arrivals"]:
+        print(f"⚠ {result['dropped_arrivals']} arrivals dropped: --max-in-flight requests were already waiting")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--url", default=API_BASE_URL)
+    parser.add_argument("--in-process", action="store_true", help="Drive the ASGI app in this process (no network)")
+    parser.add_argument("--rate", type=float, default=0.0, help="Target requests per second (open loop)")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent clients when no --rate is given")
+    parser.add_argument("--duration", type=float, default=30.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds of load before measuring")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Operation weights")
+    parser.add_argument("--patience", type=float, default=60.0,
+                        help="Seconds a waitlisted customer waits before cancelling the ticket")
+    parser.add_argument("--connections", type=int, default=64, help="Keep-alive connection pool size")
+    parser.add_argument("--max-in-flight", type=int, default=2000, help="Open loop: cap on outstanding requests")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"✓ Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
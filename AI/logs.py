@@ -0,0 +1,60 @@
+"""
+Structured event logging for hot paths.
+Each event is one logfmt line, e.g.
+    component=RoomManager event=released room_id=room_1 session_id=4f1c...
+so it can be grepped or shipped to a log pipeline as is. A disabled level costs
+one cached comparison: fields are only formatted for events that are written.
+LOG_LEVEL (default INFO) sets the level; per-room assign/release events are DEBUG.
+"""
+import logging
+import sys
+
+from decouple import config
+
+_root = logging.getLogger("fitting_room")
+if not _root.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    _root.addHandler(_handler)
+    _root.setLevel(config('LOG_LEVEL', default='INFO').upper())
+    _root.propagate = False
+
+
+def format_value(value) -> str:
+    text = str(value).strip()
+    if not text or any(c in text for c in ' "=\n\t'):
+        # Escaped so each event stays on one line
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"').replace("\n", "\\n").replace("\t", "\\t") + '"'
+    return text
+
+
+def format_event(component: str, event: str, fields: dict) -> str:
+    return " ".join([f"component={component}", f"event={event}"]
+                    + [f"{name}={format_value(value)}" for name, value in fields.items()])
+
+
+class EventLogger:
+    __slots__ = ("component", "_logger")
+
+    def __init__(self, component: str):
+        self.component = component
+        self._logger = logging.getLogger(f"fitting_room.{component}")
+
+    def debug(self, event: str, **fields):
+        if self._logger.isEnabledFor(logging.DEBUG):
+            self._logger.debug(format_event(self.component, event, fields))
+
+    def info(self, event: str, **fields):
+        if self._logger.isEnabledFor(logging.INFO):
+            self._logger.info(format_event(self.component, event, fields))
+
+    def warning(self, event: str, **fields):
+        if self._logger.isEnabledFor(logging.WARNING):
+            self._logger.warning(format_event(self.component, event, fields))
+
+    def set_level(self, level: str):
+        self._logger.setLevel(level.upper())
+
+
+def get_logger(component: str) -> EventLogger:
+    return EventLogger(component)
@@ -0,0 +1,222 @@
+"""
+In-process metrics, exposed on /metrics in the Prometheus text format.
+Latencies go into log-linear (HDR-style) histograms: every power of two is split
+into a few equal-width buckets, so any latency from 50 µs to a minute is known
+to within 25% with under a hundred fixed buckets. Observing a value is a
+bisect and a few integer updates; nothing is formatted until /metrics is scraped.
+Request-scoped stage timings are collected per request and labelled with the
+matched route when the request ends.
+"""
+import asyncio
+import bisect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+def log_linear_bounds(lowest: float, highest: float, sub_buckets: int = 4) -> tuple:
+    """Bucket edges from `lowest` to at least `highest`, `sub_buckets` equal steps per doubling."""
+    bounds, base = [], lowest
+    while not bounds or bounds[-1] < highest:
+        bounds.extend(base * (1 + i / sub_buckets) for i in range(1, sub_buckets + 1))
+        base *= 2
+    return tuple(float(f"{b:.6g}") for b in bounds)
+
+
+LATENCY_BOUNDS = log_linear_bounds(0.00005, 60.0)  # Seconds
+
+
+class Histogram:
+    """Fixed-bucket histogram; `bounds` are the inclusive upper edges of the buckets."""
+    def __init__(self, bounds):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float | None:
+        """Upper edge of the bucket holding the q-th percentile (q in 0..100); the max beyond the last edge."""
+        if not self.count:
+            return None
+        rank, seen = q / 100 * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def describe(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 4) if self.count else None,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "buckets": {("+Inf" if i == len(self.bounds) else f"{self.bounds[i]:g}"): n
+                        for i, n in enumerate(self.counts)},
+        }
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def histogram_lines(name: str, labels: dict, histogram: Histogram) -> list:
+    lines, cumulative = [], 0
+    for bound, n in zip(histogram.bounds, histogram.counts):
+        cumulative += n
+        lines.append(f"{name}_bucket{format_labels({**labels, 'le': f'{bound:g}'})} {cumulative}")
+    lines.append(f"{name}_bucket{format_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+    lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:.9g}")
+    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+    return lines
+
+
+class HistogramFamily:
+    """Histograms of one metric, one per combination of label values."""
+    def __init__(self, name: str, help_text: str, labelnames: tuple, bounds=LATENCY_BOUNDS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.bounds = bounds
+        self._children = {}
+
+    def labels(self, *values) -> Histogram:
+        histogram = self._children.get(values)
+        if histogram is None:
+            histogram = self._children.setdefault(values, Histogram(self.bounds))
+        return histogram
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for values, histogram in sorted(self._children.items()):
+            lines.extend(histogram_lines(self.name, dict(zip(self.labelnames, values)), histogram))
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Histogram families plus collectors, callables returning
+    [(name, type, help, [(labels dict, value), ...]), ...] read at scrape time,
+    so gauges such as cache sizes cost nothing between scrapes.
+    """
+    def __init__(self):
+        self._families = {}
+        self._collectors = []
+
+    def histogram(self, name: str, help_text: str, labelnames: tuple = (), bounds=LATENCY_BOUNDS) -> HistogramFamily:
+        family = self._families.get(name)
+        if family is None:
+            family = self._families[name] = HistogramFamily(name, help_text, labelnames, bounds)
+        return family
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for family in self._families.values():
+            lines.extend(family.render())
+        for collector in self._collectors:
+            for name, metric_type, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+request_seconds = registry.histogram(
+    "fitting_room_request_duration_seconds", "Time from receiving a request to the end of its response.",
+    ("endpoint", "method", "status"))
+stage_seconds = registry.histogram(
+    "fitting_room_stage_duration_seconds", "Time spent in one stage of handling a request.",
+    ("endpoint", "stage"))
+loop_lag_seconds = registry.histogram(
+    "fitting_room_event_loop_lag_seconds", "How late the event loop woke up a sleeping task.")
+
+
+class RequestTimer:
+    __slots__ = ("started_at", "stages")
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages = []  # (stage, seconds)
+
+
+_current_request: ContextVar = ContextVar("current_request", default=None)
+
+
+def record_stage(stage: str, seconds: float):
+    """Adds a stage timing to the current request; outside a request it is recorded right away."""
+    timer = _current_request.get()
+    if timer is None:
+        stage_seconds.labels("background", stage).observe(seconds)
+    else:
+        timer.stages.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage: str):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - started_at)
+
+
+def mark_validated():
+    """Called first thing in a handler: routing, body parsing and validation are done."""
+    timer = _current_request.get()
+    if timer is not None:
+        timer.stages.append(("validation", time.perf_counter() - timer.started_at))
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request under its route template (/sessions/{session_id}/complete)."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timer = RequestTimer()
+        token = _current_request.set(timer)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _current_request.reset(token)
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or ("unmatched" if status[0] != 429 else "shed")
+            request_seconds.labels(endpoint, scope["method"], str(status[0])).observe(
+                time.perf_counter() - timer.started_at)
+            for stage, seconds in timer.stages:
+                stage_seconds.labels(endpoint, stage).observe(seconds)
+
+
+async def monitor_loop_lag(interval: float = 0.25):
+    """Samples event loop lag forever: how much later than asked a sleep returns."""
+    while True:
+        started_at = time.perf_counter()
+        await asyncio.sleep(interval)
+        loop_lag_seconds.labels().observe(max(0.0, time.perf_counter() - started_at - interval))
+
@@ -0,0 +1,233 @@
+"""
+Versioned model registry for the AI service.
+Holds the served DurationPredictor/AnomalyDetector pair as one immutable bundle,
+so a reload swaps both models with a single reference assignment while
+in-flight requests finish on the bundle they started with.
+"""
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from models import DurationPredictor, AnomalyDetector
+
+DURATION_MODEL_PATH = 'models/duration_model.pkl'
+ANOMALY_MODEL_PATH = 'models/anomaly_model.pkl'
+
+# Plausible range for a fitting room session, used by the sanity check
+MIN_SANE_DURATION = 0.5
+MAX_SANE_DURATION = 240.0
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    """One loaded, warmed-up and sanity-checked version of both models."""
+    version: str
+    duration_model: DurationPredictor
+    anomaly_model: AnomalyDetector
+    loaded_at: datetime
+    artifact_mtimes: dict = field(default_factory=dict)
+
+    def describe(self) -> dict:
+        return {
+            "version": self.version,
+            "loaded_at": self.loaded_at.isoformat(),
+            "artifacts": {path: datetime.fromtimestamp(mtime).isoformat()
+                          for path, mtime in self.artifact_mtimes.items()},
+        }
+
+
+class ModelRegistry:
+    """
+    Loads model versions off the request path and atomically publishes them.
+    Readers take `registry.current` once per request and use only that bundle.
+    """
+    def __init__(self, duration_path: str = DURATION_MODEL_PATH,
+                 anomaly_path: str = ANOMALY_MODEL_PATH, item_database_provider=None):
+        self.duration_path = duration_path
+        self.anomaly_path = anomaly_path
+        # Callable returning the item catalog; used to build realistic warm-up baskets
+        self.item_database_provider = item_database_provider or (lambda: {})
+        self._current: ModelBundle | None = None
+        self._reload_lock = threading.Lock()
+
+    @property
+    def current(self) -> ModelBundle | None:
+        return self._current
+
+    def _artifact_paths(self) -> list:
+        return [self.duration_path, self.anomaly_path]
+
+    def artifact_mtimes(self) -> dict:
+        return {path: os.path.getmtime(path) for path in self._artifact_paths() if os.path.exists(path)}
+
+    def compute_version(self) -> str:
+        """Content hash of both artifacts, so identical files always map to the same version."""
+        digest = hashlib.sha1()
+        for path in self._artifact_paths():
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(chunk)
+        return digest.hexdigest()[:12]
+
+    def _warm_up_batch(self, duration_model: DurationPredictor) -> tuple:
+        """Builds a small synthetic batch of duration and anomaly feature rows."""
+        item_db = self.item_database_provider() or {}
+        skus = sorted(item_db.keys())
+        baskets = [skus[i:i + size] for i, size in ((0, 1), (1, 2), (3, 3), (0, 5))] if skus else [[]] * 4
+        base_time = datetime(2025, 1, 6, 10, 0)
+        duration_rows = [
+            duration_model.extract_features(basket, item_db, base_time + timedelta(hours=8 * i))[0]
+            for i, basket in enumerate(baskets)
+        ]
+        anomaly_sessions = [
+            # Clean session, slow session, and one with a missing item
+            {'actual_duration': 10, 'predicted_duration': 10, 'entry_scans': ['a', 'b'],
+             'exit_scans': ['a', 'b'], 'entry_time': base_time},
+            {'actual_duration': 45, 'predicted_duration': 12, 'entry_scans': ['a'],
+             'exit_scans': ['a'], 'entry_time': base_time},
+            {'actual_duration': 8, 'predicted_duration': 10, 'entry_scans': ['a', 'b'],
+             'exit_scans': ['a'], 'entry_time': base_time},
+        ]
+        return np.array(duration_rows), anomaly_sessions
+
+    def _warm_up_and_check(self, duration_model: DurationPredictor, anomaly_model: AnomalyDetector):
+        """
+        Runs the synthetic batch through both models. The first calls pay sklearn's
+        lazy validation and allocation costs here instead of on a live request.
+        """
+        X_duration, anomaly_sessions = self._warm_up_batch(duration_model)
+
+        predictions = duration_model.model.predict(X_duration)
+        for row in X_duration:
+            duration_model.predict(row.reshape(1, -1))
+        if not np.all(np.isfinite(predictions)):
+            raise ValueError("Duration model produced non-finite predictions on the sanity batch")
+        if predictions.min() < MIN_SANE_DURATION or predictions.max() > MAX_SANE_DURATION:
+            raise ValueError(
+                f"Duration model predictions out of range on the sanity batch: "
+                f"{predictions.min():.2f}-{predictions.max():.2f} minutes"
+            )
+
+        X_anomaly = np.vstack([anomaly_model.extract_features(s) for s in anomaly_sessions])
+        results = [anomaly_model.predict_with_score(row.reshape(1, -1)) for row in X_anomaly]
+        for result in results:
+            if not 0.0 <= result['anomaly_score'] <= 1.0:
+                raise ValueError(f"Anomaly model produced an out-of-range score: {result['anomaly_score']}")
+        # Missing items are flagged by rule whatever the forest says, so judge the forest on its own scores
+        clean, slow, missing = anomaly_model.forest_scores(X_anomaly)
+        if not np.all(np.isfinite([clean, slow, missing])):
+            raise ValueError("Anomaly model produced non-finite scores on the sanity batch")
+        if not (slow < clean and missing < clean):
+            raise ValueError(
+                f"Anomaly model does not score the slow ({slow:.3f}) and missing-item ({missing:.3f}) "
+                f"sessions below the clean one ({clean:.3f})"
+            )
+
+    @staticmethod
+    def _load_artifact(model_class, path: str) -> tuple:
+        """
+        Reads the file once and unpickles the bytes that were read, so the model,
+        its content hash and its mtime all describe the same file even if a new
+        one replaces it meanwhile. Returns (bytes, model, mtime).
+        """
+        with open(path, 'rb') as f:
+            data = f.read()
+            mtime = os.fstat(f.fileno()).st_mtime
+        buffer = io.BytesIO(data)
+        buffer.name = path
+        return data, model_class.load(buffer), mtime
+
+    def load_artifacts(self) -> dict:
+        """Unpickles both models concurrently. Needs nothing but the files on disk."""
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            duration_future = pool.submit(self._load_artifact, DurationPredictor, self.duration_path)
+            anomaly_future = pool.submit(self._load_artifact, AnomalyDetector, self.anomaly_path)
+            duration_bytes, duration_model, duration_mtime = duration_future.result()
+            anomaly_bytes, anomaly_model, anomaly_mtime = anomaly_future.result()
+        # Same digest as compute_version() over the bytes actually loaded
+        digest = hashlib.sha1(duration_bytes)
+        digest.update(anomaly_bytes)
+        return {
+            "version": digest.hexdigest()[:12],
+            "duration_model": duration_model,
+            "anomaly_model": anomaly_model,
+            "artifact_mtimes": {self.duration_path: duration_mtime, self.anomaly_path: anomaly_mtime},
+        }
+
+    def build_bundle(self, artifacts: dict) -> ModelBundle:
+        """Warms up and validates loaded artifacts. Does not publish."""
+        self._warm_up_and_check(artifacts["duration_model"], artifacts["anomaly_model"])
+        return ModelBundle(loaded_at=datetime.now(), **artifacts)
+
+    def load_bundle(self) -> ModelBundle:
+        """Loads both artifacts from disk, warms them up and validates them. Does not publish."""
+        return self.build_bundle(self.load_artifacts())
+
+    def publish(self, bundle: ModelBundle) -> ModelBundle | None:
+        """Makes `bundle` the serving version and returns the one it replaced."""
+        previous = self._current
+        self._current = bundle  # Single reference assignment: readers see old or new, never a mix
+        print(f"✓ Model version {bundle.version} is now serving"
+              + (f" (replaced {previous.version})" if previous else ""))
+        return previous
+
+    def reload(self, force: bool = False) -> dict:
+        """
+        Loads a new version and swaps it in if it passed the sanity checks.
+        A failed load leaves the currently served version untouched.
+        """
+        with self._reload_lock:
+            previous = self._current
+            if previous and not force and self.compute_version() == previous.version:
+                return {"status": "unchanged", "version": previous.version}
+
+            bundle = self.load_bundle()
+            self.publish(bundle)
+            return {
+                "status": "reloaded",
+                "version": bundle.version,
+                "previous_version": previous.version if previous else None,
+            }
+
+
+class ModelFileWatcher(threading.Thread):
+    """
+    Polls the model artifacts and triggers a registry reload when they change.
+    A change is only acted on once the mtimes are stable across two polls,
+    so a pickle that is still being written is never loaded.
+    """
+    def __init__(self, registry: ModelRegistry, interval: float = 30.0):
+        super().__init__(name="model-file-watcher", daemon=True)
+        self.registry = registry
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        bundle = self.registry.current
+        seen = bundle.artifact_mtimes if bundle else self.registry.artifact_mtimes()
+        pending = None
+        while not self._stop_event.wait(self.interval):
+            mtimes = self.registry.artifact_mtimes()
+            if mtimes == seen:
+                pending = None
+                continue
+            if mtimes != pending:
+                pending = mtimes  # Changed since last poll; wait for the writer to finish
+                continue
+            try:
+                result = self.registry.reload()
+                print(f"  [ModelFileWatcher] Artifacts changed: {result['status']} ({result['version']})")
+            except Exception as e:
+                print(f"⚠ Model reload rejected, keeping version "
+                      f"{self.registry.current.version if self.registry.current else None}: {e}")
+            seen = mtimes
+            pending = None
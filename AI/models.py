@@ -5,6 +5,11 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.pipeline import Pipeline
 import joblib
 import os
+from datetime import datetime
+
+from logs import get_logger
+
+log = get_logger("AnomalyDetector")
 
 
 class DurationPredictor:
@@ -30,6 +35,15 @@ class DurationPredictor:
         Extract features from items and temporal data.
         Returns: numpy array of shape (1, n_features)
         """
+        return self.combine_features(self.extract_item_features(item_ids, item_db), entry_time)
+
+    @staticmethod
+    def extract_item_features(item_ids, item_db):
+        """
+        Basket-level part of the feature vector. Depends only on the items and the
+        catalog, so callers may cache it per basket.
+        Returns: list of 10 values
+        """
         items = [item_db.get(id, {}) for id in item_ids]
 
         # Item-level features
@@ -48,7 +62,15 @@ class DurationPredictor:
         has_zipper = int(any(i.get('has_zipper', False) for i in items))
         has_buttons = int(any(i.get('has_buttons', False) for i in items))
 
-        # Temporal features
+        return [
+            num_items, avg_price, max_price, avg_complexity, max_complexity,
+            num_jackets, num_pants, num_dresses,
+            has_zipper, has_buttons,
+        ]
+
+    @staticmethod
+    def extract_temporal_features(entry_time):
+        """Time-of-entry part of the feature vector. Returns: list of 4 values"""
         # Ensure entry_time is a datetime object
         if isinstance(entry_time, str):
             entry_time = pd.to_datetime(entry_time)
@@ -62,14 +84,12 @@ class DurationPredictor:
         is_weekend = int(entry_time.weekday() >= 5)  # Changed from dayofweek to weekday()
         is_evening = int(17 <= entry_time.hour <= 20)
 
-        features = np.array([
-            num_items, avg_price, max_price, avg_complexity, max_complexity,
-            num_jackets, num_pants, num_dresses,
-            has_zipper, has_buttons,
-            hour, day_of_week, is_weekend, is_evening
-        ]).reshape(1, -1)
+        return [hour, day_of_week, is_weekend, is_evening]
 
-        return features
+    @classmethod
+    def combine_features(cls, item_features, entry_time):
+        """Joins precomputed basket features with the temporal features for entry_time."""
+        return np.array(list(item_features) + cls.extract_temporal_features(entry_time)).reshape(1, -1)
 
     def train(self, X, y):
         """Train the model"""
@@ -83,24 +103,54 @@ class DurationPredictor:
             raise ValueError("Model not trained yet!")
         return self.model.predict(X)[0]
 
+    def predict_batch(self, X):
+        """Predicted durations for every row of X in one call"""
+        if not self.is_trained:
+            raise ValueError("Model not trained yet!")
+        return self.model.predict(X)
+
+    def predict_per_tree(self, X):
+        """
+        Predictions of every tree in the forest, shape (n_trees, n_rows).
+        Their mean is predict(); their spread is the model's uncertainty.
+        Calls the fitted trees directly, skipping sklearn's per-call validation.
+        """
+        if not self.is_trained:
+            raise ValueError("Model not trained yet!")
+        X_scaled = np.ascontiguousarray(self.model.named_steps['scaler'].transform(X), dtype=np.float32)
+        trees = self.model.named_steps['rf'].estimators_
+        return np.stack([tree.tree_.predict(X_scaled).reshape(len(X_scaled)) for tree in trees])
+
     def save(self, path='models/duration_model.pkl'):
         """Save trained model"""
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        joblib.dump(self.model, path)
+        # Write to a temp file and rename so a running API never loads a half-written pickle
+        tmp_path = f"{path}.tmp"
+        joblib.dump(self.model, tmp_path)
+        os.replace(tmp_path, path)
         print(f"✓ Duration model saved to {path}")
 
     @classmethod
     def load(cls, path='models/duration_model.pkl'):
-        """Load trained model"""
-        if not os.path.exists(path):
+        """Load trained model from a path or an open binary file"""
+        if isinstance(path, str) and not os.path.exists(path):
             raise FileNotFoundError(f"Model not found at {path}. Train first!")
         instance = cls()
         instance.model = joblib.load(path)
         instance.is_trained = True
-        print(f"✓ Duration model loaded from {path}")
+        print(f"✓ Duration model loaded from {getattr(path, 'name', path)}")
         return instance
 
 
+def _entry_hour(entry_time):
+    if isinstance(entry_time, str):
+        try:
+            return datetime.fromisoformat(entry_time.replace('Z', '+00:00')).hour
+        except ValueError:
+            return pd.to_datetime(entry_time).hour
+    return entry_time.hour
+
+
 class AnomalyDetector:
     """
     Detects suspicious behavior using Isolation Forest.
@@ -163,6 +213,33 @@ class AnomalyDetector:
 
         return features
 
+    def extract_features_batch(self, sessions):
+        """
+        extract_features for many sessions at once.
+        Returns: numpy array of shape (len(sessions), n_features)
+        """
+        actual_dur = np.array([s.get('actual_duration', 10) for s in sessions], dtype=float)
+        predicted_dur = np.array([s.get('predicted_duration', 10) for s in sessions], dtype=float)
+
+        # Scan pattern features
+        entry_scans = [s.get('entry_scans', []) for s in sessions]
+        exit_scans = [s.get('exit_scans', []) for s in sessions]
+        num_missing = [len(set(entry) - set(exit)) for entry, exit in zip(entry_scans, exit_scans)]
+
+        # Temporal features, in each entry time's own time zone like extract_features
+        hour = np.array([_entry_hour(s.get('entry_time')) for s in sessions])
+
+        return np.column_stack([
+            actual_dur,
+            actual_dur / np.maximum(predicted_dur, 1),
+            actual_dur - predicted_dur,
+            [len(scans) for scans in entry_scans],
+            [len(scans) for scans in exit_scans],
+            num_missing,
+            hour,
+            (hour < 6) | (hour > 22),
+        ]).astype(float)
+
     def train(self, X):
         """Train the anomaly detection model"""
         self.model.fit(X)
@@ -183,46 +260,68 @@ class AnomalyDetector:
         Returns both prediction and anomaly score.
         Lower scores indicate more anomalous behavior.
         """
+        return self.predict_with_score_batch(X)[0]
+
+    def forest_scores(self, X):
+        """
+        Raw isolation forest decision_function for every row of X (lower = more
+        anomalous), without the missing-item override.
+        """
+        if not self.is_trained:
+            raise ValueError("Model not trained yet!")
+        return self.model.named_steps['iso'].decision_function(
+            self.model.named_steps['scaler'].transform(np.asarray(X)))
+
+    def predict_with_score_batch(self, X):
+        """
+        predict_with_score for every row of X, scaling and scoring the whole
+        matrix at once. Returns one result dict per row.
+        """
         if not self.is_trained:
             raise ValueError("Model not trained yet!")
 
-        prediction = self.model.predict(X)[0]
+        X = np.asarray(X)
+        X_scaled = self.model.named_steps['scaler'].transform(X)
+        iso = self.model.named_steps['iso']
+        prediction = iso.predict(X_scaled)
         # Score samples: lower = more anomalous
-        score = self.model.named_steps['iso'].decision_function(
-            self.model.named_steps['scaler'].transform(X)
-        )[0]
+        score = iso.decision_function(X_scaled)
 
         # Convert decision_function score to a 0-1 probability (higher = more anomalous)
         anomaly_prob = 1 / (1 + np.exp(score * 5)) # Multiplied by 5 to make the curve steeper
 
         # === FIXED LOGIC START: Rule-based override for missing items ===
-        num_missing_items = X[0, 5] # 'num_missing' is the 6th feature (index 5) in extract_features
+        num_missing_items = X[:, 5] # 'num_missing' is the 6th feature (index 5) in extract_features
+        missing = num_missing_items > 0
 
-        if num_missing_items > 0:
-            anomaly_prob = max(anomaly_prob, 0.9) # Force high anomaly probability
-            prediction = -1 # Force anomaly prediction
-            print(f"  [AnomalyDetector] FORCING ANOMALY: {num_missing_items} item(s) missing from scans.")
+        anomaly_prob = np.where(missing, np.maximum(anomaly_prob, 0.9), anomaly_prob) # Force high anomaly probability
+        prediction = np.where(missing, -1, prediction) # Force anomaly prediction
+        if missing.any():
+            log.info("forced_anomaly", sessions=int(missing.sum()), missing_items=int(num_missing_items[missing].sum()))
         # === FIXED LOGIC END ===
 
-        return {
-            'is_anomaly': prediction == -1,
-            'anomaly_score': round(float(anomaly_prob), 3),
-            'risk_level': 'high' if anomaly_prob > 0.7 else 'medium' if anomaly_prob > 0.4 else 'low'
-        }
+        return [{
+            'is_anomaly': bool(p == -1),
+            'anomaly_score': round(float(prob), 3),
+            'risk_level': 'high' if prob > 0.7 else 'medium' if prob > 0.4 else 'low'
+        } for p, prob in zip(prediction, anomaly_prob)]
 
     def save(self, path='models/anomaly_model.pkl'):
         """Save trained model"""
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        joblib.dump(self.model, path)
+        # Write to a temp file and rename so a running API never loads a half-written pickle
+        tmp_path = f"{path}.tmp"
+        joblib.dump(self.model, tmp_path)
+        os.replace(tmp_path, path)
         print(f"✓ Anomaly model saved to {path}")
 
     @classmethod
     def load(cls, path='models/anomaly_model.pkl'):
-        """Load trained model"""
-        if not os.path.exists(path):
+        """Load trained model from a path or an open binary file"""
+        if isinstance(path, str) and not os.path.exists(path):
             raise FileNotFoundError(f"Model not found at {path}. Train first!")
         instance = cls()
         instance.model = joblib.load(path)
         instance.is_trained = True
-        print(f"✓ Anomaly model loaded from {path}")
+        print(f"✓ Anomaly model loaded from {getattr(path, 'name', path)}")
         return instance
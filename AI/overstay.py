@@ -0,0 +1,272 @@
+"""
+Server-side overstay monitor.
+Every occupied room is indexed in a priority queue keyed by the moment its
+session crosses the next overstay threshold. The monitor sleeps until the
+earliest threshold (or until the room change feed reports an assign or release),
+pops everything that is due at once and hands it to the alerts pipeline as one
+batch, so nothing has to poll rooms one by one.
+"""
+import heapq
+import itertools
+import threading
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+
+from logs import get_logger
+
+log = get_logger("OverstayMonitor")
+
+# (multiple of the predicted duration, severity); each tier fires once per session
+DEFAULT_TIERS = ((1.5, "medium"), (2.0, "high"), (3.0, "critical"))
+
+
+def parse_tiers(spec: str) -> tuple:
+    """'1.5:medium,2:high' -> ((1.5, 'medium'), (2.0, 'high')), sorted by factor."""
+    tiers = []
+    for part in spec.split(","):
+        factor, _, severity = part.strip().partition(":")
+        if severity not in ("low", "medium", "high", "critical"):
+            raise ValueError(f"Invalid overstay tier '{part}' (expected factor:low|medium|high|critical)")
+        tiers.append((float(factor), severity))
+    return tuple(sorted(tiers))
+
+
+class OverstayMonitor(threading.Thread):
+    """
+    Follows the room change feed: an occupied room schedules its session's first
+    threshold, a release drops it. Cancelled entries are left in the heap and
+    skipped when popped (each session has one generation number), so assign and
+    release stay O(log n) and the monitor only does work when a threshold is due.
+    `emit(alerts)` receives every alert that became due in the same wake-up.
+    Monitors in processes sharing one backend elect a leader through a lease: all
+    of them follow the feed, but only the holder pops and emits alerts, so each
+    alert is raised once. Followers drop thresholds due more than a poll interval
+    ago, which the leader has handled. If it stops renewing, another takes over
+    within `lease_ttl` seconds and raises whatever came due meanwhile; alerts from
+    the leader's last poll interval may be raised twice, but none is lost.
+    """
+    def __init__(self, backend, emit, tiers=DEFAULT_TIERS, min_excess_minutes: float = 5.0,
+                 poll_interval: float = 5.0, clock=datetime.now, max_recent: int = 200,
+                 lease_ttl: float | None = None):
+        super().__init__(name="overstay-monitor", daemon=True)
+        self.backend = backend
+        self.emit = emit
+        self.tiers = tuple(tiers)
+        self.min_excess = min_excess_minutes
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.recent = deque(maxlen=max_recent)
+        self.alerts_emitted = 0
+        self.holder = uuid.uuid4().hex
+        self.lease_ttl = lease_ttl or 3 * poll_interval  # Renewed at least every poll_interval
+        self.is_leader = False
+        self._sessions = {}  # session_id -> (room_id, entry_time, predicted, generation)
+        self._by_room = {}   # room_id -> session_id
+        self._heap = []      # (due_at, generation, session_id, tier)
+        self._generations = itertools.count()
+        self._version = None
+        self._pushes = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+
+    def start(self):
+        # Backends that push wake the monitor on every change; shared ones are polled
+        self._pushes = self.backend.add_change_listener(lambda version: self._wake.set())
+        super().start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+        if self.is_leader:
+            try:
+                self.backend.release_lease("overstay_monitor", self.holder)
+            except Exception as e:
+                log.warning("lease_release_failed", error=e)
+            self.is_leader = False
+
+    def _renew_lease(self) -> bool:
+        try:
+            leader = self.backend.acquire_lease("overstay_monitor", self.holder, self.lease_ttl)
+        except Exception as e:
+            log.warning("lease_failed", error=e)
+            leader = False
+        if leader != self.is_leader:
+            log.info("leader_elected" if leader else "leader_lost", holder=self.holder)
+        self.is_leader = leader
+        return leader
+
+    def threshold(self, entry_time: datetime, predicted: float, tier: int) -> datetime:
+        factor, _ = self.tiers[tier]
+        allowed = max(predicted * factor, predicted + self.min_excess)
+        return entry_time + timedelta(minutes=allowed)
+
+    def track(self, session_id: str, room_id: str, entry_time: datetime, predicted: float | None):
+        """Starts watching a session; re-tracking the same session reschedules it."""
+        with self._lock:
+            self._track(session_id, room_id, entry_time, predicted)
+
+    def untrack(self, session_id: str):
+        with self._lock:
+            self._untrack(session_id)
+
+    def _track(self, session_id, room_id, entry_time, predicted, tier: int = 0):
+        self._untrack(session_id)
+        self._untrack(self._by_room.get(room_id))
+        if entry_time is None or predicted is None:
+            return
+        self._by_room[room_id] = session_id
+        self._sessions[session_id] = (room_id, entry_time, float(predicted), None)
+        self._schedule(session_id, tier)
+
+    def _untrack(self, session_id: str | None):
+        current = self._sessions.pop(session_id, None)
+        if current is not None and self._by_room.get(current[0]) == session_id:
+            del self._by_room[current[0]]
+
+    def _schedule(self, session_id: str, tier: int):
+        """Queues the session's `tier` threshold; a new generation invalidates its older entry."""
+        room_id, entry_time, predicted, _ = self._sessions[session_id]
+        generation = next(self._generations) if tier < len(self.tiers) else None
+        self._sessions[session_id] = (room_id, entry_time, predicted, generation)
+        if generation is not None:
+            heapq.heappush(self._heap, (self.threshold(entry_time, predicted, tier), generation, session_id, tier))
+        if len(self._heap) > 2 * len(self._sessions) + 64:
+            # Mostly cancelled entries: rebuild from the live ones
+            self._heap = [entry for entry in self._heap
+                          if entry[2] in self._sessions and self._sessions[entry[2]][3] == entry[1]]
+            heapq.heapify(self._heap)
+
+    def _resync(self):
+        """Rebuilds the index from the full room status (at start, or after falling behind the feed)."""
+        version, status = self.backend.get_status_versioned()
+        with self._lock:
+            fired = {s: tier for _, generation, s, tier in self._heap
+                     if s in self._sessions and self._sessions[s][3] == generation}
+            fired.update({s: len(self.tiers) for s, (*_, generation) in self._sessions.items()
+                          if generation is None})
+            self._sessions, self._by_room, self._heap = {}, {}, []
+            for room_id, record in status.items():
+                if record["status"] == "occupied" and record["session_id"]:
+                    # Tiers already alerted for a session stay alerted
+                    self._track(record["session_id"], room_id, record["entry_time"], record["predicted_duration"],
+                                fired.get(record["session_id"], 0))
+        self._version = version
+
+    def _follow_feed(self):
+        if self._version is None:  # The first resync failed; nothing is tracked yet
+            self._resync()
+            return
+        version = self.backend.status_version()
+        if version == self._version:
+            return
+        changes = self.backend.changes_since(self._version)
+        if changes is None:
+            self._resync()
+            return
+        with self._lock:
+            for change in changes:
+                if change["status"] == "occupied":
+                    current = self._sessions.get(change["session_id"])
+                    if current is None or current[0] != change["room_id"]:
+                        entry_time = datetime.fromisoformat(change["entry_time"]) if change["entry_time"] else None
+                        self._track(change["session_id"], change["room_id"], entry_time, change["predicted_duration"])
+                else:
+                    self._untrack(self._by_room.get(change["room_id"]))
+                self._version = change["version"]
+
+    def collect_due(self, now: datetime) -> list:
+        """
+        Pops every threshold crossed by `now` and returns the alerts. A session that
+        crossed several tiers since the last wake-up only gets the most severe one.
+        """
+        alerts = {}
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due_at, generation, session_id, tier = heapq.heappop(self._heap)
+                current = self._sessions.get(session_id)
+                if current is None or current[3] != generation:
+                    continue  # Released or rescheduled since it was queued
+                room_id, entry_time, predicted, _ = current
+                elapsed = (now - entry_time).total_seconds() / 60
+                factor, severity = self.tiers[tier]
+                alerts[session_id] = {
+                    "session_id": session_id,
+                    "room_id": room_id,
+                    "severity": severity,
+                    "tier": factor,
+                    "entry_time": entry_time,
+                    "predicted_duration": round(predicted, 2),
+                    "elapsed_minutes": round(elapsed, 2),
+                    "excess_minutes": round(elapsed - predicted, 2),
+                    "threshold_at": due_at,
+                }
+                self._schedule(session_id, tier + 1)
+        return list(alerts.values())
+
+    def next_due(self) -> datetime | None:
+        with self._lock:
+            while self._heap:
+                _, generation, session_id, _ = self._heap[0]
+                current = self._sessions.get(session_id)
+                if current is not None and current[3] == generation:
+                    return self._heap[0][0]
+                heapq.heappop(self._heap)
+            return None
+
+    def run(self):
+        try:
+            self._resync()
+        except Exception as e:
+            print(f"⚠ Overstay monitor could not read room status: {e}")
+        self._renew_lease()
+        while not self._stop_event.is_set():
+            # Until a first resync succeeds, retry on the poll interval even if changes are pushed
+            timeout = None if self._pushes and self._version is not None else self.poll_interval
+            next_due = self.next_due() if self.is_leader else None  # Followers only poll the feed and the lease
+            if next_due is not None:
+                until_due = max(0.0, (next_due - self.clock()).total_seconds())
+                timeout = until_due if timeout is None else min(timeout, until_due)
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._stop_event.is_set():
+                break
+            try:
+                self._follow_feed()
+                now = self.clock()
+                if self._renew_lease():
+                    alerts = self.collect_due(now)
+                else:
+                    # The leader holds a live lease, so it has raised what came due before its last poll
+                    self.collect_due(now - timedelta(seconds=self.poll_interval))
+                    alerts = []
+            except Exception as e:
+                log.warning("update_failed", error=e)
+                continue
+            if alerts:
+                self._emit(alerts)
+
+    def _emit(self, alerts: list):
+        self.recent.extend(alerts)
+        self.alerts_emitted += len(alerts)
+        for alert in alerts:
+            log.info("overstay_alert", room_id=alert['room_id'], session_id=alert['session_id'],
+                     severity=alert['severity'])
+        try:
+            self.emit(alerts)
+        except Exception as e:
+            log.warning("alert_delivery_failed", alerts=len(alerts), error=e)
+
+    def describe(self) -> dict:
+        with self._lock:
+            watched = len(self._sessions)
+        next_due = self.next_due()
+        return {
+            "watched_sessions": watched,
+            "next_threshold_at": next_due.isoformat() if next_due else None,
+            "tiers": [{"factor": factor, "severity": severity} for factor, severity in self.tiers],
+            "min_excess_minutes": self.min_excess,
+            "alerts_emitted": self.alerts_emitted,
+            "leader": self.is_leader,
+        }
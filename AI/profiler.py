@@ -0,0 +1,142 @@
+"""
+On-demand profiling of the live API process.
+StackSampler walks the stack of every thread at a fixed interval and counts
+identical stacks, in the collapsed format read by flamegraph.pl and speedscope
+("thread;outer (file:line);inner (file:line) count"). Nothing runs between
+profiles, and while one runs each sample costs one pass over the thread stacks.
+RequestProfiles runs cProfile on a sampled fraction of requests and aggregates
+the results; with a rate of 0 it costs one comparison per request.
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+# Leaf frames of threads blocked waiting for work; left out unless asked for
+IDLE_FRAMES = {("selectors.py", "select"), ("threading.py", "wait"), ("queue.py", "get"),
+               ("threading.py", "_wait_for_tstate_lock"), ("thread.py", "_worker")}
+
+
+def frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse(frame) -> tuple:
+    """(labels outermost first, leaf (file, function)) for a thread's current frame."""
+    labels = []
+    leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+    while frame is not None:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return labels, leaf
+
+
+def sample_stacks(seconds: float, interval: float, include_idle: bool = False) -> tuple:
+    """Samples every other thread for `seconds`; returns (Counter of collapsed stacks, number of samples)."""
+    me = threading.get_ident()
+    deadline = time.perf_counter() + seconds
+    stacks, samples = Counter(), 0
+    while time.perf_counter() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            labels, leaf = collapse(frame)
+            if not include_idle and leaf in IDLE_FRAMES:
+                continue
+            stacks[";".join([names.get(ident, str(ident))] + labels)] += 1
+        samples += 1
+        time.sleep(interval)
+    return stacks, samples
+
+
+class StackSampler:
+    """Runs one sampling profile at a time on its own thread, so no executor worker is taken."""
+    def __init__(self):
+        self.running = False
+
+    async def profile(self, seconds: float, interval: float, include_idle: bool = False) -> tuple:
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def run():
+            try:
+                result = sample_stacks(seconds, interval, include_idle)
+                loop.call_soon_threadsafe(done.set_result, result)
+            except Exception as e:
+                loop.call_soon_threadsafe(done.set_exception, e)
+
+        self.running = True
+        try:
+            threading.Thread(target=run, name="stack-sampler", daemon=True).start()
+            return await done
+        finally:
+            self.running = False
+
+
+def format_collapsed(stacks: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+class RequestProfiles:
+    """
+    Aggregated cProfile statistics of sampled requests. One request is profiled at
+    a time; cProfile follows the event loop thread, so work of other requests
+    interleaved on the loop is included, and work sent to executor threads
+    (batched model calls, alert writes) is not; the stack sampler sees those.
+    """
+    def __init__(self, rate: float = 0.0):
+        self.rate = rate
+        self.profiled = 0
+        self._stats = None
+        self.active = False
+
+    def should_profile(self) -> bool:
+        return bool(self.rate) and not self.active and random.random() < self.rate
+
+    def add(self, profile: cProfile.Profile):
+        if self._stats is None:
+            self._stats = pstats.Stats(profile)
+        else:
+            self._stats.add(profile)
+        self.profiled += 1
+
+    def reset(self):
+        self._stats = None
+        self.profiled = 0
+
+    def report(self, sort: str = "cumulative", limit: int = 40) -> str:
+        header = f"{self.profiled} request(s) profiled at rate {self.rate:g}\n"
+        if self._stats is None:
+            return header
+        buffer = io.StringIO()
+        self._stats.stream = buffer
+        self._stats.sort_stats(sort).print_stats(limit)
+        return header + buffer.getvalue()
+
+
+class RequestProfilerMiddleware:
+    """ASGI middleware profiling the requests picked by RequestProfiles.should_profile()."""
+    def __init__(self, app, profiles: RequestProfiles):
+        self.app = app
+        self.profiles = profiles
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiles.should_profile():
+            return await self.app(scope, receive, send)
+        self.profiles.active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profile.disable()
+            self.profiles.active = False
+            self.profiles.add(profile)
@@ -0,0 +1,93 @@
+"""
+Conditional remaining-time estimates for sessions in progress.
+The duration predicted at entry says nothing once a customer has overrun it.
+From historical sessions we precompute, per basket size, the mean residual life
+E[D - t | D > t] on a one-minute grid, so "how much longer, given they have been
+in for t minutes" is a table lookup.
+"""
+import json
+
+import numpy as np
+
+MAX_BASKET_BUCKET = 5      # Baskets of 5 or more items share a curve
+MIN_BUCKET_SESSIONS = 30   # Smaller buckets fall back to the curve of all sessions
+MIN_SURVIVORS = 20         # Points estimated from fewer sessions still running are not trusted
+
+
+def basket_bucket(basket_size: int | None) -> int | None:
+    if basket_size is None:
+        return None
+    return max(1, min(int(basket_size), MAX_BASKET_BUCKET))
+
+
+def mean_residual_life(durations, horizon: int) -> tuple:
+    """
+    E[D - t | D > t] for t = 0..horizon minutes, with the number of sessions
+    still running at each t (how much data backs each point).
+    """
+    d = np.sort(np.asarray(durations, dtype=float))
+    suffix = np.concatenate([np.cumsum(d[::-1])[::-1], [0.0]])
+    t = np.arange(horizon + 1, dtype=float)
+    idx = np.searchsorted(d, t, side="right")
+    survivors = len(d) - idx
+    curve = suffix[idx] / np.maximum(survivors, 1) - t
+    return curve, survivors
+
+
+def _holding_tail(curve: np.ndarray, reliable: np.ndarray) -> np.ndarray:
+    """Replaces unreliable points with the last reliable value (constant hazard in the tail)."""
+    positions = np.where(reliable, np.arange(len(curve)), 0)
+    np.maximum.accumulate(positions, out=positions)
+    return curve[positions]
+
+
+class RemainingTimeEstimator:
+    """
+    expected_remaining(elapsed, predicted, basket_size) in O(1).
+    While a session is within its prediction, the prediction (which knows the
+    basket and time of day) is trusted; once it has been overrun, the empirical
+    curve for its basket size takes over.
+    """
+    def __init__(self, durations_by_bucket: dict, horizon: int = 240, min_remaining: float = 1.0):
+        self.horizon = horizon
+        self.min_remaining = min_remaining
+        all_durations = [d for durations in durations_by_bucket.values() for d in durations]
+        if not all_durations:
+            raise ValueError("No historical durations to build remaining-time curves from")
+        curve, survivors = mean_residual_life(all_durations, horizon)
+        self._default = np.maximum(_holding_tail(curve, survivors >= MIN_SURVIVORS), min_remaining)
+        self._curves = {}
+        for bucket, durations in durations_by_bucket.items():
+            if bucket is None or len(durations) < MIN_BUCKET_SESSIONS:
+                continue
+            curve, survivors = mean_residual_life(durations, horizon)
+            self._curves[bucket] = np.maximum(np.where(survivors >= MIN_SURVIVORS, curve, self._default),
+                                              min_remaining)
+        self.sessions = len(all_durations)
+
+    @classmethod
+    def from_sessions(cls, sessions, **kwargs) -> "RemainingTimeEstimator":
+        """Builds the curves from a historical sessions DataFrame (CSV or DB format)."""
+        by_bucket = {}
+        for items, duration in zip(sessions["item_ids"], sessions["duration"]):
+            if isinstance(items, str):
+                items = json.loads(items)
+            if duration is None or not np.isfinite(duration) or duration <= 0:
+                continue
+            by_bucket.setdefault(basket_bucket(len(items)), []).append(float(duration))
+        return cls(by_bucket, **kwargs)
+
+    def expected_remaining(self, elapsed: float, predicted: float | None = None,
+                           basket_size: int | None = None) -> float:
+        if predicted is not None and elapsed < predicted:
+            return predicted - elapsed
+        curve = self._curves.get(basket_bucket(basket_size), self._default)
+        return float(curve[min(max(int(elapsed), 0), self.horizon)])
+
+    def describe(self) -> dict:
+        return {
+            "sessions": self.sessions,
+            "buckets": sorted(self._curves),
+            "remaining_at": {f"{t}min": round(float(self._default[t]), 2) for t in (0, 15, 30, 60, 120)
+                             if t <= self.horizon},
+        }
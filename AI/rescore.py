@@ -0,0 +1,159 @@
+"""
+Re-scores stored sessions with the current anomaly model.
+After a retrain, sessions.is_anomaly / anomaly_score / risk_level still hold the
+verdicts of the model that was serving when each session ended. This job pages
+through completed sessions by id, scores chunks in a process pool and writes
+each chunk back with one bulk UPDATE. Progress is checkpointed after every chunk,
+so an interrupted run resumes where it stopped (for the same model version).
+
+Usage: python rescore.py [--workers 4] [--chunk-size 2000] [--checkpoint rescore_checkpoint.json] [--restart] [--dry-run]
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from logs import get_logger
+from models import DurationPredictor, AnomalyDetector
+from model_registry import ModelRegistry, DURATION_MODEL_PATH, ANOMALY_MODEL_PATH
+from db_integration import (get_db_connection, count_sessions_to_score, load_sessions_to_score,
+                            update_session_scores, load_item_database_from_db)
+
+_models = None  # (duration model, anomaly model, item catalog), per process
+
+
+def _load_models(duration_path: str, anomaly_path: str, item_db: dict):
+    """
+    Loads both models once per process. Workers forked after the parent loaded
+    them inherit them instead and share their pages copy-on-write.
+    """
+    global _models
+    if _models is None:
+        get_logger("AnomalyDetector").set_level("WARNING")  # One forced-anomaly line per chunk is noise here
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            _models = (DurationPredictor.load(duration_path), AnomalyDetector.load(anomaly_path), item_db)
+
+
+def score_chunk(sessions: list) -> list:
+    """(session_id, is_anomaly, anomaly_score, risk_level) for each session, in order."""
+    duration_model, anomaly_model, item_db = _models
+    # Sessions saved without a prediction get one, as in train.py
+    unpredicted = [s for s in sessions if s["predicted_duration"] is None]
+    if unpredicted:
+        X = np.array([DurationPredictor.extract_item_features(s["item_ids"], item_db)
+                      + DurationPredictor.extract_temporal_features(s["entry_time"]) for s in unpredicted])
+        for session, predicted in zip(unpredicted, duration_model.predict_batch(X)):
+            session["predicted_duration"] = float(predicted)
+    results = anomaly_model.predict_with_score_batch(anomaly_model.extract_features_batch(sessions))
+    return [(s["session_id"], r["is_anomaly"], r["anomaly_score"], r["risk_level"])
+            for s, r in zip(sessions, results)]
+
+
+def load_checkpoint(path: str, version: str) -> dict:
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("model_version") == version:
+            return checkpoint
+        print(f"⚠ Checkpoint is for model {checkpoint.get('model_version')}, not {version}; starting over")
+    return {"model_version": version, "last_id": 0, "scored": 0, "anomalies": 0}
+
+
+def save_checkpoint(path: str, checkpoint: dict):
+    # Write to a temp file and rename so an interrupted run never leaves a half-written checkpoint
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def format_eta(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def rescore(workers: int, chunk_size: int, checkpoint_path: str, restart: bool = False, dry_run: bool = False) -> dict:
+    version = ModelRegistry().compute_version()
+    checkpoint = ({"model_version": version, "last_id": 0, "scored": 0, "anomalies": 0} if restart
+                  else load_checkpoint(checkpoint_path, version))
+    remaining = count_sessions_to_score(checkpoint["last_id"])
+    print(f"Re-scoring {remaining} sessions with model {version} using {workers} workers "
+          f"(resuming after id {checkpoint['last_id']}, {checkpoint['scored']} already done)")
+
+    try:
+        item_db = load_item_database_from_db()
+    except Exception as e:
+        print(f"⚠ Could not load items from database ({e}); using data/item_database.json")
+        with open("data/item_database.json", "r") as f:
+            item_db = json.load(f)
+    _load_models(DURATION_MODEL_PATH, ANOMALY_MODEL_PATH, item_db)
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+
+    started, done = time.perf_counter(), 0
+    read_conn, write_conn = get_db_connection(), get_db_connection()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_load_models,
+                                 initargs=(DURATION_MODEL_PATH, ANOMALY_MODEL_PATH, item_db)) as pool:
+            in_flight = deque()  # (future, last id of chunk), in id order
+            after_id, exhausted = checkpoint["last_id"], False
+            while in_flight or not exhausted:
+                # Keep every worker busy with one chunk queued behind it, but never read further ahead
+                while not exhausted and len(in_flight) < workers * 2:
+                    sessions = load_sessions_to_score(after_id, chunk_size, conn=read_conn)
+                    read_conn.rollback()  # End the read transaction; each chunk is its own snapshot
+                    if not sessions:
+                        exhausted = True
+                        break
+                    after_id = sessions[-1]["id"]
+                    in_flight.append((pool.submit(score_chunk, sessions), after_id))
+
+                if not in_flight:
+                    break
+                future, last_id = in_flight.popleft()
+                scores = future.result()
+                if not dry_run:
+                    update_session_scores(scores, conn=write_conn)
+                checkpoint["last_id"] = last_id
+                checkpoint["scored"] += len(scores)
+                checkpoint["anomalies"] += sum(1 for score in scores if score[1])
+                if not dry_run:
+                    save_checkpoint(checkpoint_path, checkpoint)
+
+                done += len(scores)
+                elapsed = time.perf_counter() - started
+                rate = done / elapsed if elapsed > 0 else 0.0
+                eta = format_eta((remaining - done) / rate) if rate else "?"
+                print(f"  [Rescore] {done}/{remaining} sessions ({done / max(remaining, 1):.1%}), "
+                      f"{rate:.0f} sessions/s, ETA {eta}")
+    finally:
+        read_conn.close()
+        write_conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✓ Re-scored {done} sessions in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.0f} sessions/s); "
+          f"{checkpoint['anomalies']} of {checkpoint['scored']} flagged as anomalies"
+          + (" (dry run, nothing written)" if dry_run else ""))
+    return checkpoint
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=2000)
+    parser.add_argument("--checkpoint", default="rescore_checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start from the first session")
+    parser.add_argument("--dry-run", action="store_true", help="Score without writing to the database")
+    args = parser.parse_args()
+    rescore(args.workers, args.chunk_size, args.checkpoint, args.restart, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Fan-out of the room change feed to Server-Sent Events clients.
+One hub per API process reads new changes from the room state backend once and
+hands them to every connected dashboard, so the backend cost does not grow with
+the number of open streams.
+"""
+import asyncio
+import json
+
+from logs import get_logger
+
+log = get_logger("RoomStream")
+
+RESYNC = object()  # Queued for a subscriber that must reload the full status
+
+
+def format_sse(event: str, data, event_id: str | None = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class RoomStreamHub:
+    """
+    Follows the backend's change feed and broadcasts each change to subscriber queues.
+    Backends that push (in-memory) wake the hub immediately; shared backends are
+    polled every `poll_interval` seconds with a single cheap version query.
+    """
+    def __init__(self, backend, poll_interval: float = 0.5, queue_size: int = 256):
+        self.backend = backend
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._wake = None
+        self._task = None
+        self._version = 0
+        self._stopping = False
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._version = self.backend.status_version()
+        # Changes can happen on executor threads, so wake the loop thread-safely
+        self.backend.add_change_listener(lambda version: loop.call_soon_threadsafe(self._wake.set))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Not task.cancel(): on Python < 3.12 wait_for() can swallow a cancellation
+        # that arrives just as the wake event is set, and the loop would never end
+        if self._task:
+            self._stopping = True
+            self._wake.set()
+            await self._task
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping:
+                return
+            self._wake.clear()
+            try:
+                self._publish()
+            except Exception as e:
+                log.warning("update_failed", error=e)
+
+    def _publish(self):
+        version = self.backend.status_version()
+        if version == self._version:
+            return
+        changes = self.backend.changes_since(self._version)
+        self._version = version
+        if not self._subscribers:
+            return
+        for queue in list(self._subscribers):
+            if changes is None:
+                self._send(queue, RESYNC)
+                continue
+            for change in changes:
+                if not self._send(queue, change):
+                    break
+
+    @staticmethod
+    def _send(queue: asyncio.Queue, item) -> bool:
+        """Queues an item; a subscriber too slow to keep up is reset to a full resync."""
+        try:
+            queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC)
+            return False
@@ -0,0 +1,719 @@
+"""
+Fitting room state and assignment for the AI service.
+"""
+import bisect
+import heapq
+import itertools
+import threading
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from batch_assign import plan_joint_assignment
+from logs import get_logger
+
+log = get_logger("RoomManager")
+
+
+class RoomIndex:
+    """
+    Keeps available and occupied rooms in heaps so the best room for a request is
+    found in O(log n) instead of scanning every room.
+
+    Available rooms are ordered by their position in the store layout, occupied rooms
+    by expected release time. Rooms are also grouped by feature profile (e.g.
+    {"accessible"}, {"large_mirror", "store:12"}), each profile with its own pair of
+    heaps, so a request with required features only looks at matching profiles.
+    Stale heap entries are skipped lazily when they reach the top.
+    """
+    def __init__(self):
+        self._order = {}         # room_id -> position, used as the available-heap key
+        self._profile = {}       # room_id -> frozenset of features
+        self._release_at = {}    # room_id -> expected release datetime, None if available
+        self._epoch = {}         # room_id -> state change counter, invalidates old heap entries
+        self._heaps = {}         # profile -> (available heap, occupied heap)
+        self._all = ([], [])     # Same heaps across every profile, for unconstrained requests
+        self._profiles_with = {} # feature -> profiles containing it
+        self._matching = {}      # required features -> matching profiles (cache)
+
+    def __len__(self):
+        return len(self._order)
+
+    def add_room(self, room_id: str, features=()):
+        profile = frozenset(features)
+        self._order[room_id] = len(self._order)
+        self._profile[room_id] = profile
+        self._release_at[room_id] = None
+        self._epoch[room_id] = 0
+        if profile not in self._heaps:
+            self._heaps[profile] = ([], [])
+            for feature in profile:
+                self._profiles_with.setdefault(feature, set()).add(profile)
+            self._matching.clear()
+        self._push(room_id)
+
+    def _push(self, room_id: str):
+        epoch = self._epoch[room_id]
+        release_at = self._release_at[room_id]
+        for available, occupied in (self._heaps[self._profile[room_id]], self._all):
+            if release_at is None:
+                heapq.heappush(available, (self._order[room_id], room_id, epoch))
+            else:
+                heapq.heappush(occupied, (release_at, self._order[room_id], room_id, epoch))
+
+    def _changed(self, room_id: str):
+        self._epoch[room_id] += 1
+        self._push(room_id)
+        if len(self._all[0]) + len(self._all[1]) > 4 * len(self._order) + 64:
+            self._rebuild()
+
+    def _rebuild(self):
+        """Drops accumulated stale entries; amortised O(1) per state change."""
+        self._all = ([], [])
+        for profile in self._heaps:
+            self._heaps[profile] = ([], [])
+        for room_id in self._order:
+            self._push(room_id)
+
+    def mark_occupied(self, room_id: str, release_at: datetime):
+        self._release_at[room_id] = release_at
+        self._changed(room_id)
+
+    def mark_available(self, room_id: str):
+        self._release_at[room_id] = None
+        self._changed(room_id)
+
+    def is_available(self, room_id: str) -> bool:
+        return self._release_at[room_id] is None
+
+    def expected_release(self, room_id: str) -> datetime | None:
+        return self._release_at[room_id]
+
+    def overdue(self, now: datetime) -> str | None:
+        """An occupied room whose expected release has passed, if any (the earliest one)."""
+        top = self._top(self._all[1])
+        if top and top[0] <= now:
+            return top[2]
+        return None
+
+    def features(self, room_id: str) -> frozenset:
+        return self._profile[room_id]
+
+    def position(self, room_id: str) -> int:
+        return self._order[room_id]
+
+    def _top(self, heap: list):
+        """Returns the top live entry of a heap, discarding stale ones."""
+        while heap:
+            entry = heap[0]
+            room_id, epoch = entry[-2], entry[-1]
+            if epoch == self._epoch[room_id]:
+                return entry
+            heapq.heappop(heap)
+        return None
+
+    def matching_profiles(self, required: frozenset) -> frozenset:
+        """Feature profiles that include every required feature."""
+        profiles = self._matching.get(required)
+        if profiles is None:
+            if required:
+                candidates = sorted((self._profiles_with.get(f, set()) for f in required), key=len)
+                profiles = frozenset(set.intersection(*candidates))
+            else:
+                profiles = frozenset(self._heaps)
+            self._matching[required] = profiles
+        return profiles
+
+    def _matching_heaps(self, required: frozenset) -> list:
+        if not required:
+            return [self._all]
+        return [self._heaps[p] for p in self.matching_profiles(required)]
+
+    def _k_smallest_live(self, heap: list, k: int) -> list:
+        """Best-first walk of the heap array: the k smallest live entries in O(k log k)."""
+        result = []
+        frontier = [(heap[0], 0)] if heap else []
+        while frontier and len(result) < k:
+            entry, i = heapq.heappop(frontier)
+            if entry[-1] == self._epoch[entry[-2]]:
+                result.append(entry)
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+        return result
+
+    def first_available(self, required: frozenset, k: int) -> list:
+        """The first k available rooms (in layout order) with all `required` features."""
+        entries = []
+        for available, _ in self._matching_heaps(required):
+            entries.extend(self._k_smallest_live(available, k))
+        return [(e[0], e[1]) for e in heapq.nsmallest(k, entries)]
+
+    def earliest_occupied(self, required: frozenset, k: int) -> list:
+        """The k occupied rooms with all `required` features that are expected to free up first."""
+        entries = []
+        for _, occupied in self._matching_heaps(required):
+            entries.extend(self._k_smallest_live(occupied, k))
+        return [(e[0], e[1], e[2]) for e in heapq.nsmallest(k, entries)]
+
+    def best_room(self, required: frozenset = frozenset()) -> tuple:
+        """
+        Returns (room_id, expected_release) for the room that frees up first among
+        rooms having all `required` features. expected_release is None when the room
+        is available now; room_id is None when no room matches.
+        """
+        best_available = None
+        best_occupied = None
+        for available, occupied in self._matching_heaps(required):
+            top = self._top(available)
+            if top and (best_available is None or top < best_available):
+                best_available = top
+            if best_available is None:
+                top = self._top(occupied)
+                if top and (best_occupied is None or top < best_occupied):
+                    best_occupied = top
+        if best_available:
+            return best_available[1], None
+        if best_occupied:
+            return best_occupied[2], best_occupied[0]
+        return None, None
+
+
+@dataclass
+class WaitlistTicket:
+    """A customer waiting for a room. The session_id doubles as the ticket id."""
+    session_id: str
+    predicted_duration: float
+    required_features: frozenset
+    priority: int
+    seq: int
+    enqueued_at: datetime
+    status: str = "waiting"                  # "waiting", "assigned" or "cancelled"
+    room_id: str | None = None               # Room reserved while waiting, assigned once promoted
+    estimated_start: datetime | None = None
+    assigned_at: datetime | None = None
+    basket_size: int | None = None
+
+    @property
+    def sort_key(self) -> tuple:
+        # Higher priority first, then first come first served
+        return (-self.priority, self.seq)
+
+    def to_dict(self, position: int | None = None, now: datetime | None = None) -> dict:
+        now = now or datetime.now()
+        wait = None
+        if self.status == "assigned":
+            wait = 0.0
+        elif self.status == "waiting" and self.estimated_start:
+            wait = round(max(0.0, (self.estimated_start - now).total_seconds() / 60), 2)
+        return {
+            "session_id": self.session_id,
+            "status": self.status,
+            "priority": self.priority,
+            "required_features": sorted(self.required_features),
+            "waitlist_position": position,
+            "room_id": self.room_id,
+            "estimated_wait_minutes": wait,
+            "predicted_duration_minutes": round(float(self.predicted_duration), 2),
+            "enqueued_at": self.enqueued_at.isoformat(),
+            "assigned_at": self.assigned_at.isoformat() if self.assigned_at else None,
+        }
+
+
+def linked_requirements(required: frozenset, waiting: set, matching_profiles) -> set:
+    """
+    Feature sets among `waiting` that compete, directly or through other waiting
+    tickets, for the rooms matching `required`. Tickets outside this group cannot
+    change its estimates, e.g. a queue for another store.
+    matching_profiles(required) returns the room feature profiles that qualify.
+    """
+    pending = set(waiting) - {required}
+    group = {required}
+    profiles = set(matching_profiles(required))
+    grew = True
+    while grew and pending:
+        grew = False
+        for other in list(pending):
+            other_profiles = matching_profiles(other)
+            if not profiles.isdisjoint(other_profiles):
+                group.add(other)
+                profiles |= other_profiles
+                pending.discard(other)
+                grew = True
+    return group
+
+
+def project_waitlist(tickets: list, earliest_occupied, room_features, now: datetime):
+    """
+    Projects waiting tickets (in queue order) onto the rooms: each takes the matching
+    room that frees up first, which then stays busy for the ticket's predicted
+    duration. Sets each ticket's reserved room_id and estimated_start.
+
+    Only occupied rooms matter (a waiting ticket has no free matching room), and with
+    q tickets waiting only the q earliest-released rooms per feature set can be
+    reached, so the projection never touches the rest of the store.
+    earliest_occupied(required, k) returns [(release_at, position, room_id)].
+    """
+    k = len(tickets)
+    candidates = {}
+    for required in {t.required_features for t in tickets}:
+        for release_at, position, room_id in earliest_occupied(required, k):
+            candidates[room_id] = (release_at, position, room_id)
+    free_at = list(candidates.values())
+    heapq.heapify(free_at)
+    for ticket in tickets:
+        skipped = []
+        slot = None
+        while free_at:
+            candidate = heapq.heappop(free_at)
+            if ticket.required_features <= room_features(candidate[2]):
+                slot = candidate
+                break
+            skipped.append(candidate)
+        for entry in skipped:
+            heapq.heappush(free_at, entry)
+        if slot is None:
+            ticket.room_id, ticket.estimated_start = None, None
+            continue
+        start = max(now, slot[0])
+        ticket.room_id, ticket.estimated_start = slot[2], start
+        heapq.heappush(free_at, (start + timedelta(minutes=ticket.predicted_duration), slot[1], slot[2]))
+
+
+def room_change_event(version: int, room_id: str, record: dict) -> dict:
+    """One entry of the room change feed: the room's full new state, JSON-ready."""
+    entry_time = record.get("entry_time")
+    return {
+        "version": version,
+        "room_id": room_id,
+        "status": record["status"],
+        "session_id": record["session_id"],
+        "entry_time": entry_time.isoformat() if entry_time else None,
+        "predicted_duration": record["predicted_duration"],
+    }
+
+
+class RoomChangeLog:
+    """
+    Versioned feed of room state changes. Every assign or release bumps the version
+    and appends the room's new state; the last `max_entries` changes are kept so
+    clients that fell behind can catch up without refetching every room.
+    The epoch changes on every restart, so versions from a previous run are never
+    mistaken for current ones.
+    """
+    def __init__(self, max_entries: int = 1024):
+        self.epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self._log = deque(maxlen=max_entries)
+        self._listeners = []
+
+    def add_listener(self, callback):
+        """Registers callback(version), called after each change while the state lock is held."""
+        self._listeners.append(callback)
+
+    def record(self, room_id: str, record: dict):
+        self.version += 1
+        self._log.append(room_change_event(self.version, room_id, record))
+        for callback in self._listeners:
+            try:
+                callback(self.version)
+            except Exception as e:
+                log.warning("change_listener_failed", version=self.version, error=e)
+
+    def since(self, version: int) -> list | None:
+        """Changes after `version`, or None if they are no longer (or never were) in the log."""
+        if version > self.version or version < self.version - len(self._log):
+            return None
+        return list(itertools.islice(self._log, len(self._log) - (self.version - version), None))
+
+
+class RoomStateBackend:
+    """
+    Interface of the room state backends. RoomManager keeps the state in process
+    memory; SQLiteRoomManager (shared_rooms.py) keeps it in a SQLite file shared by
+    all API worker processes. Both make assign and release atomic: a room is only
+    taken if it is still available, and only released by the session holding it.
+    """
+    def assign_room_intelligently(self, session_id: str, new_session_duration: float,
+                                  required_features=(), priority: int = 0, basket_size: int | None = None) -> dict:
+        """
+        Seats the session in the best room, or queues it on the waitlist.
+        basket_size selects the remaining-time curve used once the session overruns.
+        """
+        raise NotImplementedError
+
+    def try_assign(self, room_id: str, session_id: str, duration: float) -> bool:
+        """Compare-and-set: occupies room_id only if it is still available."""
+        raise NotImplementedError
+
+    def assign_batch(self, requests: list) -> list:
+        """
+        Assigns several arrivals at once; requests are (session_id, duration,
+        required_features, priority, basket_size) tuples and one result per request is returned.
+        Backends without a joint optimizer fall back to greedy assignment in order.
+        """
+        return [self.assign_room_intelligently(*request) for request in requests]
+
+    def release_room(self, room_id: str, session_id: str | None = None) -> bool:
+        """
+        Frees room_id and promotes the next matching waitlist ticket into it.
+        With session_id, compare-and-set: only releases if that session holds the room.
+        """
+        raise NotImplementedError
+
+    def get_status(self) -> dict:
+        raise NotImplementedError
+
+    # Change feed: `feed_epoch` identifies this run of the feed; versions only grow within it.
+    feed_epoch: str = ""
+
+    def status_version(self) -> int:
+        """Current version of the room change feed. Cheap enough to poll."""
+        raise NotImplementedError
+
+    def get_status_versioned(self) -> tuple:
+        """(version, status) read atomically, so the version describes exactly this status."""
+        raise NotImplementedError
+
+    def changes_since(self, version: int) -> list | None:
+        """Room change events after `version`, or None if the client has to resync."""
+        raise NotImplementedError
+
+    def add_change_listener(self, callback) -> bool:
+        """
+        Registers callback(version) to run on every change made by this process.
+        Returns False if the backend cannot push changes and has to be polled.
+        """
+        return False
+
+    def acquire_lease(self, name: str, holder: str, ttl_seconds: float) -> bool:
+        """
+        Takes or renews the lease `name` for `holder` for ttl_seconds, unless another
+        holder's lease is still valid. Lets one of several processes sharing the
+        state do a job alone. State kept in one process has a single holder.
+        """
+        return True
+
+    def release_lease(self, name: str, holder: str):
+        """Gives the lease up early if `holder` has it, so another process can take over."""
+
+    def get_ticket(self, session_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def cancel_ticket(self, session_id: str) -> dict | None:
+        raise NotImplementedError
+
+    def get_waitlist(self) -> list:
+        raise NotImplementedError
+
+    @staticmethod
+    def _assigned_response(room_id: str) -> dict:
+        return {"assigned_room_id": room_id, "wait_time_minutes": 0.0,
+                "is_immediate": True, "waitlist_position": None}
+
+    @staticmethod
+    def _queued_response(ticket: WaitlistTicket, position: int, now: datetime) -> dict:
+        return {"assigned_room_id": ticket.room_id,
+                "wait_time_minutes": ticket.to_dict(now=now)["estimated_wait_minutes"],
+                "is_immediate": False, "waitlist_position": position}
+
+
+class RoomManager(RoomStateBackend):
+    """
+    Manages the state of fitting rooms with intelligent assignment, in process memory.
+    Customers who cannot get a room right away are queued on a waitlist and promoted
+    automatically when a matching room is released. All state changes happen under
+    one lock, so the manager is safe to call from worker threads.
+    """
+    # Finished (assigned/cancelled) tickets kept around so clients can still poll them
+    MAX_FINISHED_TICKETS = 10000
+
+    def __init__(self, total_rooms: int = 2, rooms: list[dict] | None = None, clock=datetime.now,
+                 remaining_estimator=None):
+        """
+        rooms: optional room layout, e.g. [{"room_id": "room_1", "features": ["accessible"]}].
+        When omitted, `total_rooms` plain rooms room_1..room_n are created.
+        clock: callable returning the current datetime; the simulator injects a virtual one.
+        remaining_estimator: RemainingTimeEstimator used to re-estimate the release time
+        of sessions that overrun their prediction. Without one, an overrunning room
+        keeps counting as "releasing now".
+        """
+        self.clock = clock
+        self.remaining_estimator = remaining_estimator
+        if rooms is None:
+            rooms = [{"room_id": f"room_{i+1}", "features": []} for i in range(total_rooms)]
+        self.total_rooms = len(rooms)
+        self.index = RoomIndex()
+        self.rooms = {}
+        for room in rooms:
+            features = sorted(room.get("features", []))
+            self.index.add_room(room["room_id"], features)
+            self.rooms[room["room_id"]] = self._available_record(features)
+
+        self.waitlist: list[WaitlistTicket] = []   # Waiting tickets, kept sorted by sort_key
+        self.tickets: dict[str, WaitlistTicket] = {}
+        self._finished = OrderedDict()
+        self._ticket_seq = itertools.count()
+        self._lock = threading.RLock()
+        self.changes = RoomChangeLog()
+        self.feed_epoch = self.changes.epoch
+        print(f"✓ RoomManager initialized for {self.total_rooms} rooms.")
+
+    @staticmethod
+    def _available_record(features) -> dict:
+        return {"status": "available", "session_id": None, "entry_time": None,
+                "predicted_duration": None, "basket_size": None, "features": features}
+
+    def _get_expected_release_time(self, room_id: str) -> datetime:
+        """When an occupied room is expected to be free; now if it is available."""
+        return self.index.expected_release(room_id) or self.clock()
+
+    def _occupy(self, room_id: str, session_id: str, duration: float, now: datetime,
+                basket_size: int | None = None):
+        self.rooms[room_id] = {
+            "status": "occupied",
+            "session_id": session_id,
+            "entry_time": now,
+            "predicted_duration": duration,
+            "basket_size": basket_size,
+            "features": self.rooms[room_id]["features"],
+        }
+        self.index.mark_occupied(room_id, now + timedelta(minutes=duration))
+        self.changes.record(room_id, self.rooms[room_id])
+
+    def _rekey_overdue(self, now: datetime):
+        """
+        Moves rooms whose session has overrun its predicted release to now plus the
+        expected remaining time given how long the session has lasted. Only overdue
+        rooms are touched, each at most about once per minute of overrun (the
+        estimator never returns less than its min_remaining).
+        """
+        if self.remaining_estimator is None:
+            return
+        for _ in range(len(self.rooms)):
+            room_id = self.index.overdue(now)
+            if room_id is None:
+                return
+            record = self.rooms[room_id]
+            elapsed = (now - record["entry_time"]).total_seconds() / 60
+            remaining = self.remaining_estimator.expected_remaining(
+                elapsed, record["predicted_duration"], record["basket_size"])
+            self.index.mark_occupied(room_id, now + timedelta(minutes=max(remaining, 1e-3)))
+
+    def try_assign(self, room_id: str, session_id: str, duration: float) -> bool:
+        with self._lock:
+            if room_id not in self.rooms or not self.index.is_available(room_id):
+                return False
+            self._occupy(room_id, session_id, duration, self.clock())
+            return True
+
+    def assign_room_intelligently(self, session_id: str, new_session_duration: float,
+                                  required_features=(), priority: int = 0, basket_size: int | None = None) -> dict:
+        """
+        Assigns a room using a 'Best Fit' strategy to minimize the new session's end time.
+        For a fixed session duration that is the matching room released first, which the
+        index returns directly. If that room is still occupied, the session is put on the
+        waitlist with a reservation against it. Returns {} when no room has all required
+        features.
+        """
+        with self._lock:
+            now = self.clock()
+            self._rekey_overdue(now)
+            required = frozenset(required_features)
+            room_id, expected_release_time = self.index.best_room(required)
+            if room_id is None:
+                return {}
+
+            # Only a free room is assigned; an occupied one that has overrun its prediction
+            # still belongs to its current session.
+            if expected_release_time is None:
+                self._occupy(room_id, session_id, new_session_duration, now, basket_size)
+                log.debug("assigned", room_id=room_id, session_id=session_id)
+                return self._assigned_response(room_id)
+
+            ticket = WaitlistTicket(
+                session_id=session_id,
+                predicted_duration=new_session_duration,
+                required_features=required,
+                priority=priority,
+                seq=next(self._ticket_seq),
+                enqueued_at=now,
+                basket_size=basket_size,
+            )
+            bisect.insort(self.waitlist, ticket, key=lambda t: t.sort_key)
+            self.tickets[session_id] = ticket
+            self._refresh_estimates(now, required)
+            position = self.waitlist.index(ticket) + 1
+            log.debug("queued", session_id=session_id, position=position, reserved_room_id=ticket.room_id)
+            return self._queued_response(ticket, position, now)
+
+    def assign_batch(self, requests: list) -> list:
+        """
+        Jointly assigns a batch of arrivals to minimise their total wait (see
+        batch_assign.py). Rooms promised to tickets already waiting are planned
+        around, and priorities are honoured: higher levels are planned first.
+        Arrivals planned to start now are seated; the rest join the waitlist in
+        planned start order, so promotion on release follows the plan.
+        """
+        if len(requests) <= 1:
+            return super().assign_batch(requests)
+        with self._lock:
+            now = self.clock()
+            self._rekey_overdue(now)
+            requests = [tuple(request) + (None,) * (5 - len(request)) for request in requests]
+            results = [{} for _ in requests]
+            required_sets = {frozenset(request[2]) for request in requests}
+            k = len(requests) + len(self.waitlist)
+            free_at = {}
+            for required in required_sets:
+                for _, room_id in self.index.first_available(required, k):
+                    free_at[room_id] = now
+                for release_at, _, room_id in self.index.earliest_occupied(required, k):
+                    free_at[room_id] = release_at
+            self._refresh_estimates(now)
+            for ticket in self.waitlist:
+                if ticket.room_id in free_at and ticket.estimated_start:
+                    busy_until = ticket.estimated_start + timedelta(minutes=ticket.predicted_duration)
+                    free_at[ticket.room_id] = max(free_at[ticket.room_id], busy_until)
+
+            planned = []  # (-priority, planned start, request index, room_id)
+            for priority in sorted({request[3] for request in requests}, reverse=True):
+                level = [i for i, request in enumerate(requests) if request[3] == priority]
+                rooms = [(room_id, free, self.index.features(room_id)) for room_id, free in free_at.items()]
+                jobs = [(requests[i][1], frozenset(requests[i][2])) for i in level]
+                for i, (room_id, start) in zip(level, plan_joint_assignment(rooms, jobs, now)):
+                    if room_id is None:
+                        continue  # No room has the required features
+                    planned.append((-priority, start, i, room_id))
+                    free_at[room_id] = max(free_at[room_id], start + timedelta(minutes=requests[i][1]))
+
+            queued = []
+            for _, start, i, room_id in sorted(planned):
+                session_id, duration, required, priority, basket_size = requests[i]
+                if start <= now and self.index.is_available(room_id):
+                    self._occupy(room_id, session_id, duration, now, basket_size)
+                    log.debug("assigned", room_id=room_id, session_id=session_id, batched=True)
+                    results[i] = self._assigned_response(room_id)
+                    continue
+                ticket = WaitlistTicket(
+                    session_id=session_id,
+                    predicted_duration=duration,
+                    required_features=frozenset(required),
+                    priority=priority,
+                    seq=next(self._ticket_seq),
+                    enqueued_at=now,
+                    basket_size=basket_size,
+                )
+                bisect.insort(self.waitlist, ticket, key=lambda t: t.sort_key)
+                self.tickets[session_id] = ticket
+                queued.append((i, ticket))
+
+            if queued:
+                self._refresh_estimates(now)
+                positions = {id(t): p + 1 for p, t in enumerate(self.waitlist)}
+                for i, ticket in queued:
+                    results[i] = self._queued_response(ticket, positions[id(ticket)], now)
+                log.debug("batch_assigned", requests=len(requests), seated=len(requests) - len(queued), queued=len(queued))
+            return results
+
+    def release_room(self, room_id: str, session_id: str | None = None) -> bool:
+        with self._lock:
+            if room_id not in self.rooms:
+                log.warning("release_unknown_room", room_id=room_id, session_id=session_id)
+                return False
+            holder = self.rooms[room_id]["session_id"]
+            if session_id is not None and holder != session_id:
+                log.warning("release_not_holder", room_id=room_id, holder=holder, session_id=session_id)
+                return False
+            if self.rooms[room_id]["status"] == "available":
+                log.warning("release_already_available", room_id=room_id, session_id=session_id)
+            else:
+                self.index.mark_available(room_id)
+
+            self.rooms[room_id] = self._available_record(self.rooms[room_id]["features"])
+            self.changes.record(room_id, self.rooms[room_id])
+            log.debug("released", room_id=room_id, session_id=session_id)
+            self._promote(room_id)
+            return True
+
+    def _promote(self, room_id: str):
+        """Hands a just-released room to the first waiting ticket it can serve."""
+        features = self.index.features(room_id)
+        for position, ticket in enumerate(self.waitlist):
+            if ticket.required_features <= features:
+                del self.waitlist[position]
+                now = self.clock()
+                self._occupy(room_id, ticket.session_id, ticket.predicted_duration, now, ticket.basket_size)
+                ticket.status = "assigned"
+                ticket.room_id = room_id
+                ticket.assigned_at = now
+                self._finish(ticket)
+                log.debug("promoted", room_id=room_id, session_id=ticket.session_id)
+                return ticket
+        return None
+
+    def _finish(self, ticket: WaitlistTicket):
+        self._finished[ticket.session_id] = ticket
+        while len(self._finished) > self.MAX_FINISHED_TICKETS:
+            old_id, _ = self._finished.popitem(last=False)
+            self.tickets.pop(old_id, None)
+
+    def _refresh_estimates(self, now: datetime, required: frozenset | None = None):
+        """Re-projects the whole waitlist, or only the tickets linked to `required`."""
+        self._rekey_overdue(now)
+        tickets = self.waitlist
+        if required is not None:
+            group = linked_requirements(required, {t.required_features for t in self.waitlist},
+                                        self.index.matching_profiles)
+            tickets = [t for t in self.waitlist if t.required_features in group]
+        project_waitlist(tickets, self.index.earliest_occupied, self.index.features, now)
+
+    def get_ticket(self, session_id: str) -> dict | None:
+        with self._lock:
+            ticket = self.tickets.get(session_id)
+            if ticket is None:
+                return None
+            now = self.clock()
+            if ticket.status == "waiting":
+                self._refresh_estimates(now, ticket.required_features)
+                return ticket.to_dict(position=self.waitlist.index(ticket) + 1, now=now)
+            return ticket.to_dict(now=now)
+
+    def cancel_ticket(self, session_id: str) -> dict | None:
+        """Removes a waiting ticket. Returns None if unknown; finished tickets are returned unchanged."""
+        with self._lock:
+            ticket = self.tickets.get(session_id)
+            if ticket is None or ticket.status != "waiting":
+                return ticket.to_dict(now=self.clock()) if ticket else None
+            self.waitlist.remove(ticket)
+            ticket.status = "cancelled"
+            ticket.room_id = None
+            self._finish(ticket)
+            log.debug("waitlist_cancelled", session_id=session_id)
+            return ticket.to_dict(now=self.clock())
+
+    def get_waitlist(self) -> list:
+        with self._lock:
+            now = self.clock()
+            self._refresh_estimates(now)
+            return [ticket.to_dict(position=i + 1, now=now) for i, ticket in enumerate(self.waitlist)]
+
+    def get_status(self) -> dict:
+        with self._lock:
+            return {room_id: dict(record) for room_id, record in self.rooms.items()}
+
+    def status_version(self) -> int:
+        return self.changes.version
+
+    def get_status_versioned(self) -> tuple:
+        with self._lock:
+            return self.changes.version, self.get_status()
+
+    def changes_since(self, version: int) -> list | None:
+        with self._lock:
+            return self.changes.since(version)
+
+    def add_change_listener(self, callback) -> bool:
+        self.changes.add_listener(callback)
+        return True
@@ -0,0 +1,250 @@
+"""
+Raw RFID read ingestion.
+Readers report every tag they see several times per second, so one garment
+carried into a room produces a burst of identical reads. Reads are mapped to a
+room and zone by reader id, collapsed within a short dedup window, and folded
+into the entry/exit item sets of the session currently holding the room.
+Item sets are bitsets over interned SKU ids (Python ints), so "entered but not
+scanned out" is one AND-NOT over a few machine words. A read at the exit gate
+with such items outstanding raises a missing-item event right away. Only tags
+that are catalog SKUs or already interned (basket items) get an id, so stray
+EPCs never widen the bitsets.
+"""
+import json
+import threading
+from collections import deque
+from datetime import datetime
+
+ZONES = ("entry", "exit", "gate")
+
+
+def bits_to_ids(bits: int) -> list:
+    """Positions of the set bits, lowest first."""
+    ids = []
+    while bits:
+        low = bits & -bits
+        ids.append(low.bit_length() - 1)
+        bits ^= low
+    return ids
+
+
+class SessionScanBits:
+    __slots__ = ("entry", "exit", "alerted")
+
+    def __init__(self):
+        self.entry = 0    # Items read in the entry zone
+        self.exit = 0     # Items read in the exit (scan-out) zone
+        self.alerted = 0  # Missing items already reported
+
+
+class ReaderMap:
+    """
+    reader id -> (room_id, zone). Configured readers come from a JSON object
+    {"reader_id": {"room_id": "room_1", "zone": "entry"}}; other readers are
+    accepted if named "<room_id>:<zone>", e.g. "room_1:exit".
+    """
+    def __init__(self, readers: dict = None):
+        self._readers = {reader: (spec["room_id"], spec["zone"]) for reader, spec in (readers or {}).items()}
+        for reader, (_, zone) in self._readers.items():
+            if zone not in ZONES:
+                raise ValueError(f"Reader {reader} has unknown zone '{zone}' (expected one of {ZONES})")
+
+    @classmethod
+    def from_file(cls, path: str) -> "ReaderMap":
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    def resolve(self, reader: str) -> tuple | None:
+        location = self._readers.get(reader)
+        if location is None:
+            room_id, _, zone = reader.rpartition(":")
+            if not room_id or zone not in ZONES:
+                return None
+            location = self._readers[reader] = (room_id, zone)
+        return location
+
+
+def read_timestamp(value) -> float | None:
+    """Epoch seconds from a number or an ISO 8601 string; None means "now"."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if not isinstance(value, str):
+        raise ValueError(f"'ts' must be epoch seconds or an ISO 8601 string, not {value!r}")
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def parse_read(read) -> tuple:
+    """(reader, tag, ts) of one raw read; raises ValueError if it is malformed."""
+    if not isinstance(read, dict):
+        raise ValueError(f"expected an object, got {type(read).__name__}")
+    reader, tag = read.get("reader"), read.get("tag")
+    if not isinstance(reader, str) or not isinstance(tag, str):
+        raise ValueError("'reader' and 'tag' must be strings")
+    return reader, tag, read_timestamp(read.get("ts"))
+
+
+class ScanIngestor:
+    """
+    Deduplicates raw reads and keeps each session's entry and exit item bitsets.
+    Dedup state is a per-room dict of (zone, item id) -> last accepted read time;
+    entries older than `dedup_window` seconds are swept out at most once per
+    window per room, so the cost per read stays O(1).
+    Which session holds a room is re-read from the room backend only when its
+    change feed version moves. `known_skus` returns the SKUs that may be interned
+    on their first read (the catalog); other tags not interned yet are counted as
+    unknown_tag and dropped.
+    """
+    def __init__(self, backend, interner, readers: ReaderMap = None, dedup_window: float = 2.0,
+                 known_skus=None):
+        self.backend = backend
+        self.interner = interner
+        self.known_skus = known_skus or (lambda: ())
+        self.readers = readers or ReaderMap()
+        self.dedup_window = dedup_window
+        self._seen = {}        # room_id -> {(zone, item_id): last read time}
+        self._swept_at = {}    # room_id -> read time of the last sweep
+        self._occupant = {}    # room_id -> session_id
+        self._occupant_version = None
+        self._scans = {}       # session_id -> SessionScanBits
+        self._lock = threading.Lock()
+        self.counts = {"reads": 0, "accepted": 0, "duplicates": 0, "unknown_reader": 0, "no_session": 0,
+                       "unknown_tag": 0, "rejected": 0, "missing_item_events": 0}
+        self.recent_events = deque(maxlen=200)
+
+    def _refresh_occupants(self):
+        version = self.backend.status_version()
+        if version == self._occupant_version:
+            return
+        status = self.backend.get_status()
+        occupant = {room_id: record["session_id"] for room_id, record in status.items()
+                    if record["status"] == "occupied" and record["session_id"]}
+        for room_id, session_id in self._occupant.items():
+            if occupant.get(room_id) != session_id:
+                # The room changed hands: its reads belong to nobody any more
+                self._seen.pop(room_id, None)
+                self._scans.pop(session_id, None)
+        self._occupant, self._occupant_version = occupant, version
+
+    def ingest(self, reads, now: float = None, rejects: list = None) -> tuple:
+        """
+        reads: iterable of {"tag", "reader", "ts"} dicts, "tag" being the item SKU and
+        "ts" epoch seconds or ISO time (missing means now).
+        The whole batch is parsed before anything is applied: a malformed read raises
+        ValueError and nothing is ingested, unless `rejects` is given, in which case
+        (index in the batch, error) is appended to it and only that read is skipped.
+        Returns (this batch's counts, missing-item events raised by exit gate reads).
+        """
+        now = now if now is not None else datetime.now().timestamp()
+        counts = dict.fromkeys(self.counts, 0)
+        parsed = []
+        for i, read in enumerate(reads):
+            counts["reads"] += 1
+            try:
+                parsed.append(parse_read(read))
+            except ValueError as e:
+                if rejects is None:
+                    raise ValueError(f"read {i}: {e}") from None
+                rejects.append((i, str(e)))
+                counts["rejected"] += 1
+
+        window = self.dedup_window
+        resolve, lookup, intern = self.readers.resolve, self.interner.lookup, self.interner.intern
+        known = self.known_skus()
+        events = []
+        with self._lock:
+            self._refresh_occupants()
+            occupant, seen, scans = self._occupant, self._seen, self._scans
+            for reader, tag, ts in parsed:
+                location = resolve(reader)
+                if location is None:
+                    counts["unknown_reader"] += 1
+                    continue
+                room_id, zone = location
+                session_id = occupant.get(room_id)
+                if session_id is None:
+                    counts["no_session"] += 1
+                    continue
+                item_id = lookup(tag)
+                if item_id is None:
+                    if tag not in known:
+                        counts["unknown_tag"] += 1
+                        continue
+                    item_id = intern(tag)
+                if ts is None:
+                    ts = now
+                key = (zone, item_id)
+                room_seen = seen.get(room_id)
+                if room_seen is None:
+                    room_seen = seen[room_id] = {}
+                last = room_seen.get(key)
+                if last is not None and ts - last < window:
+                    counts["duplicates"] += 1
+                    continue
+                room_seen[key] = ts
+                bits = scans.get(session_id)
+                if bits is None:
+                    bits = scans[session_id] = SessionScanBits()
+                if zone == "entry":
+                    bits.entry |= 1 << key[1]
+                elif zone == "exit":
+                    bits.exit |= 1 << key[1]
+                else:
+                    missing = bits.entry & ~bits.exit
+                    if missing & ~bits.alerted:
+                        bits.alerted |= missing
+                        events.append(self._missing_item_event(session_id, room_id, missing, ts))
+                counts["accepted"] += 1
+                if ts - self._swept_at.get(room_id, 0.0) > window:
+                    self._sweep(room_id, ts)
+            counts["missing_item_events"] = len(events)
+            for name, value in counts.items():
+                self.counts[name] += value
+            self.recent_events.extend(events)
+        return counts, events
+
+    def count_rejected(self, n: int):
+        """Counts reads rejected before they reached ingest(), e.g. NDJSON lines that are not JSON."""
+        with self._lock:
+            self.counts["reads"] += n
+            self.counts["rejected"] += n
+
+    def _missing_item_event(self, session_id: str, room_id: str, missing: int, ts: float) -> dict:
+        return {
+            "session_id": session_id,
+            "room_id": room_id,
+            "missing_items": sorted(self.interner.skus(bits_to_ids(missing))),
+            "detected_at": datetime.fromtimestamp(ts).isoformat(),
+        }
+
+    def _sweep(self, room_id: str, ts: float):
+        cutoff = ts - self.dedup_window
+        room_seen = self._seen[room_id]
+        for key in [key for key, last in room_seen.items() if last < cutoff]:
+            del room_seen[key]
+        self._swept_at[room_id] = ts
+
+    def session_scans(self, session_id: str) -> dict | None:
+        """{"entry": [SKUs], "exit": [SKUs]} seen so far for the session, or None if it has no reads."""
+        with self._lock:
+            bits = self._scans.get(session_id)
+            if bits is None:
+                return None
+            return {"entry": sorted(self.interner.skus(bits_to_ids(bits.entry))),
+                    "exit": sorted(self.interner.skus(bits_to_ids(bits.exit)))}
+
+    def missing_items(self, session_id: str) -> list | None:
+        """SKUs read at entry but not scanned out yet, or None if the session has no reads."""
+        with self._lock:
+            bits = self._scans.get(session_id)
+            if bits is None:
+                return None
+            return sorted(self.interner.skus(bits_to_ids(bits.entry & ~bits.exit)))
+
+    def forget(self, session_id: str):
+        with self._lock:
+            self._scans.pop(session_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counts, "sessions": len(self._scans),
+                    "dedup_entries": sum(len(room_seen) for room_seen in self._seen.values())}
@@ -0,0 +1,108 @@
+"""
+Server-held records of sessions started through /assign_room.
+Keeping what the API already knows (basket, prediction, room, entry time) lets
+/sessions/{id}/complete score a checkout from the exit scans alone, instead of
+the client calling /predict_duration and echoing the prediction back.
+"""
+import threading
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+
+
+class ItemInterner:
+    """Maps SKU strings to small ints and back, so each SKU string is stored once."""
+    def __init__(self):
+        self._ids = {}
+        self._skus = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._skus)
+
+    def intern(self, sku: str) -> int:
+        item_id = self._ids.get(sku)
+        if item_id is None:
+            with self._lock:
+                item_id = self._ids.get(sku)
+                if item_id is None:
+                    item_id = len(self._skus)
+                    self._skus.append(sku)
+                    self._ids[sku] = item_id
+        return item_id
+
+    def intern_all(self, skus) -> array:
+        return array("I", (self.intern(sku) for sku in skus))
+
+    def lookup(self, sku: str) -> int | None:
+        """The SKU's id if it was ever interned, without adding it."""
+        return self._ids.get(sku)
+
+    def sku(self, item_id: int) -> str:
+        return self._skus[item_id]
+
+    def skus(self, item_ids) -> list:
+        return [self._skus[i] for i in item_ids]
+
+
+@dataclass(slots=True)
+class SessionRecord:
+    session_id: str
+    created_at: datetime
+    item_ids: array              # Interned basket SKUs
+    predicted_duration: float
+    room_id: str | None          # Assigned room; None while on the waitlist
+    entry_time: datetime | None  # When the customer got the room
+    model_version: str | None = None
+
+
+class SessionStore:
+    """
+    Bounded map of session_id -> SessionRecord for sessions in progress.
+    The oldest records are dropped beyond `max_sessions`, so sessions that are
+    never completed cannot grow memory without limit.
+    """
+    def __init__(self, interner: ItemInterner = None, max_sessions: int = 50000):
+        self.interner = interner or ItemInterner()
+        self.max_sessions = max_sessions
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def start(self, session_id: str, item_ids, predicted_duration: float, room_id: str | None,
+              entry_time: datetime | None, created_at: datetime, model_version: str | None = None) -> SessionRecord:
+        record = SessionRecord(session_id, created_at, self.interner.intern_all(item_ids),
+                               float(predicted_duration), room_id, entry_time, model_version)
+        with self._lock:
+            self._records[session_id] = record
+            while len(self._records) > self.max_sessions:
+                self._records.popitem(last=False)
+                self.evicted += 1
+        return record
+
+    def get(self, session_id: str) -> SessionRecord | None:
+        return self._records.get(session_id)
+
+    def seat(self, session_id: str, room_id: str, entry_time: datetime):
+        """Records the room a waitlisted session was promoted to."""
+        record = self._records.get(session_id)
+        if record is not None:
+            record.room_id, record.entry_time = room_id, entry_time
+
+    def pop(self, session_id: str) -> SessionRecord | None:
+        with self._lock:
+            return self._records.pop(session_id, None)
+
+    def basket(self, record: SessionRecord) -> list:
+        return self.interner.skus(record.item_ids)
+
+    def stats(self) -> dict:
+        return {
+            "active_sessions": len(self._records),
+            "interned_items": len(self.interner),
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,407 @@
+"""
+Room state shared between API worker processes.
+SQLiteRoomManager keeps rooms and the waitlist in an embedded SQLite file in WAL
+mode, so several uvicorn workers on one host see the same rooms. Every state change
+runs in a BEGIN IMMEDIATE transaction (one writer at a time across processes) and
+takes or frees a room with a conditional UPDATE, so a room can never be handed to
+two sessions.
+"""
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from logs import get_logger
+from rooms import RoomStateBackend, WaitlistTicket, linked_requirements, project_waitlist, room_change_event
+
+log = get_logger("RoomManager")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rooms (
+    room_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    features TEXT NOT NULL,            -- ",feature_a,feature_b," for LIKE matching
+    status TEXT NOT NULL DEFAULT 'available',
+    session_id TEXT,
+    entry_time REAL,
+    predicted_duration REAL,
+    expected_release REAL,
+    basket_size INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_rooms_available ON rooms (status, position);
+CREATE INDEX IF NOT EXISTS idx_rooms_release ON rooms (status, expected_release, position);
+
+CREATE TABLE IF NOT EXISTS waitlist (
+    session_id TEXT PRIMARY KEY,
+    predicted_duration REAL NOT NULL,
+    required_features TEXT NOT NULL,
+    priority INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    enqueued_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'waiting',
+    room_id TEXT,
+    assigned_at REAL,
+    basket_size INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_waitlist_order ON waitlist (status, priority DESC, seq);
+
+-- Versioned feed of room state changes, written in the same transaction as the change
+CREATE TABLE IF NOT EXISTS room_changes (
+    version INTEGER PRIMARY KEY AUTOINCREMENT,
+    room_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    session_id TEXT,
+    entry_time REAL,
+    predicted_duration REAL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+# Columns added after the first release of the schema; created on open if missing
+ADDED_COLUMNS = {"rooms": [("basket_size", "INTEGER")], "waitlist": [("basket_size", "INTEGER")]}
+
+TICKET_COLUMNS = ("session_id, predicted_duration, required_features, priority, seq, enqueued_at, "
+                  "status, room_id, assigned_at, basket_size")
+
+
+def _encode_features(features) -> str:
+    return "," + ",".join(sorted(features)) + "," if features else ","
+
+
+def _decode_features(encoded: str) -> frozenset:
+    return frozenset(f for f in encoded.split(",") if f)
+
+
+def _feature_filter(required) -> tuple:
+    """SQL condition (and params) matching rooms that have every required feature."""
+    clauses, params = [], []
+    for feature in sorted(required):
+        escaped = feature.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        clauses.append("features LIKE ? ESCAPE '\\'")
+        params.append(f"%,{escaped},%")
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+def _dt(value: float | None):
+    return datetime.fromtimestamp(value) if value is not None else None
+
+
+class SQLiteRoomManager(RoomStateBackend):
+    """
+    Same behaviour as RoomManager, with the state in a SQLite database at `path`.
+    Every worker process opens the same file; the first one creates the layout.
+    """
+    MAX_FINISHED_TICKETS = 10000
+    MAX_CHANGE_LOG = 1024
+
+    def __init__(self, path: str, total_rooms: int = 2, rooms: list[dict] | None = None,
+                 busy_timeout_ms: int = 5000, clock=datetime.now, remaining_estimator=None):
+        self.path = path
+        self.clock = clock
+        self.remaining_estimator = remaining_estimator
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        if rooms is None:
+            rooms = [{"room_id": f"room_{i+1}", "features": []} for i in range(total_rooms)]
+
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for name, sql_type in columns:
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}")
+        with self._transaction() as cur:
+            next_position = cur.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM rooms").fetchone()[0]
+            for i, room in enumerate(rooms):
+                cur.execute("INSERT OR IGNORE INTO rooms (room_id, position, features) VALUES (?, ?, ?)",
+                            (room["room_id"], next_position + i, _encode_features(room.get("features", []))))
+            cur.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('feed_epoch', ?)", (uuid.uuid4().hex[:8],))
+            self.feed_epoch = cur.execute("SELECT value FROM meta WHERE key = 'feed_epoch'").fetchone()[0]
+
+        # The layout is fixed once created, so room features are cached per process
+        self._features = {row[0]: _decode_features(row[1])
+                          for row in conn.execute("SELECT room_id, features FROM rooms")}
+        self._profiles = set(self._features.values())
+        self._matching = {}
+        self.total_rooms = len(self._features)
+        print(f"✓ SQLiteRoomManager initialized for {self.total_rooms} rooms at {path}.")
+
+    # --- Connection handling ---
+
+    def _conn(self) -> sqlite3.Connection:
+        """One connection per thread; sqlite3 connections must not be shared across threads."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        return _Transaction(self._conn(), "IMMEDIATE")
+
+    def _read_transaction(self):
+        """Consistent read snapshot; does not block writers under WAL."""
+        return _Transaction(self._conn(), "DEFERRED")
+
+    # --- Layout helpers ---
+
+    def matching_profiles(self, required: frozenset) -> frozenset:
+        profiles = self._matching.get(required)
+        if profiles is None:
+            profiles = frozenset(p for p in self._profiles if required <= p)
+            self._matching[required] = profiles
+        return profiles
+
+    def _earliest_occupied(self, cur, required: frozenset, k: int) -> list:
+        where, params = _feature_filter(required)
+        rows = cur.execute(
+            f"SELECT expected_release, position, room_id FROM rooms WHERE status = 'occupied'{where} "
+            "ORDER BY expected_release, position LIMIT ?", (*params, k)).fetchall()
+        return [(_dt(release), position, room_id) for release, position, room_id in rows]
+
+    @staticmethod
+    def _ticket_from_row(row) -> WaitlistTicket:
+        session_id, duration, required, priority, seq, enqueued_at, status, room_id, assigned_at, basket = row
+        return WaitlistTicket(session_id=session_id, predicted_duration=duration,
+                              required_features=_decode_features(required), priority=priority,
+                              seq=seq, enqueued_at=_dt(enqueued_at), status=status,
+                              room_id=room_id, assigned_at=_dt(assigned_at), basket_size=basket)
+
+    def _waiting(self, cur) -> list:
+        rows = cur.execute(
+            f"SELECT {TICKET_COLUMNS} FROM waitlist WHERE status = 'waiting' "
+            "ORDER BY priority DESC, seq").fetchall()
+        return [self._ticket_from_row(row) for row in rows]
+
+    def _project(self, cur, now: datetime, required: frozenset | None = None) -> list:
+        """Waiting tickets in service order with their projected rooms and start times."""
+        self._rekey_overdue(cur, now)
+        tickets = self._waiting(cur)
+        group_tickets = tickets
+        if required is not None:
+            group = linked_requirements(required, {t.required_features for t in tickets}, self.matching_profiles)
+            group_tickets = [t for t in tickets if t.required_features in group]
+        project_waitlist(group_tickets, lambda req, k: self._earliest_occupied(cur, req, k),
+                         self._features.get, now)
+        return tickets
+
+    def _rekey_overdue(self, cur, now: datetime):
+        """Re-estimates the release of rooms whose session overran its prediction (see RoomManager)."""
+        if self.remaining_estimator is None:
+            return
+        rows = cur.execute("SELECT room_id, entry_time, predicted_duration, basket_size FROM rooms "
+                           "WHERE status = 'occupied' AND expected_release <= ?", (now.timestamp(),)).fetchall()
+        for room_id, entry_time, duration, basket_size in rows:
+            elapsed = (now.timestamp() - entry_time) / 60
+            remaining = self.remaining_estimator.expected_remaining(elapsed, duration, basket_size)
+            cur.execute("UPDATE rooms SET expected_release = ? WHERE room_id = ?",
+                        (now.timestamp() + max(remaining, 1e-3) * 60, room_id))
+
+    def _occupy(self, cur, room_id: str, session_id: str, duration: float, now: datetime,
+                basket_size: int | None = None) -> bool:
+        """Compare-and-set: takes the room only if it is still available."""
+        cur.execute(
+            "UPDATE rooms SET status = 'occupied', session_id = ?, entry_time = ?, predicted_duration = ?, "
+            "expected_release = ?, basket_size = ? WHERE room_id = ? AND status = 'available'",
+            (session_id, now.timestamp(), duration, now.timestamp() + duration * 60, basket_size, room_id))
+        if cur.rowcount != 1:
+            return False
+        self._record_change(cur, room_id, "occupied", session_id, now.timestamp(), duration)
+        return True
+
+    def _record_change(self, cur, room_id, status, session_id=None, entry_time=None, duration=None):
+        cur.execute("INSERT INTO room_changes (room_id, status, session_id, entry_time, predicted_duration) "
+                    "VALUES (?, ?, ?, ?, ?)", (room_id, status, session_id, entry_time, duration))
+        if cur.lastrowid % 256 == 0:
+            cur.execute("DELETE FROM room_changes WHERE version <= ?", (cur.lastrowid - self.MAX_CHANGE_LOG,))
+
+    # --- Backend interface ---
+
+    def try_assign(self, room_id: str, session_id: str, duration: float) -> bool:
+        with self._transaction() as cur:
+            return self._occupy(cur, room_id, session_id, duration, self.clock())
+
+    def assign_room_intelligently(self, session_id: str, new_session_duration: float,
+                                  required_features=(), priority: int = 0, basket_size: int | None = None) -> dict:
+        required = frozenset(required_features)
+        where, params = _feature_filter(required)
+        with self._transaction() as cur:
+            now = self.clock()
+            row = cur.execute(f"SELECT room_id FROM rooms WHERE status = 'available'{where} "
+                              "ORDER BY position LIMIT 1", params).fetchone()
+            if row and self._occupy(cur, row[0], session_id, new_session_duration, now, basket_size):
+                log.debug("assigned", room_id=row[0], session_id=session_id)
+                return self._assigned_response(row[0])
+
+            if not self.matching_profiles(required):
+                return {}
+            seq = cur.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM waitlist").fetchone()[0]
+            cur.execute(
+                "INSERT OR REPLACE INTO waitlist (session_id, predicted_duration, required_features, "
+                "priority, seq, enqueued_at, basket_size) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session_id, new_session_duration, _encode_features(required), priority, seq,
+                 now.timestamp(), basket_size))
+            tickets = self._project(cur, now, required)
+        position, ticket = next((i + 1, t) for i, t in enumerate(tickets) if t.session_id == session_id)
+        log.debug("queued", session_id=session_id, position=position, reserved_room_id=ticket.room_id)
+        return self._queued_response(ticket, position, now)
+
+    def release_room(self, room_id: str, session_id: str | None = None) -> bool:
+        with self._transaction() as cur:
+            row = cur.execute("SELECT status, session_id, features FROM rooms WHERE room_id = ?",
+                              (room_id,)).fetchone()
+            if row is None:
+                log.warning("release_unknown_room", room_id=room_id, session_id=session_id)
+                return False
+            status, holder, features = row
+            if session_id is not None and holder != session_id:
+                log.warning("release_not_holder", room_id=room_id, holder=holder, session_id=session_id)
+                return False
+            if status == "available":
+                log.warning("release_already_available", room_id=room_id, session_id=session_id)
+            cur.execute(
+                "UPDATE rooms SET status = 'available', session_id = NULL, entry_time = NULL, "
+                "predicted_duration = NULL, expected_release = NULL, basket_size = NULL "
+                "WHERE room_id = ? AND session_id IS ?",
+                (room_id, holder))
+            self._record_change(cur, room_id, "available")
+            log.debug("released", room_id=room_id, session_id=session_id)
+            self._promote(cur, room_id, _decode_features(features))
+            return True
+
+    def _promote(self, cur, room_id: str, features: frozenset):
+        """Hands a just-released room to the first waiting ticket it can serve."""
+        for ticket in self._waiting(cur):
+            if ticket.required_features <= features:
+                now = self.clock()
+                self._occupy(cur, room_id, ticket.session_id, ticket.predicted_duration, now, ticket.basket_size)
+                cur.execute("UPDATE waitlist SET status = 'assigned', room_id = ?, assigned_at = ? "
+                            "WHERE session_id = ?", (room_id, now.timestamp(), ticket.session_id))
+                self._prune_finished(cur, ticket.seq)
+                log.debug("promoted", room_id=room_id, session_id=ticket.session_id)
+                return ticket
+        return None
+
+    def _prune_finished(self, cur, seq: int):
+        # Amortised: trim old finished tickets once every 256 sequence numbers
+        if seq % 256 == 0:
+            cur.execute(
+                "DELETE FROM waitlist WHERE status != 'waiting' AND seq < ("
+                "SELECT seq FROM waitlist WHERE status != 'waiting' ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                (self.MAX_FINISHED_TICKETS,))
+
+    def get_ticket(self, session_id: str) -> dict | None:
+        with self._transaction() as cur:
+            row = cur.execute(
+                f"SELECT {TICKET_COLUMNS} FROM waitlist WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            now = self.clock()
+            ticket = self._ticket_from_row(row)
+            if ticket.status != "waiting":
+                return ticket.to_dict(now=now)
+            tickets = self._project(cur, now, ticket.required_features)
+        position, ticket = next((i + 1, t) for i, t in enumerate(tickets) if t.session_id == session_id)
+        return ticket.to_dict(position=position, now=now)
+
+    def cancel_ticket(self, session_id: str) -> dict | None:
+        with self._transaction() as cur:
+            cur.execute("UPDATE waitlist SET status = 'cancelled', room_id = NULL "
+                        "WHERE session_id = ? AND status = 'waiting'", (session_id,))
+            cancelled = cur.rowcount == 1
+            row = cur.execute(
+                f"SELECT {TICKET_COLUMNS} FROM waitlist WHERE session_id = ?", (session_id,)).fetchone()
+        if row is None:
+            return None
+        if cancelled:
+            log.debug("waitlist_cancelled", session_id=session_id)
+        return self._ticket_from_row(row).to_dict(now=self.clock())
+
+    def get_waitlist(self) -> list:
+        with self._transaction() as cur:
+            now = self.clock()
+            tickets = self._project(cur, now)
+        return [ticket.to_dict(position=i + 1, now=now) for i, ticket in enumerate(tickets)]
+
+    def get_status(self) -> dict:
+        return self.get_status_versioned()[1]
+
+    def _read_status(self, cur) -> dict:
+        rows = cur.execute(
+            "SELECT room_id, status, session_id, entry_time, predicted_duration, basket_size "
+            "FROM rooms ORDER BY position")
+        # Same record as RoomManager.get_status()
+        return {
+            room_id: {"status": status, "session_id": session_id, "entry_time": _dt(entry_time),
+                      "predicted_duration": duration, "basket_size": basket_size,
+                      "features": sorted(self._features.get(room_id, ()))}
+            for room_id, status, session_id, entry_time, duration, basket_size in rows
+        }
+
+    @staticmethod
+    def _version(cur) -> int:
+        return cur.execute("SELECT COALESCE(MAX(version), 0) FROM room_changes").fetchone()[0]
+
+    def status_version(self) -> int:
+        return self._version(self._conn().cursor())
+
+    def get_status_versioned(self) -> tuple:
+        with self._read_transaction() as cur:
+            return self._version(cur), self._read_status(cur)
+
+    def changes_since(self, version: int) -> list | None:
+        with self._read_transaction() as cur:
+            current = self._version(cur)
+            oldest = cur.execute("SELECT MIN(version) FROM room_changes").fetchone()[0]
+            if version > current or (version < current and (oldest is None or version < oldest - 1)):
+                return None
+            rows = cur.execute("SELECT version, room_id, status, session_id, entry_time, predicted_duration "
+                               "FROM room_changes WHERE version > ? ORDER BY version", (version,)).fetchall()
+        return [room_change_event(v, room_id, {"status": status, "session_id": session_id,
+                                               "entry_time": _dt(entry_time), "predicted_duration": duration})
+                for v, room_id, status, session_id, entry_time, duration in rows]
+
+    # --- Leases ---
+
+    def acquire_lease(self, name: str, holder: str, ttl_seconds: float) -> bool:
+        """Lease rows live in meta as 'lease:<name>' -> '<holder> <expiry epoch>'; wall clock, shared by all processes."""
+        key, now = f"lease:{name}", time.time()
+        with self._transaction() as cur:
+            row = cur.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+            if row:
+                current, _, expires_at = row[0].rpartition(" ")
+                if current != holder and float(expires_at) > now:
+                    return False
+            cur.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, f"{holder} {now + ttl_seconds}"))
+        return True
+
+    def release_lease(self, name: str, holder: str):
+        with self._transaction() as cur:
+            cur.execute("DELETE FROM meta WHERE key = ? AND substr(value, 1, ?) = ?",
+                        (f"lease:{name}", len(holder) + 1, f"{holder} "))
+
+
+class _Transaction:
+    """
+    BEGIN ... COMMIT, rolled back on error. IMMEDIATE takes the write lock up front,
+    so concurrent writers queue on busy_timeout instead of failing mid-transaction.
+    """
+    def __init__(self, conn: sqlite3.Connection, mode: str):
+        self.conn = conn
+        self.mode = mode
+
+    def __enter__(self):
+        self.conn.execute(f"BEGIN {self.mode}")
+        return self.conn.cursor()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
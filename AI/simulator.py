@@ -0,0 +1,193 @@
+"""
+Discrete-event simulator for capacity planning.
+Replays historical sessions (CSV or database) through the real RoomManager on a
+virtual clock: customers arrive at their historical entry times, get a room or a
+waitlist ticket from the production assignment code, and leave after their real
+duration. Reports waits, room utilisation and turned-away customers per layout.
+
+Usage: python simulator.py [--rooms 2,3,4] [--source csv|db] [--max-wait 30] [--load-factor 1.0]
+"""
+import argparse
+import contextlib
+import heapq
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from models import DurationPredictor
+from remaining_time import RemainingTimeEstimator
+from rooms import RoomManager
+
+ARRIVAL, DEPARTURE = 1, 0  # Departures first at equal times, so a freed room is reusable
+
+
+class SimClock:
+    """Virtual clock handed to RoomManager; the simulator moves it from event to event."""
+    def __init__(self, start: datetime):
+        self.now = start
+
+    def __call__(self) -> datetime:
+        return self.now
+
+
+def load_sessions(source: str = "csv", csv_path: str = "data/historical_sessions.csv") -> pd.DataFrame:
+    if source == "db":
+        from db_integration import load_historical_sessions_from_db
+        sessions = load_historical_sessions_from_db()
+    else:
+        sessions = pd.read_csv(csv_path)
+    sessions["entry_time"] = pd.to_datetime(sessions["entry_time"])
+    sessions["item_ids"] = [json.loads(items) if isinstance(items, str) else list(items)
+                            for items in sessions["item_ids"]]
+    return sessions.sort_values("entry_time").reset_index(drop=True)
+
+
+def predict_durations(sessions: pd.DataFrame, model_path: str = "models/duration_model.pkl",
+                      item_db_path: str = "data/item_database.json") -> np.ndarray:
+    """Duration predictions for every session in one batched model call."""
+    if not os.path.exists(model_path):
+        print(f"⚠ {model_path} not found; using actual durations as predictions")
+        return sessions["duration"].to_numpy(dtype=float)
+    model = DurationPredictor.load(model_path)
+    with open(item_db_path, "r") as f:
+        item_db = json.load(f)
+    X = np.array([
+        DurationPredictor.extract_item_features(items, item_db)
+        + DurationPredictor.extract_temporal_features(entry_time)
+        for items, entry_time in zip(sessions["item_ids"], sessions["entry_time"])
+    ])
+    return model.model.predict(X)
+
+
+def simulate(sessions: pd.DataFrame, predicted: np.ndarray, room_layout: list,
+             max_wait: float | None = None, load_factor: float = 1.0, remaining_estimator=None) -> dict:
+    """
+    Runs one replay. Customers quoted a wait above `max_wait` minutes leave
+    (balk); arrivals no room can serve are rejected.
+    load_factor > 1 compresses the gaps between arrivals to model busier days.
+    """
+    start = sessions["entry_time"].iloc[0].to_pydatetime()
+    offsets = (sessions["entry_time"] - sessions["entry_time"].iloc[0]).dt.total_seconds().to_numpy() / load_factor
+    actual = sessions["duration"].to_numpy(dtype=float)
+
+    clock = SimClock(start)
+    manager = RoomManager(rooms=room_layout, clock=clock, remaining_estimator=remaining_estimator)
+    basket_sizes = [len(items) for items in sessions["item_ids"]]
+    events = [(start + timedelta(seconds=float(offset)), ARRIVAL, i, None) for i, offset in enumerate(offsets)]
+    heapq.heapify(events)
+
+    arrived_at, waits = {}, []
+    quoted, quote_errors = {}, []  # Wait quoted to queued customers vs. what they really waited
+    busy_minutes = {room["room_id"]: 0.0 for room in room_layout}
+    rejected = balked = waiting = max_waiting = 0
+    version = manager.status_version()
+    end = start
+
+    def start_session(session_id: str, room_id: str):
+        i = int(session_id)
+        waits.append((clock.now - arrived_at[session_id]).total_seconds() / 60)
+        if session_id in quoted:
+            quote_errors.append(abs(waits[-1] - quoted.pop(session_id)))
+        busy_minutes[room_id] += actual[i]
+        heapq.heappush(events, (clock.now + timedelta(minutes=float(actual[i])), DEPARTURE, i, room_id))
+
+    while events:
+        clock.now, kind, i, room_id = heapq.heappop(events)
+        session_id = str(i)
+        if kind == DEPARTURE:
+            end = clock.now
+            manager.release_room(room_id, session_id)
+            # Sessions promoted from the waitlist show up in the room change feed
+            for change in manager.changes_since(version) or []:
+                if change["status"] == "occupied" and change["session_id"] != session_id:
+                    waiting -= 1
+                    start_session(change["session_id"], change["room_id"])
+            version = manager.status_version()
+            continue
+
+        arrived_at[session_id] = clock.now
+        result = manager.assign_room_intelligently(session_id, float(predicted[i]), basket_size=basket_sizes[i])
+        version = manager.status_version()
+        if not result:
+            rejected += 1
+        elif result["is_immediate"]:
+            start_session(session_id, result["assigned_room_id"])
+        elif max_wait is not None and (result["wait_time_minutes"] is None
+                                       or result["wait_time_minutes"] > max_wait):
+            manager.cancel_ticket(session_id)
+            balked += 1
+        else:
+            waiting += 1
+            max_waiting = max(max_waiting, waiting)
+            quoted[session_id] = result["wait_time_minutes"] or 0.0
+
+    horizon = max((end - start).total_seconds() / 60, 1e-9)
+    waits = np.array(waits) if waits else np.zeros(1)
+    return {
+        "rooms": len(room_layout),
+        "arrivals": len(sessions),
+        "served": len(arrived_at) - rejected - balked,
+        "rejected": rejected,
+        "balked": balked,
+        "mean_wait": float(waits.mean()),
+        "p50_wait": float(np.percentile(waits, 50)),
+        "p90_wait": float(np.percentile(waits, 90)),
+        "p95_wait": float(np.percentile(waits, 95)),
+        "p99_wait": float(np.percentile(waits, 99)),
+        "waited_share": float((waits > 0).mean()),
+        "max_queue": max_waiting,
+        "quote_error": float(np.mean(quote_errors)) if quote_errors else 0.0,
+        "utilisation": float(sum(busy_minutes.values()) / (horizon * len(room_layout))),
+        "room_utilisation": {room_id: round(busy / horizon, 4) for room_id, busy in busy_minutes.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--source", choices=["csv", "db"], default="csv")
+    parser.add_argument("--csv", default="data/historical_sessions.csv")
+    parser.add_argument("--rooms", default="2,3,4", help="Room counts to compare")
+    parser.add_argument("--room-config", help="JSON room layout (as ROOM_CONFIG); overrides --rooms")
+    parser.add_argument("--max-wait", type=float, default=None, help="Customers quoted a longer wait leave")
+    parser.add_argument("--load-factor", type=float, default=1.0, help="Arrival rate multiplier")
+    parser.add_argument("--actual-as-predicted", action="store_true", help="Skip the model; perfect predictions")
+    parser.add_argument("--no-remaining-estimator", action="store_true",
+                        help="Keep the entry-time release estimate for rooms that overrun")
+    args = parser.parse_args()
+
+    sessions = load_sessions(args.source, args.csv)
+    predicted = (sessions["duration"].to_numpy(dtype=float) if args.actual_as_predicted
+                 else predict_durations(sessions))
+    estimator = None if args.no_remaining_estimator else RemainingTimeEstimator.from_sessions(sessions)
+    if args.room_config:
+        with open(args.room_config, "r") as f:
+            layouts = [json.load(f)]
+    else:
+        layouts = [[{"room_id": f"room_{i+1}", "features": []} for i in range(int(n))]
+                   for n in args.rooms.split(",")]
+
+    span_days = (sessions["entry_time"].iloc[-1] - sessions["entry_time"].iloc[0]).days / args.load_factor
+    print("=" * 108)
+    print(f"FITTING ROOM SIMULATION ({len(sessions)} sessions over {span_days:.0f} days, "
+          f"load x{args.load_factor:g}, max wait {args.max_wait or 'unlimited'})")
+    print("=" * 108)
+    print(f"{'rooms':>5} | {'served':>6} | {'rejected':>8} | {'balked':>6} | {'mean':>6} | {'p50':>6} | "
+          f"{'p90':>6} | {'p95':>6} | {'p99':>6} | {'waited':>6} | {'quote err':>9} | {'util':>5} | {'sim s':>5}")
+    for layout in layouts:
+        started = time.perf_counter()
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            r = simulate(sessions, predicted, layout, args.max_wait, args.load_factor, estimator)
+        elapsed = time.perf_counter() - started
+        print(f"{r['rooms']:>5} | {r['served']:>6} | {r['rejected']:>8} | {r['balked']:>6} | {r['mean_wait']:>6.1f} | "
+              f"{r['p50_wait']:>6.1f} | {r['p90_wait']:>6.1f} | {r['p95_wait']:>6.1f} | {r['p99_wait']:>6.1f} | "
+              f"{r['waited_share']:>6.1%} | {r['quote_error']:>9.1f} | {r['utilisation']:>5.1%} | {elapsed:>5.2f}")
+    print("Waits are in minutes from arrival to entering a room, for customers who were served;")
+    print("quote err is the mean absolute gap between the wait quoted on arrival and the real wait.")
+
+
+if __name__ == "__main__":
+    main()
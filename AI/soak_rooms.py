@@ -0,0 +1,382 @@
+"""
+Concurrency soak test for the room state backends.
+Many client threads (and, with the SQLite backend, several worker processes) act
+as customers for --duration seconds: they assign rooms, hold them briefly and
+release them, wait on the waitlist and sometimes give up on it, and now and then
+replay the release of a session that already left. Afterwards the run is checked for:
+
+  double_occupancy   two sessions holding one room at the same time
+  release_mismatch   the holder's release refused, or a finished session's release accepted
+  waitlist_order     a room handed to a session while an earlier or higher-priority
+                     ticket it could serve was waiting, or a free room seated past the waitlist
+  snapshot           a session in two rooms, an unknown holder, or a waitlist out of
+                     order, from status reads taken during the run
+  leak               rooms still occupied or tickets still waiting once every client left
+  error              an exception raised by the backend (the customer is abandoned)
+
+Clients only record what they saw and when: the interval in which a session
+certainly held its room (from the response saying so to the release call) and
+in which a ticket certainly waited. Checks run on those intervals after the
+run, so the harness takes no lock of its own that could hide a race. The thread
+switch interval is lowered to interleave threads far more often than in the API.
+Exits with status 1 if any violation is found.
+
+Usage: python soak_rooms.py [--backend memory|sqlite] [--threads 32] [--workers 1] [--rooms 8]
+                            [--duration 60] [--hold-ms 5] [--patience-ms 50] [--json soak.json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from bench_rooms import build_layout
+from logs import get_logger
+from rooms import RoomManager
+from shared_rooms import SQLiteRoomManager
+
+MAX_EXAMPLES = 5  # Violations listed per kind in the report
+
+
+def open_backend(args, layout):
+    if args.backend == "sqlite":
+        return SQLiteRoomManager(args.db, rooms=layout)
+    return RoomManager(rooms=layout)
+
+
+def timestamp(iso: str) -> float:
+    return datetime.fromisoformat(iso).timestamp()
+
+
+# --- Clients ---
+
+def new_record() -> dict:
+    return {"holds": [], "seats": [], "tickets": [], "violations": [], "assign_seconds": [], "counts": Counter()}
+
+
+def wait_for_room(manager, session_id: str, args, rng, record) -> tuple:
+    """Polls a queued ticket until it is promoted or patience runs out; (room_id, held_from) or (None, None)."""
+    give_up_at = time.time() + rng.uniform(0, args.patience_ms / 1000)
+    while time.time() < give_up_at:
+        time.sleep(args.poll_ms / 1000)
+        ticket = manager.get_ticket(session_id)
+        if ticket is None:
+            record["violations"].append(("waitlist_order", f"ticket {session_id} disappeared while waiting"))
+            return None, None
+        if ticket["status"] == "assigned":
+            return promoted(ticket, record), time.time()
+
+    cancel_started = time.time()
+    ticket = manager.cancel_ticket(session_id)
+    if ticket["status"] == "assigned":  # Promoted before the cancel got through
+        return promoted(ticket, record), time.time()
+    record["counts"]["cancelled"] += 1
+    record["tickets"].append((session_id, ticket["priority"], tuple(ticket["required_features"]),
+                              timestamp(ticket["enqueued_at"]), cancel_started, None))
+    return None, None
+
+
+def promoted(ticket: dict, record) -> str:
+    record["counts"]["promoted"] += 1
+    record["tickets"].append((ticket["session_id"], ticket["priority"], tuple(ticket["required_features"]),
+                              timestamp(ticket["enqueued_at"]), timestamp(ticket["assigned_at"]), ticket["room_id"]))
+    return ticket["room_id"]
+
+
+def run_client(manager, client_id: str, args, features: list, stop_at: float, seed: int) -> dict:
+    """One customer after another until stop_at; returns what was observed."""
+    rng = random.Random(seed)
+    record = new_record()
+    previous = None  # (room_id, session_id) of the last session, which has released its room
+    n = 0
+    while time.time() < stop_at:
+        session_id = f"soak-{client_id}-{n}"
+        n += 1
+        try:
+            previous = run_customer(manager, session_id, previous, args, features, rng, record) or previous
+        except Exception as e:
+            record["violations"].append(("error", f"{session_id}: {type(e).__name__}: {e}"))
+    return record
+
+
+def run_customer(manager, session_id: str, previous, args, features: list, rng, record) -> tuple | None:
+    """Assigns, holds and releases one session; returns (room_id, session_id) once released."""
+    counts = record["counts"]
+    required = (rng.choice(features),) if features and rng.random() < args.constrained else ()
+    priority = 1 if rng.random() < 0.1 else 0
+
+    called_at = time.time()
+    response = manager.assign_room_intelligently(session_id, rng.uniform(1, 30), required, priority)
+    held_from = time.time()
+    record["assign_seconds"].append(held_from - called_at)
+    if not response:
+        counts["unservable"] += 1
+        return None
+    if response["is_immediate"]:
+        room_id = response["assigned_room_id"]
+        counts["seated"] += 1
+        record["seats"].append((room_id, session_id, called_at, held_from))
+    else:
+        counts["queued"] += 1
+        room_id, held_from = wait_for_room(manager, session_id, args, rng, record)
+        if room_id is None:
+            return None
+
+    time.sleep(rng.uniform(0, args.hold_ms / 1000))
+    if previous and rng.random() < args.stale_rate:
+        counts["stale_releases"] += 1
+        if manager.release_room(*previous):
+            record["violations"].append(
+                ("release_mismatch", f"{previous[1]} released {previous[0]} after it had already left"))
+    released_at = time.time()
+    if not manager.release_room(room_id, session_id):
+        record["violations"].append(("release_mismatch", f"{session_id} could not release {room_id}, which it held"))
+    counts["releases"] += 1
+    record["holds"].append((room_id, session_id, held_from, released_at))
+    return room_id, session_id
+
+
+def run_worker(args, worker: int, layout: list, stop_at: float, manager=None) -> list:
+    """Runs args.threads clients in this process; one record per client."""
+    sys.setswitchinterval(args.switch_interval)
+    get_logger("RoomManager").set_level("ERROR")  # Stale releases are refused with a warning each
+    if manager is None:
+        manager = open_backend(args, layout)
+    features = sorted({f for room in layout for f in room["features"] if not f.startswith("store:")})
+    records = [None] * args.threads
+
+    def client(i):
+        records[i] = run_client(manager, f"{worker}.{i}", args, features, stop_at, args.seed * 1000 + worker * 100 + i)
+
+    threads = [threading.Thread(target=client, args=(i,), name=f"soak-client-{i}") for i in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records
+
+
+# --- Checks ---
+
+def check_snapshot(manager) -> list:
+    """Violations visible in one status read and one waitlist read."""
+    violations = []
+    holders = Counter()
+    for room_id, room in manager.get_status().items():
+        if room["status"] != "occupied":
+            continue
+        holders[room["session_id"]] += 1
+        if not str(room["session_id"]).startswith("soak-"):
+            violations.append(("snapshot", f"{room_id} is held by unknown session {room['session_id']}"))
+    violations.extend(("snapshot", f"{session_id} holds {n} rooms") for session_id, n in holders.items() if n > 1)
+
+    waitlist = manager.get_waitlist()
+    for ahead, behind in zip(waitlist, waitlist[1:]):
+        if (-ahead["priority"], timestamp(ahead["enqueued_at"])) > (-behind["priority"], timestamp(behind["enqueued_at"])):
+            violations.append(("snapshot", f"waitlist has {ahead['session_id']} ahead of {behind['session_id']}"))
+    return violations
+
+
+def monitor(manager, interval: float, stop: threading.Event, violations: list):
+    while not stop.wait(interval):
+        try:
+            violations.extend(check_snapshot(manager))
+        except Exception as e:
+            violations.append(("error", f"snapshot read: {type(e).__name__}: {e}"))
+
+
+def check_occupancy(records: list) -> list:
+    """Two hold intervals of one room must never overlap."""
+    violations = []
+    by_room = defaultdict(list)
+    for record in records:
+        for room_id, session_id, start, end in record["holds"]:
+            by_room[room_id].append((start, end, session_id))
+    for room_id, holds in by_room.items():
+        holds.sort()
+        last_end, last_session = float("-inf"), None
+        for start, end, session_id in holds:
+            if start < last_end:
+                violations.append(("double_occupancy", f"{room_id} held by {session_id} while {last_session} "
+                                                       f"still held it ({(last_end - start) * 1000:.3f} ms overlap)"))
+            if end > last_end:
+                last_end, last_session = end, session_id
+    return violations
+
+
+def check_waitlist_order(records: list, room_features: dict) -> list:
+    """
+    Sweeps the run in time order, keeping the tickets certainly waiting. When a room
+    is promoted to a ticket, no waiting ticket ranked ahead of it may fit that room;
+    when a session is seated straight away, no ticket that fits the room may be
+    waiting for the whole call.
+    """
+    violations = []
+    events = []  # (time, kind, ...); at equal times tickets leave (0) before checks (1) before they join (2)
+    ends = {}
+    for record in records:
+        for session_id, priority, required, enqueued_at, ended_at, room_id in record["tickets"]:
+            ticket = (session_id, priority, frozenset(required), enqueued_at)
+            ends[session_id] = ended_at
+            events.append((enqueued_at, 2, ticket))
+            events.append((ended_at, 0, ticket))
+            if room_id is not None:
+                events.append((ended_at, 1, ticket, room_id, None))
+        for room_id, session_id, called_at, returned_at in record["seats"]:
+            events.append((called_at, 1, (session_id,), room_id, returned_at))
+    events.sort(key=lambda event: event[:2])
+
+    waiting = {}
+    for event in events:
+        ticket = event[2]
+        if event[1] == 2:
+            waiting[ticket[0]] = ticket
+        elif event[1] == 0:
+            waiting.pop(ticket[0], None)
+        else:
+            room_id, returned_at = event[3], event[4]
+            features = room_features[room_id]
+            for other in waiting.values():
+                if not other[2] <= features:
+                    continue
+                if returned_at is None:
+                    if (-other[1], other[3]) < (-ticket[1], ticket[3]):
+                        violations.append(("waitlist_order", f"{room_id} went to {ticket[0]} while {other[0]} "
+                                                             f"(priority {other[1]}) was waiting ahead of it"))
+                elif ends[other[0]] > returned_at:
+                    violations.append(("waitlist_order", f"{ticket[0]} was seated in free {room_id} while "
+                                                         f"{other[0]} was waiting for it"))
+    return violations
+
+
+def check_drained(manager) -> list:
+    """Once every client has left, all rooms are free and nobody is waiting."""
+    violations = [("leak", f"{room_id} still held by {room['session_id']}")
+                  for room_id, room in manager.get_status().items() if room["status"] == "occupied"]
+    violations.extend(("leak", f"ticket {ticket['session_id']} still waiting") for ticket in manager.get_waitlist())
+    return violations
+
+
+# --- Report ---
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+def summarize(args, records: list, violations: list, elapsed: float) -> dict:
+    counts = sum((record["counts"] for record in records), Counter())
+    assign_seconds = [s for record in records for s in record["assign_seconds"]]
+    assignments = counts["seated"] + counts["promoted"]
+    return {
+        "backend": args.backend,
+        "clients": args.threads * args.workers,
+        "workers": args.workers,
+        "rooms": args.rooms,
+        "duration_s": round(elapsed, 1),
+        "assignments": assignments,
+        "assignments_per_s": round(assignments / elapsed, 1),
+        "assign_calls_per_s": round(len(assign_seconds) / elapsed, 1),
+        "assign_p50_ms": round(percentile(assign_seconds, 50) * 1000, 3),
+        "assign_p99_ms": round(percentile(assign_seconds, 99) * 1000, 3),
+        "counts": dict(counts),
+        "violations": dict(Counter(kind for kind, _ in violations)),
+        "examples": {kind: [detail for k, detail in violations if k == kind][:MAX_EXAMPLES]
+                     for kind in dict.fromkeys(kind for kind, _ in violations)},
+    }
+
+
+def print_report(summary: dict):
+    print("=" * 60)
+    print(f"ROOM SOAK TEST ({summary['backend']}, {summary['clients']} clients, "
+          f"{summary['rooms']} rooms, {summary['duration_s']}s)")
+    print("=" * 60)
+    counts = summary["counts"]
+    print(f"Assignments:    {summary['assignments']} ({summary['assignments_per_s']}/s), "
+          f"{counts.get('seated', 0)} seated, {counts.get('promoted', 0)} promoted from the waitlist")
+    print(f"Assign calls:   {summary['assign_calls_per_s']}/s, "
+          f"p50 {summary['assign_p50_ms']} ms, p99 {summary['assign_p99_ms']} ms")
+    print(f"Waitlist:       {counts.get('queued', 0)} queued, {counts.get('cancelled', 0)} gave up")
+    print(f"Releases:       {counts.get('releases', 0)}, plus {counts.get('stale_releases', 0)} replayed stale releases")
+    if not summary["violations"]:
+        print("✓ No violations")
+        return
+    for kind, n in summary["violations"].items():
+        print(f"⚠ {kind}: {n}")
+        for detail in summary["examples"][kind]:
+            print(f"    {detail}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--backend", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--db", default=None, help="SQLite file (default: a new temporary file)")
+    parser.add_argument("--threads", type=int, default=32, help="Client threads per worker process")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes (sqlite backend only)")
+    parser.add_argument("--rooms", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--hold-ms", type=float, default=5.0, help="Longest time a session holds its room")
+    parser.add_argument("--patience-ms", type=float, default=50.0, help="Longest wait before giving up a ticket")
+    parser.add_argument("--poll-ms", type=float, default=1.0)
+    parser.add_argument("--constrained", type=float, default=0.2, help="Share of customers requiring a room feature")
+    parser.add_argument("--stale-rate", type=float, default=0.05, help="Share of sessions replaying a stale release")
+    parser.add_argument("--switch-interval", type=float, default=1e-5, help="sys.setswitchinterval() in seconds")
+    parser.add_argument("--check-interval", type=float, default=0.05, help="Seconds between snapshot checks")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--json", default=None, help="Also write the summary to this file")
+    args = parser.parse_args()
+    if args.workers > 1 and args.backend != "sqlite":
+        parser.error("--workers > 1 needs --backend sqlite; the memory backend lives in one process")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.backend == "sqlite" and args.db is None:
+            args.db = os.path.join(tmp, "soak_rooms.db")
+        layout = build_layout(args.rooms)
+        get_logger("RoomManager").set_level("ERROR")
+        manager = open_backend(args, layout)
+        print(f"Soaking {args.backend} backend for {args.duration:g}s: "
+              f"{args.workers} worker(s) x {args.threads} clients on {args.rooms} rooms")
+
+        violations, stop = [], threading.Event()
+        watcher = threading.Thread(target=monitor, args=(manager, args.check_interval, stop, violations),
+                                   name="soak-monitor", daemon=True)
+        started_at = time.time()
+        stop_at = started_at + args.duration
+        watcher.start()
+        try:
+            if args.workers == 1:
+                records = run_worker(args, 0, layout, stop_at, manager)
+            else:
+                with ProcessPoolExecutor(args.workers) as pool:
+                    futures = [pool.submit(run_worker, args, w, layout, stop_at) for w in range(args.workers)]
+                    records = [record for future in futures for record in future.result()]
+        finally:
+            stop.set()
+            watcher.join()
+        elapsed = time.time() - started_at
+
+        violations.extend(check_drained(manager))
+        violations.extend(v for record in records for v in record["violations"])
+        violations.extend(check_occupancy(records))
+        violations.extend(check_waitlist_order(records, {room["room_id"]: frozenset(room["features"])
+                                                          for room in layout}))
+
+    summary = summarize(args, records, violations, elapsed)
+    print_report(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"✓ Summary written to {args.json}")
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
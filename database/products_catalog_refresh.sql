@@ -0,0 +1,34 @@
+-- Products change tracking for the AI service catalog refresher
+-- Keeps products.updated_at current on every write (the refresher pulls rows past
+-- its updated_at watermark) and publishes changed SKUs on the 'products_changed'
+-- NOTIFY channel. Set CATALOG_NOTIFY_CHANNEL=products_changed in the AI service
+-- environment to refresh on notification instead of waiting for the next poll.
+
+-- Step 1: Touch updated_at on every update
+CREATE OR REPLACE FUNCTION products_touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_touch_updated_at ON products;
+CREATE TRIGGER products_touch_updated_at
+    BEFORE UPDATE ON products
+    FOR EACH ROW EXECUTE FUNCTION products_touch_updated_at();
+
+-- Step 2: Notify listeners after inserts and updates
+CREATE OR REPLACE FUNCTION products_notify_changed() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('products_changed', NEW.sku);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS products_notify_changed ON products;
+CREATE TRIGGER products_notify_changed
+    AFTER INSERT OR UPDATE ON products
+    FOR EACH ROW EXECUTE FUNCTION products_notify_changed();
+
+-- Step 3: Index the watermark column so delta pulls stay cheap
+CREATE INDEX IF NOT EXISTS idx_products_updated_at ON products (updated_at);